@@ -14,7 +14,7 @@ from django.db.models.signals import post_save
 from siteconfig.models import SiteConfig
 from notifications.signals import notify
 
-from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin
+from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin, PrereqEvaluationContext
 from tags.models import TagsModelMixin
 from notifications.models import notify_rank_up
 
@@ -127,11 +127,7 @@ class BadgeManager(models.Manager):
     # this should be generic and placed in the prerequisites app
     # extend models.Model (e.g. PrereqModel) and prereq users should subclass it
     def get_conditions_met(self, user):
-        pk_met_list = [
-            obj.pk for obj in self.get_queryset().get_active()
-            if Prereq.objects.all_conditions_met(obj, user, False)
-            # if not obj.badge_type.manual_only and Prereq.objects.all_conditions_met(obj, user)
-        ]
+        pk_met_list = Prereq.objects.all_conditions_met_pks(self.get_queryset().get_active(), user, no_prereq_means=False)
         return self.filter(pk__in=pk_met_list)
 
     def all_manually_granted(self):
@@ -211,11 +207,34 @@ class Badge(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, models.Model):
     # all models that want to act as a possible prerequisite need to have this method
     # Create a default in the PrereqModel(models.Model) class that uses a default:
     # prereq_met boolean field.  Use that or override the method like this
-    def condition_met_as_prerequisite(self, user, num_required=1):
-        num_approved = BadgeAssertion.objects.all_for_user_badge(user, self, False).count()
-        # print("num_approved: " + str(num_approved) + "/" + str(num_required))
+    def condition_met_as_prerequisite(self, user, num_required=1, context=None):
+        context = context or PrereqEvaluationContext(user)
+        num_approved = context.assertion_count_per_badge().get(self.pk, 0)
         return num_approved >= num_required
 
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        num_assertions = context.assertion_count_per_badge()
+        return {
+            (badge.pk, num_required) for badge, num_required in requirements
+            if num_assertions.get(badge.pk, 0) >= num_required
+        }
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        num_assertions = BadgeAssertion.objects.assertion_count_per_user_badge(users, [badge.pk for badge, _ in requirements])
+        return {
+            user.id: {
+                (badge.pk, num_required) for badge, num_required in requirements
+                if num_assertions.get((user.id, badge.pk), 0) >= num_required
+            }
+            for user in users
+        }
+
 
 class BadgeAssertionQuerySet(models.query.QuerySet):
     def get_user(self, user):
@@ -262,6 +281,23 @@ class BadgeAssertionManager(models.Manager):
         users = users.annotate(assertion_count=Count('badgeassertion', filter=Q(badgeassertion__badge_id=badge.id)))
         return users.exclude(assertion_count=0).order_by('-assertion_count')
 
+    def assertion_count_per_badge(self, user):
+        """
+        :return: a dict of {badge_id: number of assertions} for the user, for all semesters.  Counted the same way as
+        all_for_user_badge(user, badge, False).count(), but for every badge in one query.
+        """
+        qs = self.get_queryset(False).get_user(user).order_by()
+        return dict(qs.values('badge_id').annotate(num_assertions=Count('id')).values_list('badge_id', 'num_assertions'))
+
+    def assertion_count_per_user_badge(self, users, badge_ids):
+        """
+        :return: a dict of {(user_id, badge_id): number of assertions} for the users and badges, for all semesters.
+        The same as assertion_count_per_badge(), but for many users in one query.
+        """
+        qs = self.get_queryset(False).filter(user__in=users, badge_id__in=badge_ids).order_by()
+        qs = qs.values('user_id', 'badge_id').annotate(num_assertions=Count('id'))
+        return {(user_id, badge_id): num for user_id, badge_id, num in qs.values_list('user_id', 'badge_id', 'num_assertions')}
+
     def all_for_user(self, user):
         return self.get_queryset(True).get_user(user)
 
@@ -313,7 +349,9 @@ class BadgeAssertionManager(models.Manager):
             semester_id=active_semester
         )
         new_assertion.save()
-        user.profile.xp_invalidate_cache()  # recalculate user's XP
+        if not transfer and new_assertion.semester_id == SiteConfig.get().active_semester.id:
+            # only XP from this semester's assertions is counted, see calculate_xp()
+            user.profile.xp_add(badge.xp)
         return new_assertion
 
     def check_for_new_assertions(self, user, transfer=False):
@@ -346,6 +384,16 @@ class BadgeAssertionManager(models.Manager):
             xp = 0
         return xp
 
+    def calculate_xp_per_user(self, users):
+        """
+        The same as calculate_xp(), but for many users at once with a single grouped query.
+        :param users: a queryset or list of users
+        :return: a dict of {user_id: xp} for the users that have earned XP from badges this semester
+        """
+        qs = self.get_queryset(True).grant_xp().filter(user__in=users).order_by()
+        qs = qs.values('user_id').annotate(xp=Sum('badge__xp'))
+        return {user_id: xp or 0 for user_id, xp in qs.values_list('user_id', 'xp')}
+
     def calculate_xp_to_date(self, user, date):
         # self.check_for_new_assertions(user)
         qs = self.get_queryset(True).grant_xp().get_user(user)
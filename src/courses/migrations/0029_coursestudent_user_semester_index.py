@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0028_semester_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coursestudent',
+            index=models.Index(fields=['user', 'semester'], name='coursestudent_user_semester'),
+        ),
+    ]
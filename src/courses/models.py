@@ -1,10 +1,15 @@
+import uuid
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -12,33 +17,48 @@ from django.utils import timezone
 import numpy
 from colorful.fields import RGBColorField
 
-from prerequisites.models import IsAPrereqMixin
+from prerequisites.models import IsAPrereqMixin, PrereqEvaluationContext
 from quest_manager.models import QuestSubmission
 from siteconfig.models import SiteConfig
 
 
+MARK_RANGES_VERSION_KEY = 'mark-ranges-version'
+MARK_RANGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def invalidate_mark_ranges():
+    """ Changes the version of all the users' cached mark ranges, see MarkRangeManager.get_range_for_user() """
+    cache.set(MARK_RANGES_VERSION_KEY, uuid.uuid4().hex, None)
+
+
 class MarkRangeManager(models.Manager):
     def get_range(self, mark, courses=None):
-        """ return the MarkRange encompassed by this mark adn the list of courses """
-        self.get_queryset().filter(active=True)
+        """ return the MarkRange encompassed by this mark adn the list of courses (or course ids) """
         day = timezone.localtime(timezone.now()).isoweekday()
-        # ranges for all courses
-        ranges_qs = self.get_queryset().filter(active=True, courses=None, days__contains=str(day))
+        # ranges for all courses, and for these courses
+        courses_filter = Q(courses=None)
         if courses:
-            for course in courses:
-                courses_qs = course.markrange_set.filter(active=True, days__contains=str(day))  # ranges for this course
-                ranges_qs = ranges_qs | courses_qs
+            courses_filter |= Q(courses__in=courses)
+        ranges_qs = self.get_queryset().filter(courses_filter, active=True, days__contains=str(day)).distinct()
 
         ranges_qs = ranges_qs.filter(minimum_mark__lte=mark)  # filter out ranges that are too high
 
         return ranges_qs.last()  # return the highest range that qualifies
 
     def get_range_for_user(self, user):
+        """
+        The range is used to color the navbar on every page, so it's cached for each user and day (ranges can apply to
+        some days of the week only) until their mark changes, or the mark ranges or anyone's courses are changed.
+        """
+        version = cache.get_or_set(MARK_RANGES_VERSION_KEY, lambda: uuid.uuid4().hex, None)
         mark = user.profile.mark_cached
-        student_course_ids = user.profile.current_courses().values_list('course', flat=True)
+        key = f'mark-range-{version}-{user.id}-{timezone.localdate()}-{mark}'
+        return cache.get_or_set(key, lambda: self.calculate_range_for_user(user, mark), MARK_RANGE_CACHE_TIMEOUT)
+
+    def calculate_range_for_user(self, user, mark):
+        student_course_ids = list(user.profile.current_courses().values_list('course', flat=True))
         if student_course_ids:
-            courses = Course.objects.filter(id__in=student_course_ids)
-            return self.get_range(mark, courses)
+            return self.get_range(mark, student_course_ids)
         else:
             return None
 
@@ -79,10 +99,28 @@ class RankQuerySet(models.query.QuerySet):
         return self.filter(xp__gt=xp)
 
 
+RANK_TABLE_CACHE_KEY = 'rank-table'
+
+
 class RankManager(models.Manager):
     def get_queryset(self):
         return RankQuerySet(self.model, using=self._db).order_by('xp')
 
+    def get_rank_table(self):
+        """
+        The current user's rank is shown in the navbar of every page, so instead of querying for it each time
+        all the ranks are cached until one of them is saved or deleted.
+        :return: a tuple of the list of ranks in order of XP, and the list of their XP
+        """
+        table = cache.get(RANK_TABLE_CACHE_KEY)
+        if table is None:
+            ranks = list(self.get_queryset())
+            table = ranks, [rank.xp for rank in ranks]
+            # only cache committed ranks, not those of a transaction that could still be rolled back
+            if not connection.in_atomic_block:
+                cache.set(RANK_TABLE_CACHE_KEY, table, None)
+        return table
+
     def get_rank(self, user_xp=0):
         """Return the next closest Rank with an XP value <= user_xp
         Only allow user_xp values >= 0.  If no Rank is found, then create a Rank at xp=0
@@ -90,14 +128,17 @@ class RankManager(models.Manager):
         if user_xp < 0:
             user_xp = 0
 
-        rank = self.get_queryset().get_ranks_lte(user_xp).last()
-        if not rank:
-            rank = self.create_zero_rank()
-        return rank
+        ranks, xps = self.get_rank_table()
+        index = bisect_right(xps, user_xp)  # the index of the first rank with an XP value > user_xp
+        if index == 0:
+            return self.create_zero_rank()
+        return ranks[index - 1]
 
     def get_next_rank(self, user_xp=0):
         """Return the next closest Rank with an XP value > user_xp"""
-        return self.get_queryset().get_ranks_gt(user_xp).first()
+        ranks, xps = self.get_rank_table()
+        index = bisect_right(xps, user_xp)
+        return ranks[index] if index < len(ranks) else None
 
     def create_zero_rank(self):
         zero_rank = Rank(xp=0, name="None", icon="fa fa-circle-o")
@@ -130,10 +171,27 @@ class Rank(IsAPrereqMixin, models.Model):
         else:
             return SiteConfig.get().get_default_icon_url()
 
-    def condition_met_as_prerequisite(self, user, num_required):
+    def condition_met_as_prerequisite(self, user, num_required, context=None):
         # num_required is not used for this one
-        # profile = Profile.objects.get(user=user)
-        return user.profile.xp_cached >= self.xp
+        context = context or PrereqEvaluationContext(user)
+        return context.xp() >= self.xp
+
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        xp = context.xp()
+        return {(rank.pk, num_required) for rank, num_required in requirements if xp >= rank.xp}
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        xp_by_user = dict(User.objects.filter(pk__in=[user.pk for user in users]).values_list('id', 'profile__xp_cached'))
+        return {
+            user.id: {(rank.pk, num_required) for rank, num_required in requirements if (xp_by_user.get(user.id) or 0) >= rank.xp}
+            for user in users
+        }
 
     def get_map(self):
         from djcytoscape.models import CytoScape
@@ -150,13 +208,27 @@ class Grade(IsAPrereqMixin, models.Model):
     class Meta:
         ordering = ["value"]
 
-    def condition_met_as_prerequisite(self, user, num_required):
+    def condition_met_as_prerequisite(self, user, num_required, context=None):
         # num_required is not used for this one
-        coursestudents = CourseStudent.objects.current_courses(user)
-        if coursestudents.filter(grade_fk__value=self.value):
-            return True
-        else:
-            return False
+        context = context or PrereqEvaluationContext(user)
+        return self.value in context.current_courses_values('grade_fk__value')
+
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        grade_values = context.current_courses_values('grade_fk__value')
+        return {(grade.pk, num_required) for grade, num_required in requirements if grade.value in grade_values}
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        grade_values = CourseStudent.objects.current_courses_values_per_user(users, 'grade_fk__value')
+        return {
+            user.id: {(grade.pk, num_required) for grade, num_required in requirements if grade.value in grade_values[user.id]}
+            for user in users
+        }
 
 
 class SemesterManager(models.Manager):
@@ -319,6 +391,20 @@ class Semester(models.Model):
         # make timezone aware
         return timezone.make_aware(dt, timezone.get_default_timezone())
 
+    def get_datetimes_of_class_days_so_far(self):
+        """ The same as calling get_datetime_by_days_since_start(i) for each class day so far (1 to days_so_far()),
+        but the excluded days are only read once and the dates are calculated together.
+
+        Returns:
+            {list} -- of timezone aware datetimes at the end of each class day
+        """
+        excluded_days = list(self.excluded_days())
+        num_days = self.num_days(True)
+        days = numpy.busday_offset(self.first_day, numpy.arange(num_days), roll='forward', holidays=excluded_days)
+
+        tz = timezone.get_default_timezone()
+        return [timezone.make_aware(datetime.combine(d, datetime.max.time()), tz) for d in days.astype(date)]
+
     def reset_students_xp_cached(self):
 
         from profile_manager.models import Profile
@@ -372,11 +458,29 @@ class Block(IsAPrereqMixin, models.Model):
     def __str__(self):
         return self.name
 
-    def condition_met_as_prerequisite(self, user, num_required=1):
+    def condition_met_as_prerequisite(self, user, num_required=1, context=None):
         """ Returns True if the user has a current course in this block/group.  `num_required` is not used.
         """
         # num_required is not used for this one
-        return CourseStudent.objects.current_courses(user).filter(block=self).exists()
+        context = context or PrereqEvaluationContext(user)
+        return self.pk in context.current_courses_values('block_id')
+
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        block_ids = context.current_courses_values('block_id')
+        return {(block.pk, num_required) for block, num_required in requirements if block.pk in block_ids}
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        block_ids = CourseStudent.objects.current_courses_values_per_user(users, 'block_id')
+        return {
+            user.id: {(block.pk, num_required) for block, num_required in requirements if block.pk in block_ids[user.id]}
+            for user in users
+        }
 
 
 class ExcludedDate(models.Model):
@@ -403,13 +507,27 @@ class Course(IsAPrereqMixin, models.Model):
     class Meta:
         ordering = ["title"]
 
-    def condition_met_as_prerequisite(self, user, num_required):
+    def condition_met_as_prerequisite(self, user, num_required, context=None):
         # num_required is not used for this one
-        coursestudents = CourseStudent.objects.current_courses(user)
-        if coursestudents.filter(course__pk=self.pk):
-            return True
-        else:
-            return False
+        context = context or PrereqEvaluationContext(user)
+        return self.pk in context.current_courses_values('course_id')
+
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        course_ids = context.current_courses_values('course_id')
+        return {(course.pk, num_required) for course, num_required in requirements if course.pk in course_ids}
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        course_ids = CourseStudent.objects.current_courses_values_per_user(users, 'course_id')
+        return {
+            user.id: {(course.pk, num_required) for course, num_required in requirements if course.pk in course_ids[user.id]}
+            for user in users
+        }
 
     @staticmethod
     def autocomplete_search_fields():  # for grapelli prereq selection
@@ -468,6 +586,27 @@ class CourseStudentManager(models.Manager):
                 xp += studentcourse.xp_adjustment
         return xp
 
+    def calculate_xp_per_user(self, users):
+        """
+        The same as calculate_xp(), but for many users at once with a single grouped query.
+        :param users: a queryset or list of users
+        :return: a dict of {user_id: xp} of the adjustments to the users' current courses
+        """
+        qs = self.get_queryset().filter(user__in=users).get_semester(SiteConfig.get().active_semester).order_by()
+        qs = qs.values('user_id').annotate(xp=models.Sum('xp_adjustment'))
+        return dict(qs.values_list('user_id', 'xp'))
+
+    def current_courses_per_user(self, users):
+        """
+        :return: a dict of {user_id: list of CourseStudent} for the users' courses in the active semester, in one query.
+        The lists are in the same order as current_courses(user).
+        """
+        qs = self.get_queryset().filter(user__in=users).get_semester(SiteConfig.get().active_semester).select_related('semester')
+        courses = defaultdict(list)
+        for coursestudent in qs:
+            courses[coursestudent.user_id].append(coursestudent)
+        return courses
+
     def calc_semester_grades(self, semester):
         coursestudents = self.get_queryset().get_semester(semester)
         for coursestudent in coursestudents:
@@ -491,6 +630,17 @@ class CourseStudentManager(models.Manager):
     def current_courses(self, user):
         return self.all_for_user(user).get_semester(SiteConfig.get().active_semester)
 
+    def current_courses_values_per_user(self, users, field):
+        """
+        :return: a dict of {user.id: set of values of the field} for the current courses of each user, in one query
+        e.g. current_courses_values_per_user(users, 'course_id')
+        """
+        values = {user.id: set() for user in users}
+        qs = self.get_queryset().filter(user__in=users).get_semester(SiteConfig.get().active_semester)
+        for user_id, value in qs.values_list('user_id', field):
+            values[user_id].add(value)
+        return values
+
     def all_users_for_active_semester(self, students_only=False):
         """
         :return: queryset of all Users who are enrolled in a course during the active semester (doubles removed)
@@ -533,6 +683,10 @@ class CourseStudent(models.Model):
         )
         verbose_name = "Student Course"
         ordering = ['-semester', 'block']
+        indexes = [
+            # students' current courses, e.g. QuestSubmissionQuerySet.for_teacher_only()
+            models.Index(fields=['user', 'semester'], name='coursestudent_user_semester'),
+        ]
 
     def __str__(self):
         return f"{self.user.get_username()}" \
@@ -545,11 +699,14 @@ class CourseStudent(models.Model):
     # return reverse('courses:detail', kwargs={'pk': self.pk})
 
     # @cached_property
-    def calc_mark(self, xp):
+    def calc_mark(self, xp, fraction_complete=None):
+        """ :param fraction_complete: the semester's fraction_complete(), if already known (e.g. when calculating
+        the marks of many students) """
         if not self.course:  # course may be null if it was deleted.
             return 0
 
-        fraction_complete = self.semester.fraction_complete()
+        if fraction_complete is None:
+            fraction_complete = self.semester.fraction_complete()
         if fraction_complete > 0:
             return xp / fraction_complete * 100 / self.course.xp_for_100_percent
         else:
@@ -570,3 +727,22 @@ def coursestudent_post_save_callback(instance, **kwargs):
     If they make a manual XP adjustment we need to invalidate the user's xp_cache to recalculate xp
     """
     instance.user.profile.xp_invalidate_cache()
+
+
+@receiver(post_save, sender=Rank)
+@receiver(post_delete, sender=Rank)
+def rank_changed_callback(**kwargs):
+    """ See RankManager.get_rank_table().  Cleared again once committed, in case the old ranks were cached meanwhile """
+    cache.delete(RANK_TABLE_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(RANK_TABLE_CACHE_KEY))
+
+
+@receiver(post_save, sender=MarkRange)
+@receiver(post_delete, sender=MarkRange)
+@receiver(m2m_changed, sender=MarkRange.courses.through)
+@receiver(post_save, sender=CourseStudent)
+@receiver(post_delete, sender=CourseStudent)
+def mark_ranges_changed_callback(**kwargs):
+    """ See MarkRangeManager.get_range_for_user().  Changed again once committed, in case old ranges were cached meanwhile """
+    invalidate_mark_ranges()
+    transaction.on_commit(invalidate_mark_ranges)
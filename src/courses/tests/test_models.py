@@ -1,6 +1,8 @@
 from datetime import date, datetime, timedelta
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
 from django.db.models import ProtectedError
@@ -10,7 +12,7 @@ from freezegun import freeze_time
 from unittest.mock import patch
 from model_bakery import baker
 
-from courses.models import Block, Course, CourseStudent, ExcludedDate, MarkRange, Rank, Semester
+from courses.models import RANK_TABLE_CACHE_KEY, Block, Course, CourseStudent, ExcludedDate, MarkRange, Rank, Semester
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -83,6 +85,20 @@ class MarkRangeManagerTest(TenantTestCase):
         with patch.object(user.profile, 'mark_cached', new=40.0):
             self.assertIsNone(MarkRange.objects.get_range_for_user(user))
 
+    def test_get_range_for_user__cached(self):
+        """ The range is cached until the mark ranges change """
+        user = baker.make(User)
+        baker.make(CourseStudent, user=user, semester=SiteConfig.get().active_semester)
+
+        with patch.object(user.profile, 'mark_cached', new=80.0):
+            self.assertEqual(MarkRange.objects.get_range_for_user(user), self.mr_75)
+            with self.assertNumQueries(0):
+                self.assertEqual(MarkRange.objects.get_range_for_user(user), self.mr_75)
+
+            self.mr_75.minimum_mark = 90.0
+            self.mr_75.save()
+            self.assertEqual(MarkRange.objects.get_range_for_user(user), self.mr_50)
+
 
 class BlockModelManagerTest(TenantTestCase):
 
@@ -267,6 +283,18 @@ class SemesterModelTest(TenantTestCase):
         expected = timezone.make_aware(datetime(2019, 9, 9, 23, 59, 59, 999999), timezone.get_default_timezone())
         self.assertEqual(dt, expected)
 
+    @freeze_time('2019-09-15')
+    def test_get_datetimes_of_class_days_so_far(self):
+        """ Same dates as get_datetime_by_days_since_start() for each class day so far """
+        baker.make(ExcludedDate, semester=self.semester, date=date(2019, 9, 10))
+        expected = [self.semester.get_datetime_by_days_since_start(day) for day in range(1, self.semester.days_so_far() + 1)]
+
+        with self.assertNumQueries(2):
+            datetimes = self.semester.get_datetimes_of_class_days_so_far()
+
+        self.assertEqual(datetimes, expected)
+        self.assertEqual(len(datetimes), 9)  # 10 weekdays, less the excluded date
+
     def test_reset_students_xp_cached(self):
         """Students' xp_cached should be set to 0."""
         student = baker.make(User)
@@ -540,6 +568,21 @@ class RankManagerTest(TenantTestCase):
         self.assertEqual(rank_3000, Rank.objects.get_next_rank(2999))
         self.assertEqual(None, Rank.objects.get_next_rank(3000))
 
+    def test_get_rank__cached(self):
+        """ The ranks are cached (once committed) until one of them is saved or deleted """
+        self.addCleanup(cache.delete, RANK_TABLE_CACHE_KEY)
+        with patch.object(connection, 'in_atomic_block', False):
+            Rank.objects.get_rank(0)
+
+        with self.assertNumQueries(0):
+            rank = Rank.objects.get_rank(1500)
+            Rank.objects.get_next_rank(1500)
+
+        rank.xp = 5000
+        rank.save()
+        self.assertEqual(Rank.objects.get_rank(5000), rank)
+        self.assertNotEqual(Rank.objects.get_rank(4999), rank)
+
     def test_get_next_rank__when_deleted(self):
         """Method can handle if ranks were deleted """
         Rank.objects.all().delete()
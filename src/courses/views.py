@@ -1,10 +1,12 @@
 import json
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages.views import SuccessMessageMixin
+from django.core.cache import cache
 from django.shortcuts import Http404, HttpResponse, get_object_or_404, redirect, render, reverse
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
@@ -22,6 +24,7 @@ from siteconfig.models import SiteConfig
 from tags.models import get_user_tags_and_xp, get_quest_submission_by_tag, get_badge_assertion_by_tags
 from djcytoscape.models import CytoScape
 from notifications.models import Notification
+from profile_manager.models import progress_chart_cache_key
 # from .forms import ProfileForm
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 from djcytoscape.views import UpdateMapMessageMixin
@@ -571,60 +574,67 @@ def ajax_progress_chart(request, user_id=0):
         user = get_object_or_404(User, pk=user_id)
 
     if request.method == "POST":
-        sem = SiteConfig.get().active_semester
-
-        # generate a list of dates, from first date of semester to today
-        datelist = []
-        for i in range(1, sem.days_so_far() + 1):
-            # need to ignore weekends and non-class days
-            next_day_of_class = sem.get_datetime_by_days_since_start(i, add_holidays=True)
-            datelist.append(next_day_of_class)
-
-        xp_data = []
-        # generate an list of dictionary data for chart.js:
-        #   x: day into course
-        #   y: XP earned so far
-
-        xp = 0
-        num_courses = user.profile.num_courses()
-        # days_so_far == len(datelist)
-        for day in range(0, sem.days_so_far()):
-            xp = user.profile.xp_to_date(datelist[day]) / num_courses
-            xp_data.append(
-                # day 0-indexed
-                {'x': day + 1, 'y': xp}
-            )
-
-        today = timezone.localtime()
-
-        # SAT and SUN are always excluded by numpy.busday_offset
-        # use today.date() because its a datetime.datetime object and we compare it to a DateField (returns datetime.date)
-        if today.weekday() in [5, 6] or today.date() in sem.excluded_days():  # SAT, SAT or a day specifically excluded
-            # according to a comment inside get_datetime_by_days_since_start:
-            #   "work done on weekend/holidays won't show up till Monday"
-
-            # total_xp <= xp_to_date(today) since the latest xp_data day is the last valid day (usually a friday)
-            # ie. if today is sunday: friday's total xp <= sunday's total xp
-            # (if a submission is removed then will subtract from both friday and sunday xp)
-            total_xp = xp_data[-1]['y']
-            difference = user.profile.xp_to_date(today) - total_xp
-
-            # if true: user has earned xp during the weekend.
-            # add that xp to the last valid date
-            if difference > 0:
-                xp_data[-1]['y'] += difference
-
-        progress_chart = {
-            "days_in_semester": sem.num_days(),
-            "xp_data": xp_data,
-        }
-        json_data = json.dumps(progress_chart)
+        # the chart changes every day, so only use the cached one if it was drawn today
+        cache_key = progress_chart_cache_key(user.id)
+        today = str(timezone.localdate())
+        cached_chart = cache.get(cache_key)
+        if cached_chart and cached_chart['date'] == today:
+            json_data = cached_chart['json_data']
+        else:
+            json_data = get_progress_chart_json(user)
+            cache.set(cache_key, {'date': today, 'json_data': json_data}, settings.PROGRESS_CHART_CACHE_TIMEOUT)
 
         return HttpResponse(json_data, content_type='application/json')
     else:
         raise Http404
 
 
+def get_progress_chart_json(user):
+    """ The data for ajax_progress_chart(), the user's XP on each class day of the semester so far """
+    sem = SiteConfig.get().active_semester
+
+    # generate a list of dates, from first date of semester to today
+    # need to ignore weekends and non-class days
+    datelist = sem.get_datetimes_of_class_days_so_far()
+
+    # generate an list of dictionary data for chart.js:
+    #   x: day into course
+    #   y: XP earned so far
+    today = timezone.localtime()
+    num_courses = user.profile.num_courses()
+    # the last value is today's total, for work done since the last class day (only needed if today isn't a class day,
+    # in which case it's after the last one)
+    xp_to_dates = user.profile.xp_to_dates(datelist + [max([today] + datelist[-1:])])
+    xp_data = [
+        # day 0-indexed
+        {'x': day + 1, 'y': xp / num_courses}
+        for day, xp in enumerate(xp_to_dates[:-1])
+    ]
+
+    # SAT and SUN are always excluded by numpy.busday_offset
+    # use today.date() because its a datetime.datetime object and we compare it to a DateField (returns datetime.date)
+    if today.weekday() in [5, 6] or today.date() in sem.excluded_days():  # SAT, SAT or a day specifically excluded
+        # according to a comment inside get_datetime_by_days_since_start:
+        #   "work done on weekend/holidays won't show up till Monday"
+
+        # total_xp <= xp_to_date(today) since the latest xp_data day is the last valid day (usually a friday)
+        # ie. if today is sunday: friday's total xp <= sunday's total xp
+        # (if a submission is removed then will subtract from both friday and sunday xp)
+        total_xp = xp_data[-1]['y']
+        difference = xp_to_dates[-1] - total_xp
+
+        # if true: user has earned xp during the weekend.
+        # add that xp to the last valid date
+        if difference > 0:
+            xp_data[-1]['y'] += difference
+
+    progress_chart = {
+        "days_in_semester": sem.num_days(),
+        "xp_data": xp_data,
+    }
+    return json.dumps(progress_chart)
+
+
 @method_decorator(xml_http_request_required, name='dispatch')
 class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, LoginRequiredMixin, View):
     _BINS = 10
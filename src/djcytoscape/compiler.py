@@ -0,0 +1,371 @@
+"""
+Builds the elements (nodes and edges) of a quest map in memory.
+
+Walking the graph of reliant objects through the database needs a Prereq query and a generic foreign key fetch for each
+object, and a CytoElement get_or_create for each node and edge.  Instead, PrereqGraph loads every Prereq and the objects
+they restrict once, MapCompiler walks the graph with dicts (including the campaign edge fix-ups), and the resulting
+elements are saved with one bulk_create per level: nodes outside of a campaign, nodes in a campaign, then edges.
+The objects with a node are saved as the map's CytoScapeMembers at the same time.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.urls import reverse
+
+from prerequisites.models import Prereq
+from quest_manager.models import Quest
+
+from .models import CytoElement, CytoScape, CytoScapeMember, TempCampaign
+
+
+class PrereqGraph:
+    """
+    All of the tenant's Prereqs, indexed both ways, and the objects they restrict.
+    Can be shared by several MapCompilers, e.g. when regenerating all maps.
+    """
+
+    def __init__(self):
+        self.reliants = defaultdict(list)  # {(content_type_id, object_id): [(parent content_type_id, parent_object_id), ...]}
+        self.prereqs = defaultdict(list)  # {(parent content_type_id, parent_object_id): [prereq values dict, ...]}
+        self.objects = {}  # {(content_type_id, object_id): object}
+
+        prereqs = Prereq.objects.values(
+            'parent_content_type_id', 'parent_object_id', 'prereq_content_type_id', 'prereq_object_id', 'prereq_invert',
+            'or_prereq_content_type_id', 'or_prereq_object_id', 'or_prereq_invert',
+        ).order_by('id')
+        for prereq in prereqs:
+            parent_key = (prereq['parent_content_type_id'], prereq['parent_object_id'])
+            self.prereqs[parent_key].append(prereq)
+
+            # the same prereqs as Prereq.objects.all_reliant_on(exclude_NOT=True), where NOT is only excluded for the main
+            # prereq object (see PrereqQuerySet.get_all_for_or_prereq_object())
+            reliant_on = set()
+            if not prereq['prereq_invert']:
+                reliant_on.add((prereq['prereq_content_type_id'], prereq['prereq_object_id']))
+            if prereq['or_prereq_object_id'] is not None:
+                reliant_on.add((prereq['or_prereq_content_type_id'], prereq['or_prereq_object_id']))
+            for key in reliant_on:
+                self.reliants[key].append(parent_key)
+
+        self.load_objects(self.prereqs)
+
+    def load_objects(self, keys):
+        """ Fetches the objects with one query per content type """
+        ids_per_content_type = defaultdict(set)
+        for content_type_id, object_id in keys:
+            ids_per_content_type[content_type_id].add(object_id)
+
+        for content_type_id, ids in ids_per_content_type.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            if model is Quest:
+                # including archived quests, the same as the generic foreign keys' base manager
+                qs = Quest.objects.get_queryset(include_archived=True).select_related('campaign').annotate_expired()
+            else:
+                qs = model._base_manager.all()
+            qs = qs.filter(pk__in=ids)
+            for obj in qs:
+                self.objects[(content_type_id, obj.pk)] = obj
+
+    @staticmethod
+    def key(obj):
+        return ContentType.objects.get_for_model(obj).id, obj.pk
+
+    def get_reliant_objects(self, obj):
+        """ The same as obj.get_reliant_objects(exclude_NOT=True, sort=True) """
+        reliant_objects = []
+        for parent_key in self.reliants.get(self.key(obj), ()):
+            parent_obj = self.objects.get(parent_key)
+            if parent_obj is None:
+                continue
+            if hasattr(parent_obj, 'active') and not parent_obj.active:
+                continue
+            reliant_objects.append(parent_obj)
+        return sorted(reliant_objects, key=str)
+
+    def has_complicated_prereqs(self, obj):
+        """ The same as obj.has_or_prereq() or obj.has_inverted_prereq() """
+        for prereq in self.prereqs.get(self.key(obj), ()):
+            if prereq['prereq_invert'] or prereq['or_prereq_invert'] or prereq['or_prereq_object_id'] is not None:
+                return True
+        return False
+
+
+class MapCompiler:
+    """
+    Builds the elements of a CytoScape, starting from its initial object and following everything that relies on it.
+
+    Nodes are kept in self.nodes by key, which plays the part of the lookup fields of the get_or_create calls that used to
+    build the map, so an object reached through several prereqs only gets one node.  Edges are kept in self.edges by their
+    (source key, target key).
+    """
+
+    def __init__(self, scape: CytoScape, prereq_graph: PrereqGraph = None):
+        self.scape = scape
+        self.graph = prereq_graph or PrereqGraph()
+        self.nodes = {}  # {key: unsaved CytoElement}, in the order they were added
+        self.edges = {}  # {(source key, target key): unsaved CytoElement}
+        self.parents = {}  # {node key: campaign node key}
+        self.campaigns = {}  # {campaign node key: TempCampaign}, used to fix the edges of non-sequential campaigns
+        self.campaign_labels = {}  # {campaign id: label}, since each label needs the campaign's XP
+        self.members = set()  # {(content_type_id, object_id)} of the objects and campaigns with a node
+
+    def compile(self):
+        """ Builds the map's elements
+        :return: a tuple of (list of node CytoElements, list of edge CytoElements), not saved yet
+        """
+        initial_object = self.scape.initial_content_object
+
+        # Create the starting node from the initial quest, and a link back to the parent map if there is one
+        first_key = self.add_first_node(initial_object)
+
+        # Add nodes reliant on the first node, this is recursive and will generate all nodes until endpoints reached
+        self.add_reliant_nodes(initial_object, first_key)
+
+        # Add those funky edges for proper display of compound (parent) nodes in cyto dagre layout
+        self.fix_nonsequential_campaign_edges()
+
+        return list(self.nodes.values()), list(self.edges.values())
+
+    def save(self):
+        """ Compiles the map and saves its elements, replacing any existing ones
+        :return: the list of saved elements, in the same order as CytoScape.elements()
+        """
+        nodes, edges = self.compile()
+
+        CytoElement.objects.all_for_scape(self.scape).delete()
+        # campaigns need their ids before the nodes within them can be saved, and all nodes before the edges
+        CytoElement.objects.bulk_create([node for node in nodes if node.data_parent is None])
+        CytoElement.objects.bulk_create([node for node in nodes if node.data_parent is not None])
+        CytoElement.objects.bulk_create(edges)
+
+        CytoScapeMember.objects.filter(scape=self.scape).delete()
+        CytoScapeMember.objects.bulk_create([
+            CytoScapeMember(scape=self.scape, content_type_id=content_type_id, object_id=object_id)
+            for content_type_id, object_id in sorted(self.members)
+        ])
+
+        # nodes then edges, and nodes without a parent first, see CytoElement.Meta.ordering
+        nodes.sort(key=lambda node: (node.data_parent_id is not None, node.data_parent_id or 0, node.id))
+        edges.sort(key=lambda edge: edge.id)
+        return nodes + edges
+
+    # Nodes and edges #########################################
+
+    def add_node(self, key, **fields):
+        """ Adds a node unless there's already one with the same key
+        :return: a tuple of (node, created)
+        """
+        if key in self.nodes:
+            return self.nodes[key], False
+        node = CytoElement(scape=self.scape, group=CytoElement.NODES, **fields)
+        self.nodes[key] = node
+        return node, True
+
+    def add_edge(self, source_key, target_key, **defaults):
+        """ Adds an edge between the two nodes unless there's one already, the defaults are only used for a new edge """
+        if (source_key, target_key) not in self.edges:
+            self.edges[(source_key, target_key)] = CytoElement(
+                scape=self.scape,
+                group=CytoElement.EDGES,
+                data_source=self.nodes[source_key],
+                data_target=self.nodes[target_key],
+                **defaults,
+            )
+
+    def remove_edge(self, source_key, target_key):
+        self.edges.pop((source_key, target_key), None)
+
+    def add_first_node(self, obj):
+        """ Adds the first node from `obj`, then if this map has a parent, an additional node to link back to the parent
+        map.  Returns the first node's key. """
+
+        # the initial node in this map
+        first_key, _ = self.add_object_node(obj, initial_node=True)
+
+        parent_scape = self.scape.parent_scape
+        if parent_scape:
+            # the node to link to the parent map
+            label = f"{parent_scape.name} Quest Map"
+            href = reverse('maps:quest_map', args=[parent_scape.id])
+            parent_key = ('parent-map', label, href)
+            self.add_node(parent_key, label=label, href=href, classes='link parent-map')
+
+            # link them together with an edge
+            self.add_edge(parent_key, first_key)
+
+        return first_key
+
+    def add_object_node(self, obj, initial_node=False):
+        """ Adds the node representing obj, if it hasn't been added already
+        :return: a tuple of (node key, created)
+        """
+        selector_id = CytoElement.generate_selector_id(obj)
+        label = CytoScape.generate_label(obj)
+        key = ('object', selector_id, label)
+        self.members.add(self.graph.key(obj))
+
+        if key in self.nodes:
+            node, created = self.nodes[key], False
+        else:
+            # check for an icon
+            img_url = obj.get_icon_url() if hasattr(obj, 'get_icon_url') else "none"
+            node, created = self.add_node(
+                key,
+                selector_id=selector_id,
+                label=label,
+                id_styles="'background-image': '" + img_url + "'",
+                classes=type(obj).__name__,
+                href=obj.get_absolute_url(),
+                is_transition=getattr(obj, 'map_transition', False),
+            )
+
+        # if this is a transition node (to a new map), format it and link it, see CytoElement.convert_to_transition_node()
+        if not initial_node and self.scape.is_transition_node(node):
+            content_type = ContentType.objects.get_for_model(obj)
+            node.href = reverse('maps:quest_map_interlink', args=[content_type.id, obj.id, self.scape.id])
+            node.classes = "link child-map"
+            node.is_transition = True
+
+        return key, created
+
+    def get_campaign_label(self, campaign):
+        if campaign.id not in self.campaign_labels:
+            self.campaign_labels[campaign.id] = CytoScape.generate_label(campaign)
+        return self.campaign_labels[campaign.id]
+
+    def add_to_campaign(self, obj, target_key, source_key):
+        """
+        Checks if obj is in a campaign, if so, adds the campaign node (parent/compound node) if needed and makes it the
+        parent of the target node.  Also registers the target node and source node with the TempCampaign (for edges later)
+        :param obj: the django object currently being processed, represented by the target node
+        :param target_key: key of the node of the reliant object, obj
+        :param source_key: key of the node representing the target node's prereq
+        :return: a tuple of (campaign, campaign node key, campaign created), or (None, None, False) if obj isn't part of
+        a campaign.  campaign created is False if the campaign node was added by an earlier node
+        """
+        # Currently only Quest objects have a campaign, but obj could be a Badge or other prereq model
+        campaign = getattr(obj, 'campaign', None)
+        if campaign is None:
+            return None, None, False
+
+        label = self.get_campaign_label(campaign)
+        campaign_key = ('campaign', label)
+        self.members.add(self.graph.key(campaign))
+        campaign_node, campaign_created = self.add_node(campaign_key, label=label, classes="campaign")
+
+        # Add a parent (i.e. campaign) to the target node (to form a compound node)
+        self.nodes[target_key].data_parent = campaign_node
+        self.parents[target_key] = campaign_key
+
+        # TempCampaign utility for cleaning up the edges and making the resulting map look good, after the entire map is built
+        if campaign_created:
+            self.campaigns[campaign_key] = TempCampaign(campaign_key)
+        self.campaigns[campaign_key].add_node(target_key, source_key)
+
+        return campaign, campaign_key, campaign_created
+
+    def add_reliant_nodes(self, source_obj, source_key):
+        """ Recursively connect nodes together with edges.  Starts at the top and works down through all objects
+        that rely on the source_obj as a prerequisite.
+
+        source_obj: the current django object being processed (could be any mappable prerequisite, such as a Quest, Badge, or Campaign)
+        source_key: the key of the cytoscape node representing the source_obj
+
+        target nodes are nodes created from reliant objects (objects that rely on the source_obj as a prerequisite)
+        """
+        for obj in self.graph.get_reliant_objects(source_obj):
+            # add or get the node represented by the reliant object
+            target_key, node_created = self.add_object_node(obj)
+            target_node = self.nodes[target_key]
+
+            # if source node is in a compound node (has a parent / campaign), add target node as a reliant in the temp campaign
+            if source_key in self.parents:
+                self.campaigns[self.parents[source_key]].add_reliant(source_key, target_key)
+
+            # if the source node is ITSELF a campaign (parent of a compound node)
+            if source_key in self.campaigns:
+                self.campaigns[source_key].add_campaign_reliant(target_key)
+
+            # add the target node to a campaign/compound/parent, if required
+            campaign, campaign_key, campaign_created = self.add_to_campaign(obj, target_key, source_key)
+
+            # If this is the first time this campaign has been encountered, then check if IT has any reliant objects
+            if campaign_created:
+                self.add_reliant_nodes(campaign, campaign_key)
+
+            # add a class to alternate prerequisites edges so they can be styled differently if desired
+            if self.graph.has_complicated_prereqs(obj):
+                self.add_edge(source_key, target_key, classes='complicated-prereqs')
+            else:
+                self.add_edge(source_key, target_key)
+
+            # If repeatable, also add circular edge
+            max_repeats = getattr(obj, 'max_repeats', 0)
+            if max_repeats != 0:
+                label = '∞' if max_repeats < 0 else 'x' + str(max_repeats)
+                self.add_edge(target_key, target_key, label=label, classes='repeat-edge')
+
+            # recursive, continue adding if this is a new node, and not a closing node
+            if node_created and not self.scape.is_transition_node(target_node):
+                self.add_reliant_nodes(obj, target_key)
+
+    def fix_nonsequential_campaign_edges(self):
+        """
+        cyto dagre layout doesn't support compound/parent nodes, so for non-sequential/non-directed campaigns
+        (i.e. all quests are available concurrently) we need to:
+         1. add invisible edges joining the quests
+         2. remove edges between common prereqs and quests
+         3. add edges between common prereqs and campaign/compound/parent node
+         4. add invisible edge (for structure) from prereqs to first node
+         5. (deprecated) remove edges between quests and common reliants
+         6. (deprecated) add edges between campaign/compound/parent node and common reliants
+         7. (deprecated) add invisible edge (for structure) from last node to common reliants
+         8. add invisible edge (for structure) from last node to campaign reliants
+        """
+        for campaign in self.campaigns.values():
+
+            last_node = campaign.get_last_node()
+
+            common_prereq_ids = campaign.get_common_prereq_node_ids()
+            if common_prereq_ids:  # then non-sequential campaign
+
+                # 1. add invisible edges joining the quests
+                for current_node in campaign.nodes:
+                    next_node = campaign.get_next_node(current_node)
+                    if next_node:
+                        self.add_edge(current_node.id, next_node.id, classes='hidden')
+
+                first_node = campaign.get_first_node()
+                for prereq_node_id in common_prereq_ids:
+
+                    # 2. remove edges between common prereqs and quests
+                    for quest_node in campaign.nodes:
+                        if prereq_node_id in quest_node.prereq_node_ids:
+                            self.remove_edge(prereq_node_id, quest_node.id)
+
+                    # 3. add edges between common prereqs and campaign/compound/parent node
+                    self.add_edge(prereq_node_id, campaign.node_id)
+
+                    # 4. add invisible edge (for structure) from prereqs to first node
+                    self.add_edge(prereq_node_id, first_node.id, classes='hidden')
+
+                # TODO this should no longer be required now that Campaigns can be set as prerequisites
+                # TODO but will break old maps / prereq setups if removed
+                for reliant_node_id in campaign.get_common_reliant_node_ids():
+
+                    # 5 remove edges between quests and common reliants
+                    for quest_node in campaign.nodes:
+                        if reliant_node_id in quest_node.reliant_node_ids:
+                            self.remove_edge(quest_node.id, reliant_node_id)
+
+                    # 6. add edges between campaign/compound/parent node and common reliants
+                    self.add_edge(campaign.node_id, reliant_node_id)
+
+                    # 7. add invisible edge (for structure) from last node to reliants
+                    self.add_edge(last_node.id, reliant_node_id, classes='hidden')
+
+            # 8. add invisible edge (for structure) from last node to campaign reliants
+            for reliant_node_id in campaign.campaign_reliant_node_ids:
+                self.add_edge(last_node.id, reliant_node_id, classes='hidden')
@@ -0,0 +1,377 @@
+"""
+Lays out a quest map on the server when its cache is built, so the browser can place the nodes with cytoscape's
+`preset` layout instead of running cytoscape-dagre on every view (see static/djcytoscape/js/maps.js).
+
+This is a layered (Sugiyama) layout, the same kind as dagre's:
+
+1. cycles are broken by reversing the edges that point back up the graph,
+2. each node gets a rank (row), the longest path to it from the top while keeping each edge's minLen,
+3. edges that span several ranks get a dummy node in each rank in between,
+4. the nodes in each rank are ordered to reduce edge crossings, sweeping the barycenter heuristic down and up,
+5. each node gets an x position as close to its neighbours as the spacing allows.
+
+A campaign (compound node) is laid out as a rectangle, like dagre's nesting graph: it gets a top and a bottom border
+node that all of its nodes are ranked between, with a border dummy in each rank in between.  Its nodes stay together
+in each rank, the campaigns keep the same order in every rank, and each campaign's nodes move together.
+Edges to or from the campaign itself end at its top border or start at its bottom border.
+The hidden edges added by MapCompiler.fix_nonsequential_campaign_edges() are laid out like any other edge, which is
+what stacks the quests of a non-sequential campaign.  Repeat edges (loops) don't affect the layout.
+"""
+import math
+from bisect import bisect_right, insort
+from collections import defaultdict, deque
+
+# the node sizes set in static/djcytoscape/js/maps.js, and the spacing of the dagre layout it used to run
+NODE_WIDTH = 190  # width + padding
+NODE_HEIGHT = 34  # height + padding
+NODE_SEP = 45
+EDGE_SEP = 10  # beside edges and the borders of campaigns, which have no width
+RANK_SEP = 15
+CAMPAIGN_PADDING = 20  # on each side of a campaign's nodes, including room for its rotated label
+
+SWEEPS = 8
+BALANCE_ITERATIONS = 10
+
+
+def layered_layout(nodes, edges):
+    """
+    :param nodes: an iterable of (node id, parent id), the parent id is the campaign's node id, or None
+    :param edges: an iterable of (source node id, target node id, minimum number of ranks between them)
+    :return: a dict of {node id: {'x': x, 'y': y}} for every node, including the campaigns
+    """
+    return LayeredLayout(nodes, edges).positions()
+
+
+class LayeredLayout:
+    """ See the module's docstring.  Campaign borders and dummies are layout nodes too, with tuples as their ids """
+
+    def __init__(self, nodes, edges):
+        nodes = sorted(nodes, key=lambda node: node[0])
+        self.parents = dict(nodes)
+        self.campaigns = sorted({parent_id for parent_id in self.parents.values() if parent_id in self.parents})
+        campaigns = set(self.campaigns)
+
+        self.nodes = []  # layout nodes, in the order they were added
+        self.campaign_of = {}  # {layout node: campaign id, or None}
+        self.width = {}
+        self.successors = defaultdict(dict)  # {layout node: {successor: min_len}}
+
+        for node_id, parent_id in nodes:
+            if node_id not in campaigns:
+                self.add_node(node_id, parent_id if parent_id in campaigns else None, NODE_WIDTH)
+
+        for node_id in list(self.nodes):
+            campaign_id = self.campaign_of[node_id]
+            if campaign_id is not None:
+                self.add_edge(('top', campaign_id), node_id, 1)
+                self.add_edge(node_id, ('bottom', campaign_id), 1)
+        for campaign_id in self.campaigns:
+            top, bottom = ('top', campaign_id), ('bottom', campaign_id)
+            self.add_node(top, campaign_id, 0)
+            self.add_node(bottom, campaign_id, 0)
+            self.add_edge(top, bottom, 1)
+
+        for source, target, min_len in sorted(edges, key=lambda edge: (edge[0], edge[1])):
+            if source == target or source not in self.parents or target not in self.parents:
+                continue
+            # the edges between a campaign and its own nodes are already laid out by its borders
+            if self.parents[source] == target or self.parents[target] == source:
+                continue
+            if source in campaigns:
+                source = ('bottom', source)
+            if target in campaigns:
+                target = ('top', target)
+            self.add_edge(source, target, max(min_len or 1, 1))
+
+        self.rank = {}
+        self.layers = []
+
+    def add_node(self, node, campaign_id, width):
+        self.nodes.append(node)
+        self.campaign_of[node] = campaign_id
+        self.width[node] = width
+
+    def add_edge(self, source, target, min_len):
+        self.successors[source][target] = max(self.successors[source].get(target, 0), min_len)
+
+    def predecessors(self):
+        predecessors = defaultdict(dict)
+        for source in self.nodes:
+            for target, min_len in self.successors[source].items():
+                predecessors[target][source] = min_len
+        return predecessors
+
+    def roots_first(self):
+        """ The nodes without predecessors, then the others, so the graph is walked from the top """
+        predecessors = self.predecessors()
+        return [node for node in self.nodes if not predecessors[node]] + [node for node in self.nodes if predecessors[node]]
+
+    def positions(self):
+        if not self.nodes:
+            return {}
+        self.remove_cycles()
+        self.assign_ranks()
+        self.add_dummies()
+        self.order()
+        x = self.assign_x()
+
+        positions = {}
+        for node in self.nodes:
+            if not isinstance(node, tuple):
+                positions[node] = {'x': round(x[node], 1), 'y': self.y(self.rank[node])}
+        # cytoscape sizes a campaign around its nodes, but give it a position as well
+        for campaign_id in self.campaigns:
+            top, bottom = ('top', campaign_id), ('bottom', campaign_id)
+            positions[campaign_id] = {
+                'x': round(x[top], 1), 'y': round((self.y(self.rank[top]) + self.y(self.rank[bottom])) / 2, 1),
+            }
+        return positions
+
+    @staticmethod
+    def y(rank):
+        return rank * (NODE_HEIGHT + RANK_SEP)
+
+    # Ranks ##################################################
+
+    def remove_cycles(self):
+        """ Reverses the edges that point back to a node that is still being visited by a depth first search """
+        visiting, done = set(), set()
+        for start in self.roots_first():
+            if start in done:
+                continue
+            visiting.add(start)
+            stack = [(start, iter(list(self.successors[start])))]
+            while stack:
+                node, successors = stack[-1]
+                for successor in successors:
+                    if successor in visiting:
+                        min_len = self.successors[node].pop(successor)
+                        self.add_edge(successor, node, min_len)
+                    elif successor not in done:
+                        visiting.add(successor)
+                        stack.append((successor, iter(list(self.successors[successor]))))
+                        break
+                else:
+                    visiting.discard(node)
+                    done.add(node)
+                    stack.pop()
+
+    def assign_ranks(self):
+        """ Ranks each node by the longest path to it from a node without predecessors """
+        indegree = {node: len(predecessors) for node, predecessors in self.predecessors().items()}
+        self.rank = {node: 0 for node in self.nodes}
+        queue = deque(node for node in self.nodes if not indegree.get(node))
+        while queue:
+            node = queue.popleft()
+            for successor, min_len in self.successors[node].items():
+                self.rank[successor] = max(self.rank[successor], self.rank[node] + min_len)
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    queue.append(successor)
+
+    def add_dummies(self):
+        """ Replaces each edge that spans several ranks with a chain of dummy nodes, one in each rank it crosses.
+        The dummies of a campaign's border are part of the campaign, so it has a node in each of its ranks. """
+        for source in list(self.nodes):
+            for target in list(self.successors[source]):
+                if self.rank[target] - self.rank[source] <= 1:
+                    continue
+                campaign_id = self.campaign_of[source] if self.campaign_of[source] == self.campaign_of[target] else None
+                del self.successors[source][target]
+                previous = source
+                for rank in range(self.rank[source] + 1, self.rank[target]):
+                    dummy = ('dummy', len(self.nodes))
+                    self.add_node(dummy, campaign_id, 0)
+                    self.rank[dummy] = rank
+                    self.add_edge(previous, dummy, 1)
+                    previous = dummy
+                self.add_edge(previous, target, 1)
+
+    # Order within each rank #################################
+
+    def order(self):
+        predecessors = {node: list(predecessors) for node, predecessors in self.predecessors().items()}
+        successors = {node: list(successors) for node, successors in self.successors.items()}
+
+        # start from the order of a depth first search, so each branch starts out together
+        self.layers = [[] for _ in range(max(self.rank.values()) + 1)]
+        visited = set()
+        for root in self.roots_first():
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if node in visited:
+                    continue
+                visited.add(node)
+                self.layers[self.rank[node]].append(node)
+                stack.extend(reversed(successors.get(node, [])))
+
+        for rank in range(len(self.layers)):
+            self.sort_layer(rank, None, None)
+
+        best_layers, best_crossings = [list(layer) for layer in self.layers], self.crossings()
+        for sweep in range(SWEEPS):
+            if sweep % 2 == 0:
+                for rank in range(1, len(self.layers)):
+                    self.sort_layer(rank, rank - 1, predecessors)
+            else:
+                for rank in range(len(self.layers) - 2, -1, -1):
+                    self.sort_layer(rank, rank + 1, successors)
+            crossings = self.crossings()
+            if crossings < best_crossings:
+                best_layers, best_crossings = [list(layer) for layer in self.layers], crossings
+
+        self.layers = best_layers
+        self.order_campaigns()
+
+    def sort_layer(self, rank, fixed_rank, neighbours):
+        """ Sorts the nodes of a rank by the average position of their neighbours in the fixed rank, keeping the
+        nodes of each campaign together.  Nodes without neighbours there keep their position. """
+        layer = self.layers[rank]
+        position = {node: i for i, node in enumerate(layer)}
+        fixed = {} if fixed_rank is None else {node: i for i, node in enumerate(self.layers[fixed_rank])}
+
+        barycenter = {}
+        for node in layer:
+            neighbour_positions = [fixed[neighbour] for neighbour in (neighbours or {}).get(node, []) if neighbour in fixed]
+            barycenter[node] = sum(neighbour_positions) / len(neighbour_positions) if neighbour_positions else None
+
+        units = {}
+        for node in layer:
+            key = ('campaign', self.campaign_of[node]) if self.campaign_of[node] is not None else ('node', node)
+            units.setdefault(key, []).append(node)
+
+        def node_key(node):
+            value = barycenter[node] if barycenter[node] is not None else position[node]
+            return value, position[node]
+
+        def unit_key(members):
+            values = [barycenter[node] for node in members if barycenter[node] is not None]
+            if not values:
+                values = [position[node] for node in members]
+            return sum(values) / len(values), min(position[node] for node in members)
+
+        self.layers[rank] = [node for members in sorted(units.values(), key=unit_key) for node in sorted(members, key=node_key)]
+
+    def crossings(self):
+        crossings = 0
+        for rank in range(len(self.layers) - 1):
+            below = {node: i for i, node in enumerate(self.layers[rank + 1])}
+            targets = []
+            for node in self.layers[rank]:
+                targets.extend(sorted(below[successor] for successor in self.successors[node]))
+            seen = []
+            for target in targets:
+                crossings += len(seen) - bisect_right(seen, target)
+                insort(seen, target)
+        return crossings
+
+    def order_campaigns(self):
+        """ Puts the campaigns in the same order in every rank, so their rectangles don't overlap """
+        relative_positions = defaultdict(list)
+        for layer in self.layers:
+            for i, node in enumerate(layer):
+                if self.campaign_of[node] is not None:
+                    relative_positions[self.campaign_of[node]].append(i / max(len(layer) - 1, 1))
+        campaign_order = {
+            campaign_id: sum(values) / len(values) for campaign_id, values in relative_positions.items()
+        }
+
+        for rank, layer in enumerate(self.layers):
+            units = self.units(layer)
+            campaigns = sorted(
+                (unit for unit in units if self.campaign_of[unit[0]] is not None),
+                key=lambda unit: (campaign_order[self.campaign_of[unit[0]]], self.campaign_of[unit[0]]),
+            )
+            campaigns.reverse()
+            units = [campaigns.pop() if self.campaign_of[unit[0]] is not None else unit for unit in units]
+            self.layers[rank] = [node for unit in units for node in unit]
+
+    def units(self, layer):
+        """ The nodes of the layer, grouped into a list for each campaign and a list for each other node """
+        units = []
+        for node in layer:
+            if units and self.campaign_of[node] is not None and self.campaign_of[units[-1][0]] == self.campaign_of[node]:
+                units[-1].append(node)
+            else:
+                units.append([node])
+        return units
+
+    # X positions ############################################
+
+    @staticmethod
+    def separation(left_width, right_width):
+        gap = NODE_SEP if left_width and right_width else EDGE_SEP
+        return (left_width + right_width) / 2 + gap
+
+    def assign_x(self):
+        """ Places each campaign as a whole, with its nodes centered around it in each rank.  The campaigns and other
+        nodes are packed to the left, then moved towards their neighbours while keeping their spacing.
+        :return: {layout node: x}
+        """
+        # offsets of the nodes within their campaign, and the width of each campaign
+        offset = {node: 0 for node in self.nodes}
+        unit_width = {}
+        for layer in self.layers:
+            for unit in self.units(layer):
+                campaign_id = self.campaign_of[unit[0]]
+                if campaign_id is None:
+                    unit_width[unit[0]] = self.width[unit[0]]
+                    continue
+                # the campaign's borders only take up room in the ranks where it has no nodes, and stay in its center
+                members = [node for node in unit if self.width[node]] or unit
+                lefts = [0]
+                for left, right in zip(members, members[1:]):
+                    lefts.append(lefts[-1] + self.separation(self.width[left], self.width[right]))
+                center = lefts[-1] / 2
+                for node, left in zip(members, lefts):
+                    offset[node] = left - center
+                width = lefts[-1] + (self.width[members[0]] + self.width[members[-1]]) / 2 + 2 * CAMPAIGN_PADDING
+                unit_width[campaign_id] = max(unit_width.get(campaign_id, 0), width)
+
+        def unit_of(node):
+            return self.campaign_of[node] if self.campaign_of[node] is not None else node
+
+        # constraints between neighbouring units in each rank: {unit: {right unit: separation}}
+        right_of, left_of = defaultdict(dict), defaultdict(dict)
+        for layer in self.layers:
+            units = [unit_of(unit[0]) for unit in self.units(layer)]
+            for left, right in zip(units, units[1:]):
+                separation = self.separation(unit_width[left], unit_width[right])
+                right_of[left][right] = max(right_of[left].get(right, 0), separation)
+                left_of[right][left] = right_of[left][right]
+
+        # pack to the left
+        x = {unit: 0 for unit in unit_width}
+        indegree = {unit: len(left_of[unit]) for unit in unit_width}
+        queue = deque(unit for unit in unit_width if not indegree[unit])
+        packed = []
+        while queue:
+            unit = queue.popleft()
+            packed.append(unit)
+            for right, separation in right_of[unit].items():
+                x[right] = max(x[right], x[unit] + separation)
+                indegree[right] -= 1
+                if indegree[right] == 0:
+                    queue.append(right)
+
+        # the neighbours of each unit's nodes that are outside of it, with the offset of the node they're connected to
+        neighbours = defaultdict(list)
+        for source in self.nodes:
+            for target in self.successors[source]:
+                if unit_of(source) != unit_of(target):
+                    neighbours[unit_of(source)].append((target, offset[source]))
+                    neighbours[unit_of(target)].append((source, offset[target]))
+
+        for iteration in range(BALANCE_ITERATIONS):
+            for unit in (packed if iteration % 2 else reversed(packed)):
+                if not neighbours[unit]:
+                    continue
+                desired = sum(x[unit_of(node)] + offset[node] - own_offset for node, own_offset in neighbours[unit])
+                desired /= len(neighbours[unit])
+                lower = max((x[left] + separation for left, separation in left_of[unit].items()), default=-math.inf)
+                upper = min((x[right] - separation for right, separation in right_of[unit].items()), default=math.inf)
+                x[unit] = min(max(desired, lower), upper)
+
+        left_edge = min(x[unit] - unit_width[unit] / 2 for unit in unit_width)
+        return {node: x[unit_of(node)] + offset[node] - left_edge for node in self.nodes}
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('djcytoscape', '0014_alter_cytoelement_href'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CytoScapeMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('scape', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='djcytoscape.cytoscape')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_type', 'object_id'], name='cytoscapemember_object')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cytoscapemember',
+            constraint=models.UniqueConstraint(fields=('scape', 'content_type', 'object_id'), name='unique_cytoscapemember_scape_object'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def populate_members(apps, schema_editor):
+    """ Adds the objects of the existing maps' nodes from their selector_id, e.g. 'Quest: 21'.
+    Campaigns don't have a selector_id, they are added the next time their maps are regenerated. """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    CytoElement = apps.get_model('djcytoscape', 'CytoElement')
+    CytoScapeMember = apps.get_model('djcytoscape', 'CytoScapeMember')
+
+    content_type_ids = dict(
+        ContentType.objects.filter(
+            app_label__in=['quest_manager', 'badges', 'courses'], model__in=['quest', 'badge', 'rank']
+        ).values_list('model', 'id')
+    )
+
+    members = set()
+    elements = CytoElement.objects.filter(group='nodes', selector_id__isnull=False).values_list('scape_id', 'selector_id')
+    for scape_id, selector_id in elements.iterator():
+        model_name, _, object_id = selector_id.partition(':')
+        content_type_id = content_type_ids.get(model_name.strip().lower())
+        if content_type_id and object_id.strip().isdigit():
+            members.add((scape_id, content_type_id, int(object_id)))
+
+    CytoScapeMember.objects.bulk_create([
+        CytoScapeMember(scape_id=scape_id, content_type_id=content_type_id, object_id=object_id)
+        for scape_id, content_type_id, object_id in sorted(members)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcytoscape', '0015_cytoscapemember'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_members, migrations.RunPython.noop)
+    ]
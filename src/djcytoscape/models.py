@@ -1,5 +1,6 @@
 import json
 import re
+from collections import defaultdict
 
 import random
 from badges.models import Badge
@@ -9,13 +10,14 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 from django.db import models
-from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
 from url_or_relative_url_field.fields import URLOrRelativeURLField
 
 from quest_manager.models import Category
 
+from .layout import layered_layout
+
 
 def clean_JSON(dirty_json_str):
     """ Takes a poorly formatted JSON string and cleans it up a bit:
@@ -335,7 +337,7 @@ class TempCampaign:
         """
         common_reliant_ids = []
         # print(self.get_all_reliant_ids())
-        for reliant_id in set(self.get_all_reliant_ids()):
+        for reliant_id in dict.fromkeys(self.get_all_reliant_ids()):  # unique, in order so the map is the same every time
             count = 0
             for node in self.nodes:
                 if reliant_id in node.reliant_node_ids or self.has_internal_reliant(node):
@@ -352,7 +354,7 @@ class TempCampaign:
         """
         common_prereq_ids = []
         # print(self.get_all_prereq_ids())
-        for prereq_id in set(self.get_all_prereq_ids()):
+        for prereq_id in dict.fromkeys(self.get_all_prereq_ids()):  # unique, in order so the map is the same every time
             external_count = 0
             internal_count = 0
             for node in self.nodes:
@@ -442,6 +444,30 @@ class CytoScapeManager(models.Manager):
 
         return scape
 
+    def ids_by_depth(self):
+        """ The ids of all maps, grouped by how far they are from a map without a parent_scape, so each map comes after
+        the map it links back to.  Maps in a parent_scape loop come last.
+        :return: a list of lists of map ids, the maps without a parent first
+        """
+        children = defaultdict(list)
+        all_ids = []
+        for map_id, parent_id in self.get_queryset().order_by('id').values_list('id', 'parent_scape_id'):
+            children[parent_id].append(map_id)
+            all_ids.append(map_id)
+
+        levels = []
+        level = children[None]
+        seen = set(level)
+        while level:
+            levels.append(level)
+            level = [child for map_id in level for child in children[map_id] if child not in seen]
+            seen.update(level)
+
+        remaining = [map_id for map_id in all_ids if map_id not in seen]
+        if remaining:
+            levels.append(remaining)
+        return levels
+
     def generate_random_scape(self, name, size=100):
         new_scape = CytoScape(
             name=name,
@@ -478,15 +504,36 @@ class CytoScapeManager(models.Manager):
 
     def get_related_maps(self, object_):
         """ returns all CytoScape maps associated with object as a queryset """
-        selector_id = CytoElement.generate_selector_id(object_)
-
-        related_ids = CytoElement.objects.filter(
-            group=CytoElement.NODES,
-            selector_id=selector_id,
-        ).values_list('scape__id', flat=True)
-
+        return self.get_related_maps_for_objects([object_])
+
+    def get_related_maps_for_objects(self, objects):
+        """ returns all CytoScape maps associated with any of the objects as a queryset """
+        return self.get_related_maps_for_keys([
+            (ContentType.objects.get_for_model(object_).id, object_.pk) for object_ in objects if object_.pk is not None
+        ])
+
+    def get_related_maps_for_keys(self, keys):
+        """ returns all CytoScape maps with a node for any of the (content type id, object id) keys, using the index of
+        CytoScapeMember """
+        condition = models.Q(pk__in=[])
+        for content_type_id, object_id in keys:
+            if object_id is not None:
+                condition |= models.Q(content_type_id=content_type_id, object_id=object_id)
+
+        related_ids = CytoScapeMember.objects.filter(condition).values('scape_id')
         return self.get_queryset().filter(id__in=related_ids)
 
+    def get_maps_affected_by_prereq(self, prereq):
+        """ returns the maps that would change if the prereq was added, edited or removed, as a queryset:
+        the maps of its parent object, whose edges change, and the maps of the objects it requires, which the parent
+        object can be added to or removed from when the map is regenerated.
+        """
+        return self.get_related_maps_for_keys([
+            (prereq.parent_content_type_id, prereq.parent_object_id),
+            (prereq.prereq_content_type_id, prereq.prereq_object_id),
+            (prereq.or_prereq_content_type_id, prereq.or_prereq_object_id),
+        ])
+
 
 class CytoScape(models.Model):
     ALLOWED_INITIAL_CONTENT_TYPES = models.Q(app_label='quest_manager', model='quest') | \
@@ -561,12 +608,21 @@ class CytoScape(models.Model):
         elements = self.cytoelement_set.all()
         return elements.select_related('data_parent', 'data_source', 'data_target')
 
-    def elements_dict(self):
-        elements = self.elements()
-        nodes = elements.filter(group=CytoElement.NODES)
-        edges = elements.filter(group=CytoElement.EDGES)
-
-        nodes_list = [node.json_dict() for node in nodes]
+    def elements_dict(self, elements=None):
+        """ The map's nodes, with their positions from djcytoscape.layout so the browser doesn't have to lay them out,
+        and edges.
+        :param elements: the map's elements if they've already been fetched, in the order of self.elements()
+        """
+        if elements is None:
+            elements = self.elements()
+        nodes = [element for element in elements if element.group == CytoElement.NODES]
+        edges = [element for element in elements if element.group == CytoElement.EDGES]
+
+        positions = layered_layout(
+            [(node.id, node.data_parent_id) for node in nodes],
+            [(edge.data_source_id, edge.data_target_id, edge.min_len) for edge in edges],
+        )
+        nodes_list = [{**node.json_dict(), 'position': positions[node.id]} for node in nodes]
         edges_list = [edge.json_dict() for edge in edges]
 
         elements_dict = {
@@ -575,26 +631,126 @@ class CytoScape(models.Model):
         }
         return elements_dict
 
-    def generate_elements_json(self):
-        return json.dumps(self.elements_dict())
+    def generate_elements_json(self, elements=None):
+        return json.dumps(self.elements_dict(elements))
 
-    def class_styles_list(self):
+    def class_styles_list(self, elements=None):
+        if elements is None:
+            elements = self.elements()
         ls = []
-        for element in self.elements():
+        for element in elements:
             if element.id_styles:
                 ls.append(
                     element.get_selector_styles_json_dict("#" + str(element.id), element.id_styles)
                 )
         return ls
 
-    def generate_class_styles_json(self):
-        return json.dumps(self.class_styles_list())
+    def generate_class_styles_json(self, elements=None):
+        return json.dumps(self.class_styles_list(elements))
 
-    def update_cache(self):
-        self.elements_json = self.generate_elements_json()
-        self.class_styles_json = self.generate_class_styles_json()
+    def update_cache(self, elements=None):
+        if elements is None:
+            elements = list(self.elements())
+        self.elements_json = self.generate_elements_json(elements)
+        self.class_styles_json = self.generate_class_styles_json(elements)
         self.save()
 
+    def patch_cache(self, elements, removed_ids=()):
+        """ Replaces these elements in the cached json (adding those that aren't there yet) and removes the elements with
+        removed_ids, instead of serializing all the map's elements again with update_cache() """
+        if self.elements_json is None or self.class_styles_json is None:
+            self.update_cache()
+            return
+
+        elements_dict = json.loads(self.elements_json)
+        class_styles = json.loads(self.class_styles_json)
+        removed_ids = set(removed_ids)
+
+        for group in (CytoElement.NODES, CytoElement.EDGES):
+            patched = {element.id: element for element in elements if element.group == group}
+            patched_list = []
+            for element_dict in elements_dict[group]:
+                element_id = element_dict['data']['id']
+                if element_id in patched:
+                    # patched nodes keep their place in the layout
+                    patched_dict = patched.pop(element_id).json_dict()
+                    if 'position' in element_dict:
+                        patched_dict['position'] = element_dict['position']
+                    patched_list.append(patched_dict)
+                elif element_id not in removed_ids:
+                    patched_list.append(element_dict)
+            patched_list += [element.json_dict() for element in patched.values()]
+            elements_dict[group] = patched_list
+
+        patched_selectors = {"#" + str(element.id) for element in elements} | {"#" + str(id_) for id_ in removed_ids}
+        class_styles = [style for style in class_styles if style['selector'] not in patched_selectors]
+        for element in elements:
+            if element.id_styles:
+                class_styles.append(element.get_selector_styles_json_dict("#" + str(element.id), element.id_styles))
+
+        self.elements_json = json.dumps(elements_dict)
+        self.class_styles_json = json.dumps(class_styles)
+        self.save(update_fields=['elements_json', 'class_styles_json'])
+
+    def patch_node(self, obj):
+        """
+        Updates the node representing obj in this map after a change that doesn't affect the map's structure, i.e. its
+        label (name or XP), icon, or repeats, along with the label of its campaign node and its repeat edge.
+        Much cheaper than regenerate(), which rebuilds the whole map.
+        """
+        nodes = list(
+            CytoElement.objects.all_for_scape(self).nodes()
+            .filter(selector_id=CytoElement.generate_selector_id(obj))
+            .select_related('data_parent')
+        )
+        if not nodes:
+            return
+
+        ct = ContentType.objects.get_for_model(obj)
+        is_initial_object = self.initial_content_type_id == ct.id and self.initial_object_id == obj.id
+        img_url = obj.get_icon_url() if hasattr(obj, 'get_icon_url') else "none"
+
+        patched = []
+        removed_ids = []
+        for node in nodes:
+            node.label = self.generate_label(obj)
+            node.id_styles = "'background-image': '" + img_url + "'"
+            patched.append(node)
+
+            # the campaign's label includes the XP of all its quests
+            campaign = getattr(obj, 'campaign', None)
+            if node.data_parent and campaign:
+                node.data_parent.label = self.generate_label(campaign)
+                patched.append(node.data_parent)
+
+            # the initial node never gets a repeat edge, see djcytoscape.compiler.MapCompiler.add_reliant_nodes()
+            max_repeats = getattr(obj, 'max_repeats', 0)
+            if is_initial_object:
+                continue
+            repeat_edges = list(
+                CytoElement.objects.filter(scape=self, group=CytoElement.EDGES, data_source=node, data_target=node)
+                .select_related('data_source', 'data_target')
+            )
+            if max_repeats == 0:
+                removed_ids += [edge.id for edge in repeat_edges]
+                CytoElement.objects.filter(id__in=[edge.id for edge in repeat_edges]).delete()
+                continue
+            label = '∞' if max_repeats < 0 else 'x' + str(max_repeats)
+            if repeat_edges:
+                repeat_edge = repeat_edges[0]
+                repeat_edge.label = label
+            else:
+                repeat_edge = CytoElement(
+                    scape=self, group=CytoElement.EDGES, data_source=node, data_target=node, label=label, classes='repeat-edge'
+                )
+            repeat_edge.save()
+            patched.append(repeat_edge)
+
+        for element in {element.id: element for element in patched}.values():
+            if element.group == CytoElement.NODES:
+                element.save(update_fields=['label', 'id_styles'])
+        self.patch_cache(patched, removed_ids)
+
     @staticmethod
     def generate_label(obj):
         # set max label length in characters
@@ -634,360 +790,6 @@ class CytoScape(models.Model):
         title = title.replace('"', '\\"')
         return title + post
 
-    def get_last_node_in_campaign(self, parent_node, offset=0):
-        """
-        :param offset: offset from last node by this (i.e. 1 --> second last node)
-        :param parent_node: the compound node/parent, i.e. campaign
-        :return: the most recent node added to the campaign (added to the compound/parent node) by using the highest id
-        """
-        try:
-            # latest normally used with dates, but actually works with other fields too!
-            # return CytoElement.objects.all_for_campaign(self, parent_node).latest('id')
-            qs = CytoElement.objects.all_for_campaign(self, parent_node).order_by('-id')
-            return qs[offset]
-        except self.DoesNotExist:
-            return None
-
-    def create_first_node(self, obj):
-        """ Creates the first node from `obj`, then if this map has a parent, creates an aditiona node to link back to back to the parent scape/map.
-        Returns the first node."""
-
-        # the initial node in this map
-        first_node, _ = self.create_node_from_object(obj, initial_node=True)
-
-        if self.parent_scape:
-            # the node to link to the parent map
-            parent_node, _ = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
-                label=f"{self.parent_scape.name} Quest Map",
-                href=reverse('maps:quest_map', args=[self.parent_scape.id]),
-                classes='link parent-map'
-            )
-
-            # link them together with an edge
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=parent_node,
-                data_target=first_node,
-            )
-
-        return first_node
-
-    def create_child_map_node(self, obj, data_source):
-        """ If this obj is a transition node (to a new map, make a node to link to the next map"""
-        ct = ContentType.objects.get_for_model(obj)
-        # obj = ct.get_object_for_this_type(id=obj.id)
-
-        child_map_qs = CytoScape.objects.filter(initial_content_type=ct.id, initial_object_id=obj.id)
-        if child_map_qs.exists():
-            child_map = child_map_qs[0]
-            label = f"{child_map.name} Map"
-        else:
-            label = "The Void"
-
-        child_map_node, _ = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
-            label=label,
-            href=reverse('maps:quest_map_interlink', args=[ct.id, obj.id, self.id]),  # <content_type_id>, <object_id>, <originating_scape_id>
-            classes="link child-map",
-        )
-
-        # link them together with an edge
-        CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.EDGES,
-            data_source=data_source,
-            data_target=child_map_node,
-        )
-
-        return child_map_node
-
-    def create_node_from_object(self, obj, initial_node=False):
-        # If node node doesn't exist already, create a new one
-
-        # check for an icon
-        if hasattr(obj, 'get_icon_url'):
-            img_url = obj.get_icon_url()
-        else:
-            img_url = "none"
-
-        # check for map transition
-        map_transition = False
-        if hasattr(obj, 'map_transition'):
-            map_transition = obj.map_transition
-
-        new_node, created = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
-            selector_id=CytoElement.generate_selector_id(obj),
-            label=self.generate_label(obj),
-            defaults={
-                      'id_styles': "'background-image': '" + img_url + "'",
-                      'classes': type(obj).__name__,
-                      'href': obj.get_absolute_url(),
-                      'is_transition': map_transition,
-                     }
-        )
-
-        # if this is a transition node (to a new map), format it and link it.
-        if not initial_node and self.is_transition_node(new_node):
-            new_node.convert_to_transition_node(obj, self)
-
-        return new_node, created
-
-    def init_temp_campaign_list(self):
-        """
-        Create a new member variable `campaign_list` or clear it if it already exists
-        """
-        self.campaign_list = []
-
-    def get_temp_campaign(self, campaign_id) -> TempCampaign:
-        for campaign in self.campaign_list:
-            try:
-                if campaign.node_id == campaign_id:
-                    return campaign
-            except ValueError:
-                pass
-        return None
-
-    def add_to_campaign(self, obj, target_node, source_node):
-        """
-        Checks if obj is in a campaign, if so, gets or creates the campaign_node (Parent/compound node)
-        and adds it as the parent (compound) node.  Also registers the target_node and source_node with the TempCampaign (for edges later)
-        :param source_node: node representing the target_node's prereq
-        :param obj: the django object currently being processed, represented by the target_node
-        :param target_node: node of the reliant object, obj
-        :return: campaign_node = None if obj isn't part of a campaign, otherwise = the campaign_node (i.e. parent_node)
-        campaign_created = False if obj is in campaign, but the campaign was created by an earlier node
-        """
-        # If part of a campaign, create parent and add to "parent" node, i.e. compound node
-        campaign_node = None
-        campaign = None
-        campaign_created = False
-
-        # Check if the obj has a campaign attribute, currently only Quest objects have this, but obj could be a Badge or other prereq model
-        if hasattr(obj, 'campaign') and obj.campaign is not None:
-            campaign = obj.campaign
-
-            # Create a node for this campaign (or get it if it already exists)
-            campaign_node, campaign_created = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
-                label=CytoScape.generate_label(obj.campaign),
-                classes="campaign",
-                # defaults={'attribute': value},
-            )
-
-            # Add a parent (i.e. campaign) to the target node (to form a compound node)
-            target_node.data_parent = campaign_node
-            target_node.save()
-
-            # TempCampaign utility for cleaning up the edges and making the resulting map look good, after the entire map is built
-            if campaign_created:
-                self.campaign_list.append(TempCampaign(campaign_node.id))
-            temp_campaign = self.get_temp_campaign(campaign_node.id)  # not a Django model, so custom method
-
-            # TODO: Nodes might be present multiple times through different source nodes?  check and combine
-            temp_campaign.add_node(target_node.id, source_node.id)
-
-        return campaign, campaign_node, campaign_created
-
-    def fix_nonsequential_campaign_edges(self):
-        """
-        cyto dagre layout doesn't support compound/parent nodes, so for non-sequential/non-directed campaigns
-        (i.e. all quests are available concurrently) we need to:
-         1. add invisible edges joining the quests
-         2. remove edges between common prereqs and quests
-         3. add edges between common prereqs and campaign/compound/parent node
-         4. add invisible edge (for structure) from prereqs to first node
-         5. (deprecated) remove edges between quests and common reliants
-         6. (deprecated) add edges between campaign/compound/parent node and common reliants
-         7. (deprecated) add invisible edge (for structure) from last node to common reliants
-         8. add invisible edge (for structure) from last node to campaign reliants
-        """
-
-        for campaign in self.campaign_list:
-
-            last_node = campaign.get_last_node()
-
-            common_prereq_ids = campaign.get_common_prereq_node_ids()
-            if common_prereq_ids:  # then non-sequential campaign
-
-                # 1. add invisible edges joining the quests
-                for current_node in campaign.nodes:
-                    next_node = campaign.get_next_node(current_node)
-                    if next_node:
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=current_node.id,
-                            data_target_id=next_node.id,
-                            defaults={'classes': 'hidden', },
-                        )
-
-                first_node = campaign.get_first_node()
-                for prereq_node_id in common_prereq_ids:
-
-                    # 2. remove edges between common prereqs and quests
-                    for quest_node in campaign.nodes:
-                        # we already know all quests have this prereq node in common, so the edges should all exist
-                        # unless quest has internal prereq...
-                        if prereq_node_id in quest_node.prereq_node_ids:
-                            edge_node = get_object_or_404(CytoElement,
-                                                          data_source_id=prereq_node_id,
-                                                          data_target_id=quest_node.id)
-                            edge_node.delete()
-
-                    # 3. add edges between common prereqs and campaign/compound/parent node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=campaign.node_id,
-                        # defaults={'attribute': value},
-                    )
-
-                    # 4. add invisible edge (for structure) from prereqs to first node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=first_node.id,
-                        defaults={'classes': 'hidden', }
-                    )
-
-                # TODO this should no longer be required now that Campaigns can be set as prerequisites
-                # TODO but will break old maps / prereq setups if removed
-                reliant_node_ids = campaign.get_common_reliant_node_ids()
-                if reliant_node_ids:
-                    for reliant_node_id in reliant_node_ids:
-
-                        # 5 remove edges between quests and common reliants
-                        for quest_node in campaign.nodes:
-                            # we already know all quests have this reliant node in common, so the edges should all exist
-                            # unless it has an internal reliant...
-                            if reliant_node_id in quest_node.reliant_node_ids:
-                                edge_node = get_object_or_404(CytoElement,
-                                                              data_source_id=quest_node.id,
-                                                              data_target_id=reliant_node_id)
-                                edge_node.delete()
-
-                        # 6. add edges between campaign/compound/parent node and common reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=campaign.node_id,
-                            data_target_id=reliant_node_id,
-                            # defaults={'attribute': value},
-                        )
-
-                        # 7. add invisible edge (for structure) from last node to reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=last_node.id,
-                            data_target_id=reliant_node_id,
-                            defaults={'classes': 'hidden', }
-                            # defaults={'attribute': value},
-                        )
-
-            # 8. add invisible edge (for structure) from last node to campaign reliants
-            # TODO actually add nodes to the campaign_reliant_nodes_ids list!!!!
-            for reliant_node_id in campaign.campaign_reliant_node_ids:
-                CytoElement.objects.get_or_create(
-                    scape=self,
-                    group=CytoElement.EDGES,
-                    data_source_id=last_node.id,
-                    data_target_id=reliant_node_id,
-                    defaults={'classes': 'hidden', }
-                    # defaults={'attribute': value},
-                )
-
-    def find_reliant_objects_and_add_target_nodes(self, source_obj, source_node: CytoElement):
-        """ Recursivly connect nodes together with edges.  Starts at the top and works down through all objects
-        that rely on the source_obj as a prerequisite.
-
-        source_obj: the current django object being processed (could be any mappable prerequisite, such as a Quest, Badge, or Campaign)
-        source_node: the cytoscape node representing the source_obj
-
-        Other names:
-        parent node is confusing, but refers to the compound nodes that group other nodes together (i.e. campaigns)
-        variables with names such as data_parent, parent_node, etc, are Campaigns that a quest might be in.
-        In graph terms these are called parent nodes or compound nodes
-
-        target_nodes are nodes created from reliant objects (objects that rely on the source_obj as a prerequisite)
-        """
-        reliant_objects = source_obj.get_reliant_objects(exclude_NOT=True, sort=True)
-
-        for obj in reliant_objects:
-            # source_node
-            #  > reliant obj1 (target node 1)
-            #  > reliant obj2 (target node 2)
-            #  > ...
-
-            # create or get the node represented by the reliant object
-            target_node, node_created = self.create_node_from_object(obj)
-
-            # if source node is in a compound node (has a parent / campaign), add target_node as a reliant in the temp_campaign
-            if source_node.data_parent:
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.data_parent.id)
-                temp_campaign.add_reliant(source_node.id, target_node.id)
-
-            # if the source node is ITSELF a campaign (parent of a compound node)
-            if source_node.is_parent():
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.id)
-                temp_campaign.add_campaign_reliant(target_node.id)
-
-            # add new_node to a campaign/compound/parent, if required
-            campaign_obj, campaign_node, campaign_node_created = self.add_to_campaign(obj, target_node, source_node)
-
-            # If this is the first time this campaign has been encountered, then check if IT has any reliant objects
-            if campaign_node_created:
-                self.find_reliant_objects_and_add_target_nodes(campaign_obj, campaign_node)
-                # these nodes need to be added to the temp_campaigncampaign_reliant_node_ids for later cleanup
-
-            # add a class to alternate prerequisites edges so they can be styled differently if desired
-            if obj.has_or_prereq() or obj.has_inverted_prereq():
-                # add "alternate" class
-                defaults = {'classes': 'complicated-prereqs'}
-            else:
-                defaults = {}
-
-            # TODO: should add number of times prereq is required, similar to repeat edges below
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=source_node,
-                data_target=target_node,
-                defaults=defaults,
-            )
-
-            # If repeatable, also add circular edge
-            if hasattr(obj, 'max_repeats'):
-                if obj.max_repeats != 0:
-                    if obj.max_repeats < 0:
-                        label = '∞'
-                    else:
-                        label = 'x' + str(obj.max_repeats)
-
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source=target_node,
-                        data_target=target_node,
-                        defaults={
-                            'label': label,
-                            'classes': 'repeat-edge',
-                        },
-                    )
-
-            # recursive, continue adding if this is a new node, and not a closing node
-            if node_created and not self.is_transition_node(target_node):
-                self.find_reliant_objects_and_add_target_nodes(obj, target_node)
-
     def is_transition_node(self, node: CytoElement):
         """ A transition node represents an obj.map_transition attribute set to True (saved in node.is_transition_)
         DEPRECATED: Also return True if node.label begins with the tilde '~' or contains an astrix '*'
@@ -1014,29 +816,42 @@ class CytoScape(models.Model):
         scape.calculate_nodes()
         return scape
 
-    def calculate_nodes(self,):
-
-        # Create the starting node from the initial quest, and a link back to the parent map if there is one
-        first_node = self.create_first_node(self.initial_content_object)
-
-        # Temp campaign list used to track funky edges required for compound nodes to display properly with dagre
-        self.init_temp_campaign_list()
-
-        # Add nodes reliant on the first_node, this is recursive and will generate all nodes until endpoints reached
-        # Endpoints... not sure yet, but probably quests starting with '~' tilde character, or add a new field?
-        self.find_reliant_objects_and_add_target_nodes(self.initial_content_object, first_node)
+    def calculate_nodes(self, prereq_graph=None):
+        """ Builds and saves all the elements of this map, see djcytoscape.compiler
+        :param prereq_graph: a djcytoscape.compiler.PrereqGraph to share between maps, otherwise one is loaded
+        """
+        from djcytoscape.compiler import MapCompiler  # avoid circular import
 
-        # Add those funky edges for proper display of compound (parent) nodes in cyto dagre layout
-        self.fix_nonsequential_campaign_edges()
+        elements = MapCompiler(self, prereq_graph).save()
         self.last_regeneration = timezone.now()
-        self.update_cache()
-        self.save()
+        self.update_cache(elements)
 
-    def regenerate(self):
+    def regenerate(self, prereq_graph=None):
         if self.initial_content_object is None:
             self.delete()
             raise (self.InitialObjectDoesNotExist)
 
-        # Delete existing nodes
-        CytoElement.objects.all_for_scape(self).delete()
-        self.calculate_nodes()
+        # existing nodes are replaced
+        self.calculate_nodes(prereq_graph)
+
+
+class CytoScapeMember(models.Model):
+    """
+    An object (e.g. a Quest, Badge, Rank or campaign) that has a node in a map.  Kept up to date by
+    djcytoscape.compiler.MapCompiler whenever the map is generated, so the maps an object is part of can be found
+    with the (content_type, object_id) index instead of searching CytoElement.selector_id.
+    """
+    scape = models.ForeignKey(CytoScape, on_delete=models.CASCADE, related_name='members')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scape', 'content_type', 'object_id'], name='unique_cytoscapemember_scape_object'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='cytoscapemember_object'),
+        ]
+
+    def __str__(self):
+        return f"{self.scape_id}: {self.content_type_id}-{self.object_id}"
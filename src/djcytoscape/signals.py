@@ -1,14 +1,32 @@
+from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 
-from djcytoscape.models import CytoScape
+from djcytoscape.models import CytoScape, CytoScapeMember
 from siteconfig.models import SiteConfig
 from badges.models import Badge
 from quest_manager.models import Quest
 from courses.models import Rank
 from prerequisites.models import Prereq
 
-from djcytoscape.tasks import regenerate_map
+from djcytoscape.tasks import schedule_map_regeneration
+
+# Fields shown on an object's node, so a change to them only needs the node to be patched, see CytoScape.patch_node()
+PATCHABLE_FIELDS = {
+    Quest: ['name', 'xp', 'xp_can_be_entered_by_students', 'icon', 'max_repeats'],
+    Badge: ['name', 'xp', 'icon'],
+    Rank: ['name', 'xp', 'icon'],
+}
+
+# Fields that change which nodes and edges are in a map, so a change to them needs the map to be regenerated
+STRUCTURAL_FIELDS = {
+    Quest: [
+        'campaign', 'map_transition', 'visible_to_students', 'archived',
+        'date_available', 'time_available', 'date_expired', 'time_expired',
+    ],
+    Badge: ['active', 'map_transition'],
+    Rank: [],
+}
 
 
 def regenerate_related_maps(instance):
@@ -24,30 +42,87 @@ def regenerate_related_maps(instance):
     if not related_map_ids:
         return
 
-    # run task in background
-    regenerate_map.apply_async(args=[related_map_ids], queue='default')
+    # run task in background, merged with other changes to the same maps
+    schedule_map_regeneration(related_map_ids)
+
+
+def get_map_field_values(instance):
+    """ The values of the fields that are shown on the instance's node or affect its maps' structure, as saved in the db """
+    fields = [instance._meta.get_field(name) for name in PATCHABLE_FIELDS[type(instance)] + STRUCTURAL_FIELDS[type(instance)]]
+    return {field.name: field.get_prep_value(field.value_from_object(instance)) for field in fields}
+
+
+def is_autobreak_label(name):
+    """ With autobreak, a name beginning with '~' or containing '*' makes the node a transition node, see
+    CytoScape.is_transition_node() """
+    return bool(name) and (name.startswith('~') or '*' in name)
+
+
+@receiver(pre_save, sender=Badge)
+@receiver(pre_save, sender=Quest)
+@receiver(pre_save, sender=Rank)
+def remember_map_field_values(sender, instance, raw=False, **kwargs):
+    """ Keeps the values the instance had before this save, so the post_save receiver can tell what changed """
+    instance._map_field_values = None
+    if raw or instance.pk is None or not SiteConfig.get().map_auto_update:
+        return
+    try:
+        instance._map_field_values = get_map_field_values(sender._base_manager.get(pk=instance.pk))
+    except sender.DoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=Badge)
+@receiver(post_save, sender=Quest)
+@receiver(post_save, sender=Rank)
+def update_related_maps(sender, instance, created, raw=False, **kwargs):
+    """ Updates any related map(s) when a badge, quest, or rank is saved.
+    Changes that are only shown on the object's node (e.g. its name or XP) patch the node in place, and changes that
+    affect the maps' structure regenerate them.  A new object isn't part of a map until a prereq makes it one.
+    """
+    if created or raw:
+        return
+
+    before = getattr(instance, '_map_field_values', None)
+    if before is None:
+        # unknown previous values, e.g. the instance was saved with save_base() or auto updates were just turned on
+        regenerate_related_maps(instance)
+        return
+
+    after = get_map_field_values(instance)
+    changed = {name for name in after if after[name] != before[name]}
+    if not changed:
+        return
+
+    structural = changed & set(STRUCTURAL_FIELDS[sender])
+    if 'name' in changed and (is_autobreak_label(before['name']) or is_autobreak_label(after['name'])):
+        structural.add('name')
+    if structural:
+        regenerate_related_maps(instance)
+        return
 
+    for scape in CytoScape.objects.get_related_maps(instance):
+        scape.patch_node(instance)
 
-@receiver([post_save, post_delete], sender=Badge)
-@receiver([post_save, post_delete], sender=Quest)
-@receiver([post_save, post_delete], sender=Rank)
+
+@receiver(post_delete, sender=Badge)
+@receiver(post_delete, sender=Quest)
+@receiver(post_delete, sender=Rank)
 def badge_regenerate_related_maps(sender, instance, **kwargs):
-    """ Regenerates any related map(s) when either a badge, quest, or rank is saved/deleted. """
+    """ Regenerates any related map(s) when either a badge, quest, or rank is deleted. """
     regenerate_related_maps(instance)
+    CytoScapeMember.objects.filter(content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk).delete()
 
 
 @receiver([post_save, post_delete], sender=Prereq)
 def prereq_regenerate_related_maps(sender, instance, **kwargs):
-    """ Regenerates any related map(s) when a prereq is saved or deleted. """
-
-    # get parent object of prereq
-    model_class = instance.parent_content_type.model_class()
-
-    try:
-        object_ = model_class.objects.get(id=instance.parent_object_id)
+    """ Regenerates any related map(s) when a prereq is saved or deleted, including the maps of the objects it requires,
+    which its parent object may now be added to or removed from, see CytoScapeManager.get_maps_affected_by_prereq() """
+    if not SiteConfig.get().map_auto_update:
+        return
 
-    # means this signal was called when object_ was deleted
-    except model_class.DoesNotExist:
+    affected_map_ids = list(CytoScape.objects.get_maps_affected_by_prereq(instance).values_list('id', flat=True))
+    if not affected_map_ids:
         return
 
-    regenerate_related_maps(object_)
+    schedule_map_regeneration(affected_map_ids)
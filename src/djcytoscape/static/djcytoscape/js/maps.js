@@ -117,7 +117,13 @@ cy.style()
  *
 /**************************************/
 
-var layout = cy.layout({
+// Maps are laid out on the server when they're regenerated (see djcytoscape/layout.py), so their nodes already have a
+// position.  Maps cached before that are still laid out here with dagre.
+var hasPositions = typeof mapElements !== 'undefined' && mapElements.nodes.length > 0 && mapElements.nodes.every(
+    function (node) { return node.position; }
+);
+
+var layout = hasPositions ? cy.layout({"name": "preset", "fit": false}) : cy.layout({
 
     // name: 'breadthfirst',
     // directed: true,
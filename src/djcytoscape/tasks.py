@@ -1,37 +1,105 @@
+import logging
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 from hackerspace_online.celery import app
 
 from notifications.signals import notify
 from siteconfig.models import SiteConfig
 
+from .compiler import PrereqGraph
 from .models import CytoScape
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 
 @app.task(name='djcytoscape.tasks.regenerate_all_maps')
-def regenerate_all_maps(requesting_user_id):
-    requesting_user = User.objects.get(id=requesting_user_id)
-    for scape in CytoScape.objects.all():
+def regenerate_all_maps(requesting_user_id, levels=None, run_id=None):
+    """ Regenerates all maps, split between up to MAP_REGENERATION_CONCURRENCY `regenerate_level_maps` tasks.
+
+    The maps are regenerated one level at a time (see CytoScapeManager.ids_by_depth()), so a map whose initial object
+    no longer exists is deleted, along with the maps linking back to it, before those maps are regenerated.
+    The last task to finish a level starts the next one, and the requesting user is notified once all of them are done.
+
+    ARGS:
+        requesting_user_id (int): the user that is notified of the maps that failed and when all maps are done
+        levels (list[list[int]]): the map ids that are left to regenerate, by level, None to start with all maps
+        run_id (str): identifies this regeneration's counter of remaining tasks in the cache
+    """
+    if levels is None:
+        levels = CytoScape.objects.ids_by_depth()
+        run_id = uuid.uuid4().hex
+
+    if not levels:
+        requesting_user = User.objects.get(id=requesting_user_id)
+        notify.send(
+            SiteConfig.get().deck_ai,
+            target=None,
+            recipient=requesting_user,
+            affected_users=[requesting_user],
+            icon="<i class='fa fa-lg fa-fw fa-map-signs text-success'></i>",
+            verb="completed regeneration of all valid maps."
+        )
+        return
+
+    level, next_levels = levels[0], levels[1:]
+    concurrency = max(1, min(settings.MAP_REGENERATION_CONCURRENCY, len(level)))
+    cache.set(remaining_tasks_key(run_id), concurrency, settings.MAP_REGENERATION_RUN_TIMEOUT)
+    for i in range(concurrency):
+        regenerate_level_maps.apply_async(args=[requesting_user_id, level[i::concurrency], next_levels, run_id], queue='default')
+
+
+def remaining_tasks_key(run_id):
+    return f'map-regeneration-remaining-{run_id}'
+
+
+@app.task(name='djcytoscape.tasks.regenerate_level_maps')
+def regenerate_level_maps(requesting_user_id, map_ids, next_levels, run_id):
+    """ Regenerates some of the maps of a `regenerate_all_maps` level, then continues with the next level if this was the
+    last of the level's tasks to finish.  The maps share the same PrereqGraph, so the prereqs are only loaded once.
+    """
+    try:
+        prereq_graph = PrereqGraph()
+        for scape in CytoScape.objects.filter(id__in=map_ids):
+            try:
+                scape.regenerate(prereq_graph)
+            except scape.InitialObjectDoesNotExist:
+                notify.send(
+                    SiteConfig.get().deck_ai,
+                    recipient=User.objects.get(id=requesting_user_id),
+                    icon="<i class='fa fa-lg fa-fw fa-map-signs text-warning'></i>",
+                    verb=f"failed to regenerate '{scape.name} Map', the intial object no longer exists.  This map has been deleted."
+                )
+            except Exception:
+                # one broken map shouldn't stop the others, or the next levels, from being regenerated
+                logger.exception("Failed to regenerate map %s", scape.id)
+    finally:
         try:
-            scape.regenerate()
-        except scape.InitialObjectDoesNotExist:
-            notify.send(
-                SiteConfig.get().deck_ai,
-                recipient=requesting_user,
-                icon="<i class='fa fa-lg fa-fw fa-map-signs text-warning'></i>",
-                verb=f"failed to regenerate '{scape.name} Map', the intial object no longer exists.  This map has been deleted."
-            )
-
-    notify.send(
-        SiteConfig.get().deck_ai,
-        target=None,
-        recipient=requesting_user,
-        affected_users=[requesting_user],
-        icon="<i class='fa fa-lg fa-fw fa-map-signs text-success'></i>",
-        verb="completed regeneration of all valid maps."
-    )
+            remaining = cache.decr(remaining_tasks_key(run_id))
+        except ValueError:
+            # the counter expired, so the first task to find out continues in case one of the level's tasks was lost
+            remaining = 0 if cache.add(remaining_tasks_key(run_id), -1, settings.MAP_REGENERATION_RUN_TIMEOUT) else -1
+        if remaining == 0:
+            regenerate_all_maps.apply_async(args=[requesting_user_id, next_levels, run_id], queue='default')
+
+
+def pending_regeneration_key(map_id):
+    return f'map-regeneration-pending-{map_id}'
+
+
+def schedule_map_regeneration(map_ids):
+    """ Regenerates the maps after settings.MAP_REGENERATION_DEBOUNCE seconds.  Maps that are already waiting to be
+    regenerated are skipped, since that task will pick up these changes too.  This merges the many signals sent when
+    e.g. a quest's prereqs are edited into a single regeneration of each map.
+    """
+    map_ids = [map_id for map_id in map_ids if cache.add(pending_regeneration_key(map_id), True, settings.MAP_REGENERATION_DEBOUNCE)]
+    if map_ids:
+        regenerate_map.apply_async(args=[map_ids], queue='default', countdown=settings.MAP_REGENERATION_DEBOUNCE)
 
 
 @app.task(name='djcytoscape.tasks.regenerate_map')
@@ -43,6 +111,8 @@ def regenerate_map(map_ids):
     ARGS:
         map_ids (list[int]): list of ids belonging to Cytoscape maps
     """
+    # changes from here on need another regeneration
+    cache.delete_many([pending_regeneration_key(map_id) for map_id in map_ids])
     for scape in CytoScape.objects.filter(id__in=map_ids):
         try:
             scape.regenerate()
@@ -0,0 +1,130 @@
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from djcytoscape.compiler import MapCompiler, PrereqGraph
+from djcytoscape.models import CytoElement, CytoScape
+from prerequisites.models import Prereq
+from quest_manager.models import Category, Quest
+
+
+class MapCompilerTest(TenantTestCase):
+
+    def setUp(self):
+        self.first_quest = baker.make(Quest, name='First')
+
+    def make_chain(self, size, **kwargs):
+        """ A chain of quests, each one relying on the one before """
+        quests = [self.first_quest]
+        for i in range(size):
+            quest = baker.make(Quest, name=f'Quest {i:03}', **kwargs)
+            Prereq.add_simple_prereq(quest, quests[-1])
+            quests.append(quest)
+        return quests
+
+    def edges(self, scape):
+        """ The map's edges as (source label, target label, classes) """
+        edges = CytoElement.objects.all_for_scape(scape).filter(group=CytoElement.EDGES)
+        return {(edge.data_source.label, edge.data_target.label, edge.classes) for edge in edges}
+
+    def test_chain(self):
+        self.make_chain(3)
+        scape = CytoScape.generate_map(self.first_quest, 'Chain')
+
+        nodes = CytoElement.objects.all_for_scape(scape).nodes()
+        self.assertEqual(nodes.count(), 4)
+        self.assertEqual(len(self.edges(scape)), 3)
+        for quest in Quest.objects.filter(name__startswith='Quest'):
+            self.assertIn(quest.get_absolute_url(), scape.elements_json)
+
+    def test_repeatable_quest(self):
+        self.make_chain(1, max_repeats=-1)
+        scape = CytoScape.generate_map(self.first_quest, 'Repeat')
+
+        repeat_edge = CytoElement.objects.get(scape=scape, classes='repeat-edge')
+        self.assertEqual(repeat_edge.label, '∞')
+        self.assertEqual(repeat_edge.data_source, repeat_edge.data_target)
+
+    def test_inactive_quests_are_left_out(self):
+        quests = self.make_chain(2)
+        quests[1].visible_to_students = False
+        quests[1].save()
+
+        scape = CytoScape.generate_map(self.first_quest, 'Drafts')
+
+        self.assertEqual(CytoElement.objects.all_for_scape(scape).nodes().count(), 1)
+
+    def test_nonsequential_campaign(self):
+        """ Quests that share a prereq are connected through their campaign instead """
+        campaign = baker.make(Category, title='Campaign')
+        quest_a = baker.make(Quest, name='A', campaign=campaign)
+        quest_b = baker.make(Quest, name='B', campaign=campaign)
+        for quest in (quest_a, quest_b):
+            Prereq.add_simple_prereq(quest, self.first_quest)
+
+        scape = CytoScape.generate_map(self.first_quest, 'Campaign')
+
+        campaign_node = CytoElement.objects.get(scape=scape, classes='campaign')
+        self.assertCountEqual(
+            CytoElement.objects.filter(data_parent=campaign_node).values_list('label', flat=True),
+            [CytoScape.generate_label(quest_a), CytoScape.generate_label(quest_b)]
+        )
+        first, a, b = (CytoScape.generate_label(quest) for quest in (self.first_quest, quest_a, quest_b))
+        self.assertEqual(self.edges(scape), {
+            (first, campaign_node.label, None),
+            (first, a, 'hidden'),
+            (a, b, 'hidden'),
+        })
+
+    def test_regenerate_replaces_elements(self):
+        self.make_chain(3)
+        scape = CytoScape.generate_map(self.first_quest, 'Chain')
+        elements_json = scape.elements_json
+
+        scape.regenerate()
+
+        self.assertEqual(CytoElement.objects.all_for_scape(scape).count(), 7)
+        self.assertEqual(scape.elements_json.count('"id"'), elements_json.count('"id"'))
+        cached, generated = json.loads(scape.elements_json), json.loads(scape.generate_elements_json())
+        self.assertCountEqual(cached['nodes'], generated['nodes'])
+        self.assertCountEqual(cached['edges'], generated['edges'])
+
+    def test_positions_are_cached(self):
+        """ The nodes are laid out when the map is generated, so the browser doesn't have to """
+        quests = self.make_chain(2)
+        scape = CytoScape.generate_map(self.first_quest, 'Chain')
+
+        positions = {
+            node['data']['Quest']: node['position'] for node in json.loads(scape.elements_json)['nodes']
+        }
+        self.assertCountEqual(positions, [quest.id for quest in quests])
+        self.assertLess(positions[quests[0].id]['y'], positions[quests[1].id]['y'])
+        self.assertLess(positions[quests[1].id]['y'], positions[quests[2].id]['y'])
+
+    def test_queries_dont_grow_with_map_size(self):
+        """ Everything is loaded up front, then saved in bulk """
+        scape = baker.make(CytoScape, initial_content_object=self.first_quest)
+        self.make_chain(3)
+        # so both have existing elements to replace
+        MapCompiler(scape).save()
+        with CaptureQueriesContext(connection) as small_map:
+            MapCompiler(scape).save()
+
+        self.make_chain(20)
+        with CaptureQueriesContext(connection) as large_map:
+            MapCompiler(scape).save()
+
+        self.assertEqual(len(large_map), len(small_map))
+
+    def test_shared_prereq_graph(self):
+        self.make_chain(2)
+        graph = PrereqGraph()
+        scape = CytoScape.generate_map(self.first_quest, 'Chain')
+
+        with self.assertNumQueries(0):
+            nodes, edges = MapCompiler(scape, graph).compile()
+        self.assertEqual(len(nodes), 3)
+        self.assertEqual(len(edges), 2)
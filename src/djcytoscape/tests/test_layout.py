@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase
+
+from djcytoscape.layout import NODE_WIDTH, layered_layout
+
+
+class LayeredLayoutTest(SimpleTestCase):
+
+    def test_empty(self):
+        self.assertEqual(layered_layout([], []), {})
+
+    def test_chain(self):
+        """ A chain is laid out straight down """
+        positions = layered_layout([(1, None), (2, None), (3, None)], [(1, 2, 1), (2, 3, 1)])
+
+        self.assertEqual(len({position['x'] for position in positions.values()}), 1)
+        self.assertLess(positions[1]['y'], positions[2]['y'])
+        self.assertLess(positions[2]['y'], positions[3]['y'])
+
+    def test_branches_dont_overlap(self):
+        positions = layered_layout([(1, None), (2, None), (3, None)], [(1, 2, 1), (1, 3, 1)])
+
+        self.assertEqual(positions[2]['y'], positions[3]['y'])
+        self.assertGreaterEqual(abs(positions[2]['x'] - positions[3]['x']), NODE_WIDTH)
+        # the parent is centered above its branches
+        self.assertEqual(positions[1]['x'], (positions[2]['x'] + positions[3]['x']) / 2)
+
+    def test_cycles_and_repeat_edges(self):
+        positions = layered_layout([(1, None), (2, None)], [(1, 2, 1), (2, 1, 1), (2, 2, 1)])
+
+        self.assertLess(positions[1]['y'], positions[2]['y'])
+
+    def test_min_len(self):
+        """ An edge's minLen is the number of ranks between its nodes """
+        one_rank = layered_layout([(1, None), (2, None)], [(1, 2, 1)])
+        three_ranks = layered_layout([(1, None), (2, None)], [(1, 2, 3)])
+
+        self.assertEqual(three_ranks[2]['y'] - three_ranks[1]['y'], 3 * (one_rank[2]['y'] - one_rank[1]['y']))
+
+    def test_campaigns(self):
+        """ Each campaign's quests are below the edges into the campaign, above the edges out of it,
+        and the campaigns don't overlap """
+        nodes = [(1, None), (10, None), (11, 10), (12, 10), (20, None), (21, 20), (22, 20), (30, None)]
+        edges = [
+            (1, 10, 1), (1, 11, 1), (11, 12, 1),
+            (1, 20, 1), (1, 21, 1), (21, 22, 1),
+            (10, 30, 1), (20, 30, 1),
+        ]
+        positions = layered_layout(nodes, edges)
+
+        self.assertCountEqual(positions, [node_id for node_id, _ in nodes])
+        for campaign_quests in ([11, 12], [21, 22]):
+            # a campaign's chain stays straight
+            self.assertEqual(len({positions[quest]['x'] for quest in campaign_quests}), 1)
+            for quest in campaign_quests:
+                self.assertLess(positions[1]['y'], positions[quest]['y'])
+                self.assertLess(positions[quest]['y'], positions[30]['y'])
+        self.assertGreater(abs(positions[11]['x'] - positions[21]['x']), NODE_WIDTH)
+
+    def test_doesnt_depend_on_order(self):
+        nodes = [(1, None), (10, None), (11, 10), (12, 10), (2, None), (3, None)]
+        edges = [(1, 10, 1), (1, 11, 1), (11, 12, 1), (1, 2, 1), (2, 3, 1), (12, 3, 1)]
+
+        self.assertEqual(layered_layout(nodes, edges), layered_layout(nodes[::-1], edges[::-1]))
@@ -1,5 +1,6 @@
 import json
 from itertools import cycle
+from unittest.mock import patch
 
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
@@ -11,6 +12,7 @@ from model_bakery import baker
 
 # from siteconfig.models import SiteConfig
 from djcytoscape.models import CytoElement, CytoScape, TempCampaign, TempCampaignNode, clean_JSON
+from prerequisites.models import Prereq
 from quest_manager.models import Quest, Category
 
 # from django_tenants.test.client import TenantClient
@@ -184,6 +186,17 @@ class TempCampaignTest(TenantTestCase):
     def test_object_creation(self):
         self.assertIsInstance(self.temp_campaign, TempCampaign)
 
+    def test_get_common_node_ids__in_order(self):
+        """ The common nodes are in the order they were added, not in an order that changes with the hash seed """
+        for node_id in ['quest 1', 'quest 2']:
+            node = TempCampaignNode(node_id)
+            node.prereq_node_ids = ['z', 'a', 'm']
+            node.reliant_node_ids = ['y', 'b', 'n']
+            self.temp_campaign.nodes.append(node)
+
+        self.assertEqual(self.temp_campaign.get_common_prereq_node_ids(), ['z', 'a', 'm'])
+        self.assertEqual(self.temp_campaign.get_common_reliant_node_ids(), ['y', 'b', 'n'])
+
 
 class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
     def setUp(self):
@@ -356,6 +369,40 @@ class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
         self.assertEqual(CytoScape.objects.get_related_maps(self.one_map).count(), 1)
         self.assertEqual(CytoScape.objects.get_related_maps(self.all_maps).count(), 3)
 
+    def test_members(self):
+        """ The map's objects, including campaigns, are kept in the index used by get_related_maps """
+        campaign = baker.make(Category)
+        first = baker.make(Quest)
+        quest = baker.make(Quest, campaign=campaign)
+        quest.add_simple_prereqs([first])
+        scape = CytoScape.generate_map(first, "Map")
+
+        self.assertCountEqual(
+            scape.members.values_list('content_type__model', 'object_id'),
+            [('quest', first.id), ('quest', quest.id), ('category', campaign.id)],
+        )
+        self.assertEqual(list(CytoScape.objects.get_related_maps(campaign)), [scape])
+
+        # replaced when the map is regenerated
+        with patch('djcytoscape.tasks.regenerate_map.apply_async'):
+            quest.prereqs().delete()
+        scape.regenerate()
+        self.assertEqual(list(scape.members.values_list('object_id', flat=True)), [first.id])
+        self.assertFalse(CytoScape.objects.get_related_maps(quest).exists())
+
+    def test_get_maps_affected_by_prereq(self):
+        """ A prereq affects the maps of its parent object and of the objects it requires """
+        map_1 = CytoScape.generate_map(baker.make(Quest), "Map 1")
+        map_2 = CytoScape.generate_map(baker.make(Quest), "Map 2")
+        CytoScape.generate_map(baker.make(Quest), "Map 3")
+        quest = baker.make(Quest)
+
+        prereq = Prereq(parent_object=quest, prereq_object=map_1.initial_content_object)
+        self.assertEqual(list(CytoScape.objects.get_maps_affected_by_prereq(prereq)), [map_1])
+
+        prereq.or_prereq_object = map_2.initial_content_object
+        self.assertCountEqual(CytoScape.objects.get_maps_affected_by_prereq(prereq), [map_1, map_2])
+
     def test_get_maps_as_formatted_string(self):
         """ Checks if `get_maps_as_formatted_string` returns the appropriate formatting per length """
         names = [str(x) for x in range(4)]
@@ -381,3 +428,16 @@ class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
         for index, expected in enumerate(expected_results):
             result = scapes[0:index].get_maps_as_formatted_string()
             self.assertEqual(result, expected)
+
+    def test_ids_by_depth(self):
+        """ Each map comes after the map it links back to """
+        root = baker.make(CytoScape)
+        other_root = baker.make(CytoScape)
+        child = baker.make(CytoScape, parent_scape=root)
+        grandchild = baker.make(CytoScape, parent_scape=child)
+        other_child = baker.make(CytoScape, parent_scape=other_root)
+
+        self.assertEqual(
+            CytoScape.objects.ids_by_depth(),
+            [[root.id, other_root.id], [child.id, other_child.id], [grandchild.id]],
+        )
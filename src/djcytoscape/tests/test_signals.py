@@ -1,9 +1,14 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
 from django_tenants.test.cases import TenantTestCase
 
 from unittest.mock import patch
 from model_bakery import baker
 
-from djcytoscape.models import CytoScape
+from djcytoscape.models import CytoElement, CytoScape
+from djcytoscape.tasks import regenerate_map
 from siteconfig.models import SiteConfig
 from badges.models import Badge
 from quest_manager.models import Quest
@@ -14,18 +19,25 @@ from prerequisites.models import Prereq
 @patch('djcytoscape.tasks.regenerate_map.apply_async')
 class TestRegenerateMapSignals(TenantTestCase):
 
-    def assert_regenerates_map_on_object_change(self, object_, scape, task):
+    def assert_regenerates_map_on_object_change(self, object_, scape, task, structural_change):
         """ Helper function that checks if the `regenerate_map` task is triggered
-        when saving or deleting an object linked to a Cytoscape map """
+        when changing the structure of or deleting an object linked to a Cytoscape map """
 
-        # should regenerate map on save
+        # nothing changed
+        object_.save()
+        self.assertEqual(task.call_count, 0)
+
+        # should regenerate map on a structural change
+        for field, value in structural_change.items():
+            setattr(object_, field, value)
         object_.save()
         self.assertEqual(task.call_count, 1)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
         self.assertEqual(CytoScape.objects.get_related_maps(object_).count(), 1)
 
-        # should regenerate map on delete
+        # should regenerate map on delete, once the pending regeneration has started
         # the CytoElement linked also deleted (cascade). Therefore, no related maps
+        cache.clear()
         object_.delete()
         self.assertEqual(task.call_count, 2)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
@@ -38,12 +50,20 @@ class TestRegenerateMapSignals(TenantTestCase):
         object_.save()
         self.assertEqual(task.call_count, 2)
 
+    def assert_patches_map_on_label_change(self, object_, scape, task):
+        """ Changing the name or XP only updates the object's node, without regenerating the map """
+        object_.name = 'Renamed'
+        object_.xp = 123
+        object_.save()
+
+        self.assertEqual(task.call_count, 0)
+        scape.refresh_from_db()
+        self.assertIn(CytoScape.generate_label(object_), scape.elements_json)
+        self.assertIn(CytoScape.generate_label(object_), CytoElement.objects.filter(scape=scape).values_list('label', flat=True))
+
     def setUp(self):
         self.config = SiteConfig.get()
-
-    def tearDown(self):
-        self.config.map_auto_update = True
-        self.config.save()
+        cache.clear()
 
     def test_badge_regenerate_related_maps(self, task):
         """ Tests if saving and deleting badge triggers `regenerate_map` task.
@@ -52,7 +72,8 @@ class TestRegenerateMapSignals(TenantTestCase):
         badge = baker.make(Badge)
         scape = CytoScape.generate_map(badge, "Map")
 
-        self.assert_regenerates_map_on_object_change(badge, scape, task)
+        self.assert_patches_map_on_label_change(badge, scape, task)
+        self.assert_regenerates_map_on_object_change(badge, scape, task, {'map_transition': True})
 
     def test_quest_regenerate_related_maps(self, task):
         """ Tests if saving and deleting quest triggers `regenerate_map` task.
@@ -61,7 +82,8 @@ class TestRegenerateMapSignals(TenantTestCase):
         quest = baker.make(Quest)
         scape = CytoScape.generate_map(quest, "Map")
 
-        self.assert_regenerates_map_on_object_change(quest, scape, task)
+        self.assert_patches_map_on_label_change(quest, scape, task)
+        self.assert_regenerates_map_on_object_change(quest, scape, task, {'visible_to_students': False})
 
     def test_rank_regenerate_related_maps(self, task):
         """ Tests if saving and deleting rank triggers `regenerate_map` task.
@@ -70,7 +92,8 @@ class TestRegenerateMapSignals(TenantTestCase):
         rank = baker.make(Rank, name="name")  # needs name or generate_map breaks
         scape = CytoScape.generate_map(rank, "Map")
 
-        self.assert_regenerates_map_on_object_change(rank, scape, task)
+        self.assert_patches_map_on_label_change(rank, scape, task)
+        self.assert_regenerates_map_on_object_change(rank, scape, task, {'name': '~Transition'})
 
     def test_prereq_regenerate_related_maps(self, task):
         """ Tests if saving and deleting quest triggers `regenerate_map` task.
@@ -88,7 +111,8 @@ class TestRegenerateMapSignals(TenantTestCase):
         self.assertEqual(task.call_count, 1)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
 
-        # should regenerate map on delete
+        # should regenerate map on delete, once the pending regeneration has started
+        cache.clear()
         prereq.delete()
         self.assertEqual(task.call_count, 2)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
@@ -99,3 +123,55 @@ class TestRegenerateMapSignals(TenantTestCase):
 
         prereq.save()
         self.assertEqual(task.call_count, 2)
+
+    def test_prereq_regenerate_maps_of_required_object(self, task):
+        """ A new prereq on a quest that isn't in any map regenerates the map of the quest it requires """
+        origin = baker.make(Quest, name='origin')
+        scape = CytoScape.generate_map(origin, "Map")
+        quest = baker.make(Quest, name='quest')
+
+        Prereq.add_simple_prereq(quest, origin)
+        self.assertEqual(task.call_count, 1)
+        self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
+
+    def test_regenerations_are_merged(self, task):
+        """ Changes made while a map is waiting to be regenerated are picked up by that regeneration """
+        origin = baker.make(Quest, name='origin')
+        quests = baker.make(Quest, _quantity=3)
+        scape = CytoScape.generate_map(origin, "Map")
+
+        for quest in quests:
+            Prereq.add_simple_prereq(quest, origin)
+
+        task.assert_called_once()
+        self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
+        self.assertEqual(task.call_args.kwargs['countdown'], settings.MAP_REGENERATION_DEBOUNCE)
+
+        # once the regeneration starts, the next change schedules another one
+        with patch('djcytoscape.models.CytoScape.regenerate'):
+            regenerate_map([scape.id])
+        origin.visible_to_students = False
+        origin.save()
+        self.assertEqual(task.call_count, 2)
+
+    def test_patch_repeat_edge(self, task):
+        origin = baker.make(Quest, name='origin')
+        quest = baker.make(Quest, name='quest', max_repeats=0)
+        Prereq.add_simple_prereq(quest, origin)
+        scape = CytoScape.generate_map(origin, "Map")
+        cache.clear()
+
+        quest.max_repeats = -1
+        quest.save()
+        repeat_edge = CytoElement.objects.get(scape=scape, classes='repeat-edge')
+        self.assertEqual(repeat_edge.label, '∞')
+
+        quest.max_repeats = 0
+        quest.save()
+        self.assertFalse(CytoElement.objects.filter(scape=scape, classes='repeat-edge').exists())
+
+        task.assert_not_called()
+        scape.refresh_from_db()
+        cached, generated = json.loads(scape.elements_json), json.loads(scape.generate_elements_json())
+        self.assertCountEqual(cached['edges'], generated['edges'])
+        self.assertCountEqual(cached['nodes'], generated['nodes'])
@@ -1,9 +1,19 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import override_settings
 from django_tenants.test.cases import TenantTestCase
 
 from model_bakery import baker
 
 from djcytoscape.models import CytoScape
-from djcytoscape.tasks import regenerate_map
+from djcytoscape.tasks import regenerate_all_maps, regenerate_map
+from hackerspace_online.celery import app
+from notifications.models import Notification
+
+User = get_user_model()
 
 
 class CytoScapeTaskTests(TenantTestCase):
@@ -33,3 +43,68 @@ class CytoScapeTaskTests(TenantTestCase):
 
         # should be 3 as self.quest got linked to 3 maps
         self.assertEqual(CytoScape.objects.get_related_maps(self.quest).count(), 3)
+
+
+class RegenerateAllMapsTaskTests(TenantTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = baker.make(User, is_staff=True)
+        self.old_celery_always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+
+    def tearDown(self):
+        app.conf.task_always_eager = self.old_celery_always_eager
+
+    @override_settings(MAP_REGENERATION_CONCURRENCY=2)
+    def test_split_between_tasks(self):
+        for origin in baker.make('quest_manager.Quest', _quantity=5):
+            CytoScape.generate_map(origin, "Map")
+
+        with patch('djcytoscape.tasks.regenerate_level_maps.apply_async') as task:
+            regenerate_all_maps.apply(args=[self.teacher.id])
+
+        self.assertEqual(task.call_count, 2)
+        map_ids = [call.kwargs['args'][1] for call in task.call_args_list]
+        self.assertCountEqual(sum(map_ids, []), CytoScape.objects.values_list('id', flat=True))
+
+    @override_settings(MAP_REGENERATION_CONCURRENCY=2)
+    def test_regenerate_all_maps(self):
+        """ A map whose initial object was deleted is deleted before the maps linking back to it are regenerated """
+        root = CytoScape.generate_map(baker.make('quest_manager.Quest'), "Root")
+        bad_map = CytoScape.objects.create(
+            name="bad map",
+            initial_content_type=ContentType.objects.get(app_label='quest_manager', model='quest'),
+            initial_object_id=99999,  # a non-existant object
+        )
+        child = CytoScape.generate_map(baker.make('quest_manager.Quest'), "Child", parent_scape=bad_map)
+        grandchild = CytoScape.generate_map(baker.make('quest_manager.Quest'), "Grandchild", parent_scape=root)
+
+        with patch('djcytoscape.models.CytoScape.regenerate', autospec=True, side_effect=CytoScape.regenerate) as regenerate:
+            regenerate_all_maps.apply(args=[self.teacher.id])
+
+        regenerated = [call.args[0].id for call in regenerate.call_args_list]
+        self.assertCountEqual(regenerated, [root.id, bad_map.id, grandchild.id])
+        self.assertFalse(CytoScape.objects.filter(id__in=[bad_map.id, child.id]).exists())
+
+        notifications = Notification.objects.filter(recipient=self.teacher)
+        self.assertEqual(notifications.filter(verb__startswith='failed').count(), 1)
+        self.assertEqual(notifications.filter(verb__startswith='completed').count(), 1)
+
+    def test_regenerate_all_maps__map_fails(self):
+        """ An error regenerating one map is logged, and the other maps and levels are still regenerated """
+        root = CytoScape.generate_map(baker.make('quest_manager.Quest'), "Root")
+        child = CytoScape.generate_map(baker.make('quest_manager.Quest'), "Child", parent_scape=root)
+
+        def regenerate(scape, prereq_graph=None):
+            if scape.id == root.id:
+                raise RuntimeError("broken map")
+
+        with patch('djcytoscape.models.CytoScape.regenerate', autospec=True, side_effect=regenerate) as regenerate_mock, \
+                self.assertLogs('djcytoscape.tasks', level='ERROR'):
+            regenerate_all_maps.apply(args=[self.teacher.id])
+
+        regenerated = [call.args[0].id for call in regenerate_mock.call_args_list]
+        self.assertCountEqual(regenerated, [root.id, child.id])
+        notifications = Notification.objects.filter(recipient=self.teacher)
+        self.assertEqual(notifications.filter(verb__startswith='completed').count(), 1)
@@ -18,6 +18,7 @@ from quest_manager.models import QuestSubmission, Quest
 from siteconfig.models import SiteConfig
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 
+from .compiler import PrereqGraph
 from .models import CytoScape
 from .forms import GenerateQuestMapForm, QuestMapForm
 from .tasks import regenerate_all_maps
@@ -229,11 +230,14 @@ def regenerate_all(request):
         messages.warning(request, "You have a lot of maps, so the map regeneration is being processed in the background. It may take a few minutes.")  # noqa
         regenerate_all_maps.apply_async(args=[request.user.id], queue='default')
     else:
-        for scape in CytoScape.objects.all():
-            try:
-                scape.regenerate()
-            except scape.InitialObjectDoesNotExist:
-                messages.warning(request, f"The initial object for the '{scape.name} Map' no longer exists. The map has now been removed too.")
+        # in the same order as regenerate_all_maps, so maps linking back to a deleted map are deleted with it
+        prereq_graph = PrereqGraph()
+        for map_ids in CytoScape.objects.ids_by_depth():
+            for scape in CytoScape.objects.filter(id__in=map_ids):
+                try:
+                    scape.regenerate(prereq_graph)
+                except scape.InitialObjectDoesNotExist:
+                    messages.warning(request, f"The initial object for the '{scape.name} Map' no longer exists. The map has now been removed too.")
 
         messages.success(request, "All valid quest maps have been regenerated.")
 
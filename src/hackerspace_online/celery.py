@@ -43,6 +43,13 @@ app.conf.beat_schedule = {
             "queue": "default",
         }
     },
+    "Update cached fields of the tenants for the admin daily task": {
+        "task": "tenant.tasks.update_cached_fields_in_all_schemas",
+        "schedule": crontab(minute=30, hour=1),
+        "options": {
+            "queue": "default",
+        }
+    },
 }
 
 
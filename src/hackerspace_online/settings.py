@@ -348,10 +348,50 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_MAX_RETRIES = 10
 CELERY_TASKS_BUNCH_SIZE = 10
 
+# Bulk updates of the cache of available quests (see prerequisites.tasks):
+# number of users evaluated and written together, and number of tasks the users are split between.
+CONDITIONS_UPDATE_CHUNK_SIZE = 500
+CONDITIONS_UPDATE_PARALLELISM = 1
+
 # allowed delay between conditions met updates for all users:
 # In sec., wait before start next 'big' update for all conditions, if it's going to start - all other updates could be skipped
 CONDITIONS_UPDATE_COUNTDOWN = 60 * 1
 
+# In sec., how long updates of the same quest's conditions are merged before they start, see prerequisites.scheduler
+CONDITIONS_UPDATE_DEBOUNCE = 5
+
+# In sec., how long a student's XP progress chart is cached for, 0 to disable.  Cleared when the student's XP changes.
+PROGRESS_CHART_CACHE_TIMEOUT = 60 * 60
+
+# Number of notifications inserted per query when one is sent to many users at once, e.g. for an announcement
+NOTIFICATIONS_BULK_CREATE_BATCH_SIZE = 500
+
+# The daily notification emails (see notifications.tasks): number of users whose emails are built together,
+# number of emails sent together, and how many times a batch that failed to send is retried
+NOTIFICATION_EMAILS_CHUNK_SIZE = 200
+NOTIFICATION_EMAILS_BATCH_SIZE = 50
+NOTIFICATION_EMAILS_RETRIES = 2
+
+# The nightly jobs that run on every tenant (see tenant.scheduler): number of tasks the tenants are split between,
+# the queue those tasks are sent to, in sec., how long one of them runs before continuing in a new task, and in days,
+# how long the record of each job's run on each tenant is kept
+TENANT_JOBS_CONCURRENCY = 3
+TENANT_JOBS_QUEUE = 'default'
+TENANT_JOBS_TIME_BUDGET = 60 * 10
+TENANT_JOB_RUNS_RETENTION_DAYS = 30
+
+# Number of tenants whose SiteConfig each process keeps in memory on top of the shared cache, see SiteConfig.get()
+SITECONFIG_LOCAL_CACHE_SIZE = 200
+
+# In sec., how long structural changes to the same map (e.g. a quest's prereqs or campaign) are merged before the map is
+# regenerated, see djcytoscape.tasks.schedule_map_regeneration()
+MAP_REGENERATION_DEBOUNCE = 10
+
+# Regenerating all maps (see djcytoscape.tasks.regenerate_all_maps): number of tasks each level of maps is split between,
+# and in sec., how long a level's tasks can take before the level is considered done
+MAP_REGENERATION_CONCURRENCY = 4
+MAP_REGENERATION_RUN_TIMEOUT = 60 * 60
+
 
 # DATABASES #######################################################
 
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from notifications.models import Notification
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the pre-rendered text of notifications created before it was stored, "
+        "so they can be displayed without fetching their sender, target and action objects"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of notifications rendered and saved together'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = ['rendered', 'sender_text', 'target_text', 'action_text', 'target_url']
+        qs = Notification.objects.filter(rendered=False).order_by('id')
+
+        num_rendered = 0
+        last_id = 0
+        while True:
+            # the generic relations are prefetched with one query per content type
+            notifications = list(
+                qs.filter(id__gt=last_id).prefetch_related('sender_object', 'target_object', 'action_object')[:batch_size]
+            )
+            if not notifications:
+                break
+
+            for notification in notifications:
+                notification.render()
+            Notification.objects.bulk_update(notifications, fields)
+
+            num_rendered += len(notifications)
+            last_id = notifications[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {num_rendered} notifications'))
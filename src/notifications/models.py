@@ -2,8 +2,11 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.html import strip_tags
@@ -16,6 +19,17 @@ from .signals import notify
 # Create your models here.
 
 
+UNREAD_COUNTS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def unread_counts_cache_key(user_id):
+    return f'notifications-unread-counts-{user_id}'
+
+
+def invalidate_unread_counts(user_id):
+    cache.delete(unread_counts_cache_key(user_id))
+
+
 class UserNotificationOptionSet(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     quest_approved_without_comment = models.BooleanField(default=True)
@@ -51,11 +65,13 @@ class NotificationQuerySet(models.query.QuerySet):
         qs = self.get_unread().get_user(recipient)
         qs.update(unread=False)
         qs.update(time_read=timezone.now())
+        invalidate_unread_counts(recipient.id)
 
     def mark_all_unread(self, recipient):
         qs = self.get_read().get_user(recipient)
         qs.update(unread=True)
         qs.update(time_read=None)
+        invalidate_unread_counts(recipient.id)
 
     def get_unread(self):
         return self.filter(unread=True)
@@ -77,6 +93,22 @@ class NotificationManager(models.Manager):
     def all_read(self, user):
         return self.get_queryset().get_user(user).get_read()
 
+    def unread_counts(self, user):
+        """
+        The numbers shown in the navbar's notification and announcement badges, which are polled by every open page.
+        They are cached until one of the user's notifications is saved or deleted, so polling doesn't hit the database.
+        :return: a dict with the number of unread notifications, and how many of them are about announcements
+        """
+        def count():
+            unread = self.all_unread(user).order_by()
+            return {
+                'count': unread.count(),
+                'announcements_count': unread.filter(
+                    target_content_type=ContentType.objects.get_by_natural_key('announcements', 'announcement')
+                ).count(),
+            }
+        return cache.get_or_set(unread_counts_cache_key(user.id), count, UNREAD_COUNTS_CACHE_TIMEOUT)
+
     def all_for_user(self, user):
         # self.get_queryset().mark_targetless(user)
         return self.get_queryset().get_user(user)
@@ -124,6 +156,15 @@ class Notification(models.Model):
     unread = models.BooleanField(default=True)
     time_read = models.DateTimeField(null=True, blank=True)
 
+    # The text of the sender, target and action objects, rendered once when the notification is created (see render())
+    # so displaying or emailing it doesn't need to fetch them.  Older notifications are rendered by the
+    # render_notifications command, or when they are displayed until then.
+    rendered = models.BooleanField(default=False)
+    sender_text = models.TextField(null=True, blank=True)
+    target_text = models.TextField(null=True, blank=True)
+    action_text = models.TextField(null=True, blank=True)
+    target_url = models.CharField(max_length=500, null=True, blank=True)
+
     objects = NotificationManager()
 
     def html_strip(string, char_limit=50, tag_size=1, resize_image=True, image_height=20, **kwargs) -> str:
@@ -197,35 +238,53 @@ class Notification(models.Model):
 
         return text + ("..." if limit_imposed else "")
 
-    def __str__(self):
+    @staticmethod
+    def render_text(verb, sender, target=None, action=None):
+        """
+        :return: the values of the pre-rendered text fields for a notification about these objects
+        """
         try:
-            target_url = self.target_object.get_absolute_url()
-
-            # Is this the right place to do this?
-            if 'commented on' in self.verb:
-                target_url += f'#comment-{self.action_object_id}'
+            target_url = target.get_absolute_url()
         except AttributeError:
             target_url = None
+        else:
+            # Is this the right place to do this?
+            if 'commented on' in verb:
+                target_url += f'#comment-{getattr(action, "id", None)}'
+
+        return {
+            'rendered': True,
+            'sender_text': str(sender),
+            'target_text': str(target) if target else None,
+            # uses custom strip
+            'action_text': Notification.html_strip(action) if action else None,
+            'target_url': target_url,
+        }
 
-        action = self.action_object
+    def render(self):
+        """ Fills in the pre-rendered text fields from the sender, target and action objects, without saving """
+        fields = Notification.render_text(self.verb, self.sender_object, self.target_object, self.action_object)
+        for field, value in fields.items():
+            setattr(self, field, value)
 
-        # uses custom strip
-        action = Notification.html_strip(action)
+    def __str__(self):
+        if not self.rendered:
+            self.render()
 
         # absolute url needed for when notifications are sent via email
         root_url = get_root_url()
         context = {
-            "sender": self.sender_object,
+            "sender": self.sender_text,
             "verb": self.verb,
-            "action": action,  # notif text
-            "target": self.target_object,  # basically quest name
+            "action": self.action_text,  # notif text
+            "target": self.target_text,  # basically quest name
             "verify_read": "{}{}".format(root_url, reverse('notifications:read', kwargs={"id": self.id})),
-            "target_url": target_url,
+            "target_url": self.target_url,
         }
 
         url_common_part = "%(sender)s %(verb)s <a href='%(verify_read)s?next=%(target_url)s'>" % context
-        if self.target_object:
-            if self.action_object:
+        if self.target_text is not None:
+            if self.action_text is not None:
                 url = url_common_part + ' <em>%(target)s</em> with "%(action)s"</a>' % context
             else:
                 url = url_common_part + " <em>%(target)s</em></a>" % context
@@ -239,53 +298,32 @@ class Notification(models.Model):
         self.save()
 
     def get_url(self):
-        # print("***** NOTIFICATION.get_url **********")
-        try:
-            target_url = self.target_object.get_absolute_url()
-
-            if 'commented on' in self.verb:
-                target_url += f'#comment-{self.action_object_id}'
-        except:  # noqa
-            # TODO make this except explicit, don't remember what it's doing
-            target_url = reverse('notifications:list')
+        if not self.rendered:
+            self.render()
 
         context = {
             "verify_read": reverse('notifications:read', kwargs={"id": self.id}),
-            "target_url": target_url
+            "target_url": self.target_url or reverse('notifications:list'),
         }
 
         return "%(verify_read)s?next=%(target_url)s" % context
 
     def get_link(self):
-        # print("***** NOTIFICATION.get_link **********")
-        # try:
-        #     target_url = self.target_object.get_absolute_url()
-        # except:
-        #     target_url = reverse('notifications:list')
-
-        # if len(str(self.action_object)) > 50:
-        #     action = str(self.action_object)[:50] + "..."
-        # else:
-        #     action = str(self.action_object)
-
-        # action = strip_tags(action)
-
-        action = Notification.html_strip(str(self.action_object))
+        if not self.rendered:
+            self.render()
 
         context = {
-            "sender": self.sender_object,
+            "sender": self.sender_text,
             "verb": self.verb,
-            "action": action,
-            "target": self.target_object,
-            # "verify_read": reverse('notifications:read', kwargs={"id":self.id}),
-            # "target_url": target_url,
+            "action": self.action_text,
+            "target": self.target_text,
             "url": self.get_url(),
             "icon": self.font_icon
         }
 
         url_common_part = "<a href='%(url)s'>%(icon)s&nbsp;&nbsp; %(sender)s %(verb)s" % context
-        if self.target_object:
-            if self.action_object:
+        if self.target_text is not None:
+            if self.action_text is not None:
                 url = url_common_part + ' <em>%(target)s</em> with "%(action)s"</a>' % context
             else:
                 url = url_common_part + " <em>%(target)s</em></a>" % context
@@ -327,35 +365,47 @@ def new_notification(sender, **kwargs):
     if affected_users is None:
         affected_users = [recipient, ]
 
-    for u in affected_users:
-        # don't send a notification to yourself/themself
-        if u == sender:
+    # The fields shared by every affected user's notification are worked out once, and the notifications are
+    # inserted together, since e.g. an announcement notifies every student in the active semester
+    shared_fields = {
+        'verb': verb,
+        'sender_content_type': ContentType.objects.get_for_model(sender),
+        'sender_object_id': sender.id,
+        'font_icon': icon,
+    }
+    related_objects = {}
+    # Set the target if provided.
+    for option in ("target", "action"):
+        # obj = kwargs.pop(option, None) #don't want to remove option with pop
+        try:
+            obj = kwargs[option]
+            if obj is not None:
+                shared_fields["%s_content_type" % option] = ContentType.objects.get_for_model(obj)
+                shared_fields["%s_object_id" % option] = obj.id
+                related_objects[option] = obj
+        except:  # noqa
+            # TODO make this except explicit, don't remember what it's doing
             pass
-        else:
-            new_note = Notification(
-                recipient=u,
-                verb=verb,
-                sender_content_type=ContentType.objects.get_for_model(sender),
-                sender_object_id=sender.id,
-                font_icon=icon,
-            )
-            # Set the target if provided.
-            for option in ("target", "action"):
-                # obj = kwargs.pop(option, None) #don't want to remove option with pop
-                try:
-                    obj = kwargs[option]
-                    if obj is not None:
-                        setattr(new_note, "%s_content_type" % option, ContentType.objects.get_for_model(obj))
-                        setattr(new_note, "%s_object_id" % option, obj.id)
-                except:  # noqa
-                    # TODO make this except explicit, don't remember what it's doing
-                    pass
-            new_note.save()
+    shared_fields.update(Notification.render_text(verb, sender, **related_objects))
+
+    # don't send a notification to yourself/themself
+    new_notes = [Notification(recipient=u, **shared_fields) for u in affected_users if u != sender]
+
+    # bulk_create doesn't send post_save, see notification_changed_receiver()
+    Notification.objects.bulk_create(new_notes, batch_size=settings.NOTIFICATIONS_BULK_CREATE_BATCH_SIZE)
+    cache.delete_many([unread_counts_cache_key(note.recipient_id) for note in new_notes])
 
 
 notify.connect(new_notification)
 
 
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def notification_changed_receiver(sender, instance, **kwargs):
+    """ The recipient's unread counts may have changed, e.g. a new notification or one marked read """
+    invalidate_unread_counts(instance.recipient_id)
+
+
 def deleted_object_receiver(sender, **kwargs):
     # Printing was causing and ASCII/Unicode error on the production server...I think
     # print("************delete signal ****************")
@@ -1,71 +1,138 @@
+import logging
+import smtplib
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
-from django_tenants.utils import get_tenant_model, tenant_context
 
+from courses.models import CourseStudent
 from hackerspace_online.celery import app
 from quest_manager.models import QuestSubmission
 
 from profile_manager.models import Profile
 
 from siteconfig.models import SiteConfig
+from tenant.scheduler import run_on_all_schemas
+from tenant.utils import get_root_url
 
 from .models import Notification
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 
 @app.task(name='notifications.tasks.email_notification_to_users_on_all_schemas')
 def email_notification_to_users_on_all_schemas():
-    for tenant in get_tenant_model().objects.exclude(schema_name='public'):
-        with tenant_context(tenant):
-            root_url = tenant.get_root_url()
-            email_notifications_to_users_on_schema.apply_async(args=[root_url], queue='default')
-
-    return "Scheduled email_notifications_to_users_on_schema for all schemas"
-
-
-@app.task(name='notifications.tasks.email_notifications_to_users_on_schema')
-def email_notifications_to_users_on_schema(root_url):
-
-    notification_emails = get_notification_emails(root_url)
-    connection = mail.get_connection()
-    connection.send_messages(notification_emails)
-    # send_email_notification_tenant.delay(root_url)
+    """ Runs email_notifications_to_users() on each schema, see tenant.scheduler """
+    num_tasks = run_on_all_schemas('notifications.tasks.email_notifications_to_users')
 
-    return f"Sent {len(notification_emails)} notification emails"
+    return f"Scheduled email_notifications_to_users for all schemas in {num_tasks} tasks"
 
 
-def get_notification_emails(root_url):
-    users_to_email = Profile.objects.get_mailing_list(for_notification_email=True)
+def email_notifications_to_users(root_url=None):
+    """ Sends the daily notification emails of the current schema
 
-    notification_emails = []
+    :param root_url: the tenant's url the emails link to, defaults to the current schema's
+    :return: the number of emails sent
+    """
+    return send_in_batches(iter_notification_emails(root_url or get_root_url()))
 
-    for user in users_to_email:
-        email = generate_notification_email(user, root_url)
-        if email:
-            notification_emails.append(email)
 
-    return notification_emails
+@app.task(name='notifications.tasks.email_notifications_to_users_on_schema')
+def email_notifications_to_users_on_schema(root_url):
+    """ Kept for the tasks queued before the emails were sent through tenant.scheduler, see email_notifications_to_users() """
+    num_sent = email_notifications_to_users(root_url)
+    return f"Sent {num_sent} notification emails"
+
+
+def batches(iterable, size):
+    """ Yields successive lists of `size` items, without needing the whole iterable at once """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def send_in_batches(emails, batch_size=None, retries=None):
+    """
+    Sends the emails over a single connection, a batch at a time, so they don't all need to be built first.
+    A batch that fails is retried on a new connection.
+
+    :return: the number of emails sent
+    """
+    batch_size = batch_size or settings.NOTIFICATION_EMAILS_BATCH_SIZE
+    retries = settings.NOTIFICATION_EMAILS_RETRIES if retries is None else retries
+
+    num_sent = 0
+    with mail.get_connection() as email_connection:
+        for batch in batches(emails, batch_size):
+            for attempt in range(retries + 1):
+                try:
+                    num_sent += email_connection.send_messages(batch) or 0
+                    break
+                except (smtplib.SMTPException, OSError):
+                    if attempt == retries:
+                        raise
+                    logger.warning(f"Failed to send a batch of {len(batch)} notification emails, retrying", exc_info=True)
+                    email_connection.close()
+                    email_connection.open()
+    return num_sent
+
+
+def iter_notification_emails(root_url, chunk_size=None):
+    """
+    Generates the notification emails for everyone on the mailing list, a chunk of users at a time.
+    The unread notifications and current courses of each chunk are fetched together instead of for each user.
+    """
+    chunk_size = chunk_size or settings.NOTIFICATION_EMAILS_CHUNK_SIZE
+    user_ids = list(Profile.objects.get_mailing_list(for_notification_email=True).order_by('id').values_list('id', flat=True))
+
+    for i in range(0, len(user_ids), chunk_size):
+        users = list(User.objects.filter(id__in=user_ids[i:i + chunk_size]).select_related('profile').order_by('id'))
+
+        unread_notifications = defaultdict(list)
+        for notification in Notification.objects.get_queryset().get_unread().filter(recipient__in=users):
+            unread_notifications[notification.recipient_id].append(notification)
+        current_courses = CourseStudent.objects.current_courses_values_per_user(users, 'id')
+
+        for user in users:
+            email = generate_notification_email(
+                user, root_url,
+                unread_notifications=unread_notifications[user.id],
+                has_current_course=bool(current_courses.get(user.id)),
+            )
+            if email:
+                yield email
+
+
+def generate_notification_email(user, root_url, unread_notifications=None, has_current_course=None):
+    """Generate an email notification from user
+
+    :param unread_notifications: the user's unread notifications, if already fetched
+    :param has_current_course: whether the user is enrolled in the active semester, if already known
+    """
+    if has_current_course is None:
+        has_current_course = user.profile.has_current_course
 
+    # Do not generate email notification for users that are not currently enrolled
+    if not user.is_staff and not has_current_course:
+        return None
 
-def generate_notification_email(user, root_url):
-    """Generate an email notification from user"""
     html_template = get_template('notifications/email_notifications.html')
     subject = f'{SiteConfig.get().site_name_short} Notifications'
     to_email_address = user.email
-    unread_notifications = Notification.objects.all_unread(user)
+    if unread_notifications is None:
+        unread_notifications = Notification.objects.all_unread(user)
     submissions_awaiting_approval = None
 
     if user.is_staff:
         submissions_awaiting_approval = QuestSubmission.objects.all_awaiting_approval(teacher=user)
 
-    # Do not generate email notification for users that are not currently enrolled
-    if not user.is_staff and not user.profile.has_current_course:
-        return None
-
     if unread_notifications or submissions_awaiting_approval:
         text_content = str(unread_notifications)
 
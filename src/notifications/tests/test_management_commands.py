@@ -0,0 +1,31 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from notifications.models import Notification
+
+User = get_user_model()
+
+
+class RenderNotificationsCommandTest(TenantTestCase):
+
+    def test_render_notifications(self):
+        """ Notifications that weren't rendered when they were created are rendered the same way """
+        teacher = baker.make(User, is_staff=True)
+        announcement = baker.make('announcements.Announcement')
+        old = [
+            baker.make(Notification, recipient=baker.make(User), sender_object=teacher, target_object=announcement)
+            for _ in range(3)
+        ]
+        expected_links = [notification.get_link() for notification in old]
+
+        out = StringIO()
+        call_command('render_notifications', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Rendered 3 notifications', out.getvalue())
+        notifications = Notification.objects.filter(id__in=[notification.id for notification in old]).order_by('id')
+        self.assertTrue(all(notification.rendered for notification in notifications))
+        self.assertEqual([notification.get_link() for notification in notifications], expected_links)
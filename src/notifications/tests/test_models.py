@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import override_settings
 
 from django_tenants.test.cases import TenantTestCase
 from unittest import TestCase
@@ -8,10 +10,12 @@ from model_bakery.recipe import Recipe
 from notifications.models import Notification, new_notification
 
 
+User = get_user_model()
+
+
 class NotificationModelTest(TenantTestCase):
 
     def setUp(self):
-        User = get_user_model()
         self.teacher = Recipe(User, is_staff=True).make()  # need a teacher or student creation will fail.
         self.student = baker.make(User)
         self.notification = baker.make(Notification)
@@ -29,6 +33,22 @@ class NotificationModelTest(TenantTestCase):
         notification.mark_read()
         self.assertFalse(notification.unread)
 
+    def test_unread_counts(self):
+        """ The counts are cached until one of the user's notifications changes """
+        announcement = baker.make('announcements.Announcement')
+        baker.make(Notification, recipient=self.student)
+        baker.make(Notification, recipient=self.student, target_object=announcement)
+        self.assertEqual(Notification.objects.unread_counts(self.student), {'count': 2, 'announcements_count': 1})
+
+        with self.assertNumQueries(0):
+            Notification.objects.unread_counts(self.student)
+
+        Notification.objects.all_for_user(self.student).mark_all_read(self.student)
+        self.assertEqual(Notification.objects.unread_counts(self.student), {'count': 0, 'announcements_count': 0})
+
+        baker.make(Notification, recipient=self.student)
+        self.assertEqual(Notification.objects.unread_counts(self.student)['count'], 1)
+
     def test_new_notification(self):
         """
         def new_notification(sender, **kwargs):
@@ -65,6 +85,44 @@ class NotificationModelTest(TenantTestCase):
         notes_unread = Notification.objects.all_unread(self.student)
         self.assertEqual(notes_unread.count(), 1)
 
+    def test_new_notification__rendered_text(self):
+        """ The text is rendered when the notification is created, so displaying it doesn't need the related objects """
+        announcement = baker.make('announcements.Announcement', title='Big news')
+        comment = baker.make('comments.Comment', text='<p>So <b>exciting</b></p>')
+        new_notification(self.teacher, target=announcement, action=comment, recipient=self.student, verb='commented on')
+
+        notification = Notification.objects.get(recipient=self.student)
+        self.assertTrue(notification.rendered)
+        self.assertEqual(notification.sender_text, str(self.teacher))
+        self.assertEqual(notification.target_text, 'Big news')
+        self.assertEqual(notification.action_text, 'So exciting')
+        self.assertEqual(notification.target_url, f'{announcement.get_absolute_url()}#comment-{comment.id}')
+
+        with self.assertNumQueries(0):
+            link = notification.get_link()
+        text = str(notification)
+        self.assertIn('<em>Big news</em> with "So exciting"', link)
+        self.assertIn(f'next={notification.target_url}', text)
+
+    @override_settings(NOTIFICATIONS_BULK_CREATE_BATCH_SIZE=2)
+    def test_new_notification__affected_users(self):
+        """ Every affected user except the sender is notified, with the notifications inserted in batches """
+        students = baker.make(User, _quantity=5)
+        announcement = baker.make('announcements.Announcement')
+        for student in students:
+            Notification.objects.unread_counts(student)  # cached
+        ContentType.objects.get_for_models(User, announcement)  # cached too
+
+        with self.assertNumQueries(3):
+            new_notification(
+                self.teacher, target=announcement, recipient=self.teacher, affected_users=students + [self.teacher], verb='posted'
+            )
+
+        self.assertEqual(Notification.objects.filter(target_object_id=announcement.id).count(), 5)
+        self.assertFalse(Notification.objects.filter(recipient=self.teacher).exists())
+        for student in students:
+            self.assertEqual(Notification.objects.unread_counts(student), {'count': 1, 'announcements_count': 1})
+
     def test_url_correct_comment_hash(self):
         """ Checks if instances where an url is given. There is a corresponding comment hash with it
         ie. url...#comment-id.
@@ -1,5 +1,11 @@
+import smtplib
+
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
 from model_bakery import baker
@@ -7,7 +13,7 @@ from django_tenants.test.cases import TenantTestCase
 
 from notifications import tasks
 from notifications.models import Notification
-from notifications.tasks import generate_notification_email, get_notification_emails
+from notifications.tasks import generate_notification_email, iter_notification_emails
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -37,12 +43,12 @@ class NotificationTasksTests(TenantTestCase):
         baker.make('courses.CourseStudent', user=self.test_student1, semester=self.sem)
         baker.make('courses.CourseStudent', user=self.test_student2, semester=self.sem)
 
-    def test_get_notification_emails(self):
+    def test_iter_notification_emails(self):
         """ Test that the correct list of notification emails are generated"""
         root_url = f'https://{self.get_test_tenant_domain()}'
 
         # 0 notifications to start
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(type(emails), list)
         self.assertEqual(len(emails), 0)
 
@@ -51,7 +57,7 @@ class NotificationTasksTests(TenantTestCase):
 
         # Create a notification for student 1, but they have emails turned off by default
         notification1 = baker.make(Notification, recipient=self.test_student1)
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(len(emails), 0)
 
         # Turn on notification emails for student1, now it should appear and add them to the list of emails
@@ -62,7 +68,7 @@ class NotificationTasksTests(TenantTestCase):
         self.test_student1.profile.get_notifications_by_email = True
         self.test_student1.profile.save()
 
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
 
         self.assertEqual(len(emails), 1)
         self.assertEqual(emails[0].to, [self.test_student1.email])
@@ -73,13 +79,13 @@ class NotificationTasksTests(TenantTestCase):
         self.test_student2.profile.get_notifications_by_email = True
         self.test_student2.profile.save()
 
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(len(emails), 1)
         self.assertEqual(emails[0].to, [self.test_student1.email])
 
         # Make a bunch of notifications for student2, so now we should have 2 emails
         baker.make(Notification, recipient=self.test_student2, _quantity=10)
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
 
         self.assertEqual(len(emails), 2)
         self.assertEqual(emails[0].to, [self.test_student1.email])
@@ -88,7 +94,7 @@ class NotificationTasksTests(TenantTestCase):
         # mark the original notification as read, so only student2 email now
         notification1.unread = False
         notification1.save()
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(len(emails), 1)
         self.assertEqual(emails[0].to, [self.test_student2.email])
 
@@ -151,7 +157,7 @@ class NotificationTasksTests(TenantTestCase):
         root_url = 'https://test.com'
 
         # 0 notifications to start
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(type(emails), list)
         self.assertEqual(len(emails), 0)
 
@@ -163,5 +169,67 @@ class NotificationTasksTests(TenantTestCase):
         inactive_student.profile.save()
 
         # Should not get email because they are not enrolled in any courses
-        emails = get_notification_emails(root_url)
+        emails = list(iter_notification_emails(root_url))
         self.assertEqual(len(emails), 0)
+
+    def test_send_in_batches(self):
+        emails = (EmailMultiAlternatives('Subject', 'Body', to=[f'user{i}@email.com']) for i in range(5))
+
+        num_sent = tasks.send_in_batches(emails, batch_size=2)
+
+        self.assertEqual(num_sent, 5)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_send_in_batches__retries_failed_batch(self):
+        emails = [EmailMultiAlternatives('Subject', 'Body', to=[f'user{i}@email.com']) for i in range(3)]
+        send_messages = locmem.EmailBackend.send_messages
+        batches_sent = []
+
+        def disconnect_once(backend, messages):
+            batches_sent.append(messages)
+            if len(batches_sent) == 1:
+                raise smtplib.SMTPServerDisconnected()
+            return send_messages(backend, messages)
+
+        with patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=disconnect_once):
+            num_sent = tasks.send_in_batches(emails, batch_size=2, retries=1)
+
+        self.assertEqual(num_sent, 3)
+        self.assertEqual([len(batch) for batch in batches_sent], [2, 2, 1])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_send_in_batches__gives_up_after_retries(self):
+        emails = [EmailMultiAlternatives('Subject', 'Body', to=['user@email.com'])]
+
+        with patch.object(locmem.EmailBackend, 'send_messages', side_effect=smtplib.SMTPServerDisconnected()):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                tasks.send_in_batches(emails, retries=1)
+
+    def test_iter_notification_emails__queries_per_chunk(self):
+        """ The number of queries doesn't grow with the number of students in a chunk """
+        from allauth.account.models import EmailAddress
+
+        def add_student():
+            student = baker.make(User)
+            student.email = f'student{student.id}@email.com'
+            student.save()
+            EmailAddress.objects.create(user=student, email=student.email, verified=True, primary=True)
+            baker.make('courses.CourseStudent', user=student, semester=self.sem)
+            student.profile.get_notifications_by_email = True
+            student.profile.save()
+            baker.make(Notification, recipient=student, _quantity=2)
+
+        def count_queries():
+            # rendering each notification looks up the tenant's root url, which isn't what's being tested here
+            with patch('notifications.models.get_root_url', return_value='https://test.com'):
+                with CaptureQueriesContext(connection) as queries:
+                    emails = list(tasks.iter_notification_emails('https://test.com'))
+            return len(emails), len(queries)
+
+        add_student()
+        num_emails, num_queries = count_queries()
+        self.assertEqual(num_emails, 1)
+
+        add_student()
+        add_student()
+        self.assertEqual(count_queries(), (3, num_queries))
@@ -6,6 +6,7 @@ from django_tenants.test.client import TenantClient
 from model_bakery import baker
 
 from hackerspace_online.tests.utils import ViewTestUtilsMixin
+from notifications.models import Notification
 
 User = get_user_model()
 
@@ -119,3 +120,27 @@ class NotificationViewTests(ViewTestUtilsMixin, TenantTestCase):
             HTTP_X_REQUESTED_WITH='XMLHttpRequest',
         )
         self.assertEqual(response.status_code, 200)
+
+    def test_ajax_unread_counts(self):
+        """ The counts are returned with an ETag, and a 304 if they haven't changed since """
+        self.client.force_login(self.test_student1)
+        Notification.objects.all_for_user(self.test_student1).delete()
+        baker.make('notifications.Notification', recipient=self.test_student1, _quantity=2)
+
+        response = self.client.get(reverse('notifications:ajax_unread_counts'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'count': 2, 'announcements_count': 0})
+        etag = response['ETag']
+
+        response = self.client.get(
+            reverse('notifications:ajax_unread_counts'), HTTP_X_REQUESTED_WITH='XMLHttpRequest', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # a new notification changes the counts
+        baker.make('notifications.Notification', recipient=self.test_student1)
+        response = self.client.get(
+            reverse('notifications:ajax_unread_counts'), HTTP_X_REQUESTED_WITH='XMLHttpRequest', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
@@ -10,5 +10,6 @@ urlpatterns = [
     re_path(r'^read/(?P<id>\d+)/$', views.read, name='read'),  # function based view
     re_path(r'^read/all/$', views.read_all, name='read_all'),  # function based view
     re_path(r'^ajax/$', views.ajax, name='ajax'),  # function based view
+    re_path(r'^ajax/counts/$', views.ajax_unread_counts, name='ajax_unread_counts'),  # function based view
     re_path(r'^ajax/mark/read/$', views.ajax_mark_read, name='ajax_mark_read'),  # function based view
 ]
@@ -8,6 +8,7 @@ from django.http import HttpResponse, JsonResponse
 from django.shortcuts import Http404, HttpResponseRedirect, redirect, render
 from django.urls import reverse
 from django.utils import timezone
+from django.views.decorators.http import condition
 from tenant.views import non_public_only_view
 
 from hackerspace_online.decorators import xml_http_request_required
@@ -96,11 +97,9 @@ def ajax(request):
         # the bottom of the screen and can't get the links at the bottom...
         notifications = notifications[:limit]
         notes = []
+        announcement_content_type = ContentType.objects.get_by_natural_key('announcements', 'announcement')
         for note in notifications:
-            removable = note.target_content_type != ContentType.objects.get(
-                app_label="announcements",
-                model='announcement'
-            )
+            removable = note.target_content_type_id != announcement_content_type.id
             notes.append(
                 {
                     'link': str(note.get_link()),
@@ -121,6 +120,21 @@ def ajax(request):
         raise Http404
 
 
+def unread_counts_etag(request):
+    counts = Notification.objects.unread_counts(request.user)
+    return f"{request.user.id}-{counts['count']}-{counts['announcements_count']}"
+
+
+@xml_http_request_required
+@non_public_only_view
+@login_required
+@condition(etag_func=unread_counts_etag)
+def ajax_unread_counts(request):
+    """ The numbers for the navbar's notification badges.  Polled by every open page, so the counts are cached and
+    a 304 Not Modified is returned if they haven't changed since the page's last request (using the ETag) """
+    return JsonResponse(data=Notification.objects.unread_counts(request.user))
+
+
 @xml_http_request_required
 @non_public_only_view
 @login_required
@@ -1,12 +1,11 @@
 from django import forms
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.contenttypes.admin import GenericTabularInline
 
 # from tenant.admin import NonPublicSchemaOnlyAdminAccessMixin
 
 from .models import IsAPrereqMixin, Prereq
-from .tasks import update_quest_conditions_all_users
+from .scheduler import schedule_all_users_update
 
 
 class PrereqInlineForm(forms.ModelForm):
@@ -44,7 +43,7 @@ def auto_name_selected_prereqs(modeladmin, request, queryset):
 
 
 def recalculate_available_quests_for_all_users(modeladmin, request, queryset):
-    update_quest_conditions_all_users.apply_async(args=[1], queue='default', countdown=settings.CONDITIONS_UPDATE_COUNTDOWN)
+    schedule_all_users_update()
     messages.add_message(
         request, messages.INFO,
         'Recalculating... this might take a while so I\'m doing it the background. You don\'t need to stick around and can leave this page.'
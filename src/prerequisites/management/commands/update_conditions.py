@@ -1,11 +1,38 @@
+import time
+
 from django.core.management.base import BaseCommand
 
-from prerequisites.tasks import update_quest_conditions_all_users
+from courses.models import CourseStudent
+from prerequisites.tasks import bulk_update_quest_conditions_for_users, update_quest_conditions_all_users
 
 
 class Command(BaseCommand):
     help = 'Update all conditons met'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Number of users evaluated and saved together. Defaults to settings.CONDITIONS_UPDATE_CHUNK_SIZE'
+        )
+        parser.add_argument(
+            '--background', action='store_true',
+            help='Queue the update as a celery task instead of running it now'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Creating conditions met for all users...')
-        update_quest_conditions_all_users.apply_async(args=[1], queue='default')
+
+        if options['background']:
+            update_quest_conditions_all_users.apply_async(args=[1], queue='default')
+            return
+
+        user_ids = list(CourseStudent.objects.all_users_for_active_semester().order_by('id').values_list('id', flat=True))
+
+        start = time.perf_counter()
+        num_users = bulk_update_quest_conditions_for_users(user_ids, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - start
+
+        users_per_second = num_users / elapsed if elapsed else num_users
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated conditions met for {num_users} users in {elapsed:.2f}s ({users_per_second:.1f} users/sec)'
+        ))
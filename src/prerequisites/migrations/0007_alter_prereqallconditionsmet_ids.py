@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:32
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prerequisites', '0006_auto_20220629_1807'),
+    ]
+
+    operations = [
+        # The old ids field was a str(list) such as '[25, 34, 55]', convert it in place to a postgres array '{25,34,55}'
+        migrations.RunSQL(
+            sql="""
+                ALTER TABLE prerequisites_prereqallconditionsmet
+                ALTER COLUMN ids TYPE integer[] USING COALESCE(NULLIF(translate(ids, '[]', '{}'), ''), '{}')::integer[];
+            """,
+            reverse_sql="""
+                ALTER TABLE prerequisites_prereqallconditionsmet
+                ALTER COLUMN ids TYPE text USING translate(ids::text, '{}', '[]');
+            """,
+            state_operations=[
+                migrations.AlterField(
+                    model_name='prereqallconditionsmet',
+                    name='ids',
+                    field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), blank=True, default=list, size=None),
+                ),
+            ],
+        ),
+        # Remove duplicate caches (keeping the most recent) so the (user, model_name) unique constraint can be added
+        migrations.RunSQL(
+            sql="""
+                DELETE FROM prerequisites_prereqallconditionsmet older
+                USING prerequisites_prereqallconditionsmet newer
+                WHERE older.user_id = newer.user_id
+                AND older.model_name = newer.model_name
+                AND older.id < newer.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
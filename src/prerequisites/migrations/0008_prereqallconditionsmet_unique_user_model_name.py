@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:32
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prerequisites', '0007_alter_prereqallconditionsmet_ids'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prereqallconditionsmet',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ids'], name='prereqallconditionsmet_ids_gin'),
+        ),
+        migrations.AddConstraint(
+            model_name='prereqallconditionsmet',
+            constraint=models.UniqueConstraint(fields=('user', 'model_name'), name='unique_prereqallconditionsmet_user_model_name'),
+        ),
+    ]
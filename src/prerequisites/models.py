@@ -1,9 +1,16 @@
-import json
+import copy
+from collections import defaultdict
+
+from django.apps import apps
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.conf import settings
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import connection, models
+from django.db.models import F, Func, Q, Value
+from django.db.models.expressions import RawSQL
 
 
 class HasPrereqsMixin:
@@ -104,7 +111,7 @@ class IsAPrereqMixin:
     """
     For models that act as a prerequisite.
     Classes using this mixin need to implement
-    the method: condition_met_as_prerequisite(user, num_required)
+    the method: condition_met_as_prerequisite(user, num_required, context=None)
     and have a field "name", or override the autocomplete_search_fields() and dal_autocomplete_search_fields class methods
 
     Steps to add a new prerequisite model:
@@ -112,21 +119,56 @@ class IsAPrereqMixin:
     1. add IsAPrereqMixin to the class (this will automatically regsiter the model as a prerequisite)
     2. if the model does not have a name field, then override the autocomplete_search_fields()  and dal_autocomplete_search_fields methods
      (see implementation below)
-    3. implement the `condition_met_as_prerequisite(user, num_required)` method to the model class
+    3. implement the `condition_met_as_prerequisite(user, num_required, context=None)` method to the model class,
+     getting facts about the user from the PrereqEvaluationContext when possible, so they are shared with other prereqs
+    4. optionally, override the `bulk_condition_met_as_prerequisite(user, requirements, context=None)` class method so the
+     PrereqEvaluator can check many objects of this model at once, and `bulk_condition_met_for_users(users, requirements)`
+     so it can check them for many users at once
 
     """
 
-    def condition_met_as_prerequisite(self, user, num_required):
+    def condition_met_as_prerequisite(self, user, num_required, context=None):
         """
         Defines what it means for the user to meet this prerequisite.  For this Mixin to be any use, the implementing
         model must override this method.
         :param user: a django user
         :param num_required - recommend to default this to when overriding
+        :param context: the PrereqEvaluationContext of the current evaluation run, if any
         :return: True if the user meets the requirements for this object as a prerequisite, otherwise False.
 
         """
         raise NotImplementedError(f"{self.__class__.__name__} model must implement a condition_met_as_prerequisite() method")
 
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """
+        A batch version of condition_met_as_prerequisite() used by the PrereqEvaluator.
+        By default this checks each object one at a time, so models should override it to answer all the requirements
+        with a constant number of queries.
+        :param user: a django user
+        :param requirements: an iterable of (object, num_required) tuples, where object is an instance of this model
+        :param context: the PrereqEvaluationContext of the current evaluation run, if any
+        :return: a set of the (object.pk, num_required) tuples whose conditions have been met by the user
+        """
+        context = context or PrereqEvaluationContext(user)
+        return {
+            (obj.pk, num_required) for obj, num_required in requirements
+            if obj.condition_met_as_prerequisite(user, num_required, context=context)
+        }
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """
+        The same as bulk_condition_met_as_prerequisite() but for many users at once, used when one object is
+        evaluated for every student (see PrereqEvaluator.for_users()).
+        By default this checks each user one at a time, so models should override it with set-based queries.
+        :param users: a list of django users
+        :param requirements: an iterable of (object, num_required) tuples, where object is an instance of this model
+        :return: a dict of {user.id: set of the (object.pk, num_required) tuples whose conditions have been met by the user}
+        """
+        requirements = list(requirements)
+        return {user.id: cls.bulk_condition_met_as_prerequisite(user, requirements) for user in users}
+
     def is_used_prereq(self):
         """
         :return: True if this object has been assigned as a prerequisite to at least one another object.
@@ -298,7 +340,7 @@ class PrereqManager(models.Manager):
         or_qs = self.get_queryset().get_all_for_or_prereq_object(prereq_object, exclude_NOT=exclude_NOT)
         return qs.union(or_qs)
 
-    def all_conditions_met(self, parent_object, user, no_prereq_means=True):
+    def all_conditions_met(self, parent_object, user, no_prereq_means=True, context=None):
         """
         Checks if all the prerequisites for this parent_object and user have been met.
         If the parent_object has Prereq object in which it is the Prereq.parent_object,
@@ -309,15 +351,136 @@ class PrereqManager(models.Manager):
         This should be set in the IsAPrereqMixin constructor... I'd tell you how to do it here but I haven't figured it
         out yet.  I assume by the time this is published anywhere that someone is reading it other than myself, the
         mixin itself will explain better...
+
+        The same PrereqEvaluationContext is used for all the prereqs, so facts about the user are only queried once.
+        Pass one in to share it with other calls about the same user.
         """
         prereqs = self.all_parent(parent_object)
         if not prereqs:
             return no_prereq_means
+        context = context or PrereqEvaluationContext(user)
         for prereq in prereqs:
-            if not prereq.condition_met(user):
+            if not prereq.condition_met(user, context=context):
                 return False
         return True
 
+    def all_conditions_met_pks(self, parent_queryset, user, no_prereq_means=True):
+        """
+        A set based version of all_conditions_met() for every object in parent_queryset.
+        Instead of evaluating each Prereq one at a time, all the facts needed about the user are loaded at once
+        and the prerequisites are resolved in memory by a PrereqEvaluator, so the number of queries doesn't grow
+        with the size of the queryset.
+        :return: a list of pks of the objects in parent_queryset whose prerequisites have been met by the user
+        """
+        pks = list(parent_queryset.values_list('pk', flat=True))
+        evaluator = PrereqEvaluator(user, parent_queryset.model, parent_object_ids=pks)
+        return [pk for pk in pks if evaluator.all_conditions_met(pk, no_prereq_means)]
+
+    def all_conditions_met_pks_for_users(self, parent_queryset, users, no_prereq_means=True):
+        """
+        The same as all_conditions_met_pks() but for many users at once, with a number of queries that doesn't depend
+        on the number of users either.
+        :return: a dict of {user.id: list of pks of the objects in parent_queryset whose prerequisites have been met by the user}
+        """
+        pks = list(parent_queryset.values_list('pk', flat=True))
+        evaluators = PrereqEvaluator.for_users(users, parent_queryset.model, parent_object_ids=pks)
+        return {
+            user_id: [pk for pk in pks if evaluator.all_conditions_met(pk, no_prereq_means)]
+            for user_id, evaluator in evaluators.items()
+        }
+
+    def all_conditions_met_user_ids(self, parent_object, users, no_prereq_means=True):
+        """
+        The set based equivalent of calling all_conditions_met(parent_object, user) for each of the users
+        :return: a list of the ids of the users that have met all the prerequisites of parent_object
+        """
+        evaluators = PrereqEvaluator.for_users(users, type(parent_object), parent_object_ids=[parent_object.pk])
+        return [
+            user_id for user_id, evaluator in evaluators.items()
+            if evaluator.all_conditions_met(parent_object.pk, no_prereq_means)
+        ]
+
+    @staticmethod
+    def reverse_index_cache_key():
+        return f'{connection.schema_name}-prereq-reverse-index'
+
+    def get_reverse_index(self):
+        """
+        The reverse of the Prereq graph, so we can quickly find which objects need to be re-evaluated when a user's
+        progress on a prereq object changes (e.g. a quest submission is approved or a badge is granted).
+        Built from a single query and cached until a Prereq is saved or deleted (see prerequisites.signals)
+
+        :return: a dict of {(content_type_id, object_id): {(parent_content_type_id, parent_object_id), ...}} mapping
+        each prereq object to the parent objects that rely on it, either directly or through nested Prereqs
+        (a Prereq used as the prereq object of another Prereq), including alternate (OR) and inverted (NOT) prereqs.
+        """
+        reverse_index = cache.get(self.reverse_index_cache_key())
+        if reverse_index is None:
+            reverse_index = self._build_reverse_index()
+            cache.set(self.reverse_index_cache_key(), reverse_index, 3600)
+        return reverse_index
+
+    def invalidate_reverse_index(self):
+        cache.delete(self.reverse_index_cache_key())
+
+    def _build_reverse_index(self):
+        prereq_content_type_id = ContentType.objects.get_for_model(self.model).id
+
+        # direct relationships: {prereq object: [(prereq.id, parent), ...]}
+        referenced_by = defaultdict(list)
+        fields = (
+            'id', 'parent_content_type_id', 'parent_object_id', 'prereq_content_type_id', 'prereq_object_id',
+            'or_prereq_content_type_id', 'or_prereq_object_id',
+        )
+        for prereq_id, parent_ct_id, parent_id, ct_id, object_id, or_ct_id, or_object_id in self.values_list(*fields):
+            parent = (parent_ct_id, parent_id)
+            referenced_by[(ct_id, object_id)].append((prereq_id, parent))
+            if or_ct_id and or_object_id:
+                referenced_by[(or_ct_id, or_object_id)].append((prereq_id, parent))
+
+        def reliant_parents(key, visiting):
+            """ Parents relying on this object, following nested prereqs which are themselves prereq objects """
+            parents = set()
+            for prereq_id, parent in referenced_by.get(key, ()):
+                parents.add(parent)
+                nested_key = (prereq_content_type_id, prereq_id)
+                if nested_key not in visiting:  # guard against circular prereqs
+                    visiting.add(nested_key)
+                    parents |= reliant_parents(nested_key, visiting)
+            return parents
+
+        return {key: reliant_parents(key, {key}) for key in referenced_by}
+
+    def get_reliant_parent_ids(self, prereq_model, prereq_object_ids, parent_model):
+        """
+        :param prereq_model: the model of the prereq objects, e.g. Badge
+        :param prereq_object_ids: an iterable of ids of prereq_model objects, e.g. [badge_assertion.badge_id]
+        :param parent_model: the model of the parents we are interested in, e.g. Quest
+        :return: a set of ids of the parent_model objects that rely on any of the prereq objects
+        """
+        prereq_ct_id = ContentType.objects.get_for_model(prereq_model).id
+        keys = [(prereq_ct_id, object_id) for object_id in prereq_object_ids if object_id is not None]
+        return self._reliant_parent_ids(keys, parent_model)
+
+    def get_reliant_parent_ids_for_model(self, prereq_model, parent_model):
+        """
+        :return: a set of ids of the parent_model objects that rely on any object of prereq_model,
+        e.g. all quests that have a Rank prereq, which need to be re-evaluated when a user's XP changes.
+        """
+        prereq_ct_id = ContentType.objects.get_for_model(prereq_model).id
+        keys = [key for key in self.get_reverse_index() if key[0] == prereq_ct_id]
+        return self._reliant_parent_ids(keys, parent_model)
+
+    def _reliant_parent_ids(self, keys, parent_model):
+        parent_ct_id = ContentType.objects.get_for_model(parent_model).id
+        reverse_index = self.get_reverse_index()
+        return {
+            parent_id
+            for key in keys
+            for parent_content_type_id, parent_id in reverse_index.get(key, ())
+            if parent_content_type_id == parent_ct_id
+        }
+
     def is_prerequisite(self, prereq_obj):
         """
         :return: True if obj is a prerequisite to any other object
@@ -451,12 +614,14 @@ class Prereq(IsAPrereqMixin, models.Model):
         return self.or_prereq_object
 
     # A Prereq can itself be a prereq_object
-    def condition_met_as_prerequisite(self, user, num_required=1):
-        return self.condition_met(user)
+    def condition_met_as_prerequisite(self, user, num_required=1, context=None):
+        return self.condition_met(user, context=context)
 
-    def condition_met(self, user):
+    def condition_met(self, user, context=None):
         """
         :param user:
+        :param context: a PrereqEvaluationContext for the user, so facts already loaded for other prereqs are reused.
+            A new one is created if not provided.
         :return: True if the conditions for this complex Prereq have been met by the user
 
         CONTINUE this simple example from Prereq:
@@ -491,7 +656,8 @@ class Prereq(IsAPrereqMixin, models.Model):
         prereq_object = self.get_prereq()
         if prereq_object is None:
             return False
-        main_condition_met = prereq_object.condition_met_as_prerequisite(user, self.prereq_count)
+        context = context or PrereqEvaluationContext(user)
+        main_condition_met = prereq_object.condition_met_as_prerequisite(user, self.prereq_count, context=context)
 
         # invert the requirement if needed (NOT)
         if self.prereq_invert:
@@ -504,7 +670,7 @@ class Prereq(IsAPrereqMixin, models.Model):
         or_prereq_object = self.get_or_prereq()
         if or_prereq_object is None:
             return False
-        or_condition_met = or_prereq_object.condition_met_as_prerequisite(user, self.or_prereq_count)
+        or_condition_met = or_prereq_object.condition_met_as_prerequisite(user, self.or_prereq_count, context=context)
 
         # invert alternate if required (NOT OR)
         if self.or_prereq_invert:
@@ -545,37 +711,338 @@ class Prereq(IsAPrereqMixin, models.Model):
         return new_prereq
 
 
+class PrereqEvaluationContext:
+    """
+    The facts about a user that prereq objects are checked against (current courses, approved submissions, badges, XP),
+    loaded lazily and memoized for the duration of one evaluation run.
+
+    Many prereqs of the same kind need the same fact (e.g. every Grade, Block and Course prereq needs the user's current
+    courses), so instead of each condition_met_as_prerequisite() querying for it, they all get it from the context
+    passed down from Prereq.condition_met(), and it's only queried once.
+
+    The facts reflect the database at the time they were first needed, so don't keep a context around after the
+    user's progress might have changed (e.g. after granting a badge).
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._facts = {}
+
+    def get(self, key, load):
+        """
+        :param key: a unique name for the fact
+        :param load: a callable taking the user, called only the first time the fact is needed
+        :return: the memoized fact
+        """
+        if key not in self._facts:
+            self._facts[key] = load(self.user)
+        return self._facts[key]
+
+    def current_courses_values(self, field):
+        """
+        :param field: one of 'course_id', 'block_id' or 'grade_fk__value'
+        :return: the set of the field's values for the user's courses in the active semester
+        """
+        current_courses = self.get('current_courses', lambda user: list(
+            apps.get_model('courses', 'CourseStudent').objects.current_courses(user).values('course_id', 'block_id', 'grade_fk__value')
+        ))
+        return {course[field] for course in current_courses}
+
+    def approved_count_per_quest(self):
+        """ :return: a dict of {quest_id: number of approved submissions}, see QuestSubmissionManager.approved_count_per_quest() """
+        return self.get('approved_count_per_quest', apps.get_model('quest_manager', 'QuestSubmission').objects.approved_count_per_quest)
+
+    def assertion_count_per_badge(self):
+        """ :return: a dict of {badge_id: number of assertions}, see BadgeAssertionManager.assertion_count_per_badge() """
+        return self.get('assertion_count_per_badge', apps.get_model('badges', 'BadgeAssertion').objects.assertion_count_per_badge)
+
+    def xp(self):
+        """ :return: the user's cached XP """
+        return self.get('xp', lambda user: user.profile.xp_cached)
+
+
+class PrereqEvaluator:
+    """
+    Evaluates the prerequisites of the objects of one model (e.g. all quests) for a single user, in memory.
+
+    All Prereq objects are loaded with a single query.  The prereq objects that can be reached from the parent model,
+    including through nested Prereq objects used as prerequisites themselves, are then fetched with one query per
+    content type and each model's bulk_condition_met_as_prerequisite() is asked about all of them at once.
+    After that, checking a parent object is only dictionary lookups, so the number of queries does not depend on
+    how many objects (or Prereqs) are being evaluated.
+
+    Use for_users() to evaluate many users at once: the Prereqs and prereq objects are then loaded only once, and
+    each model's bulk_condition_met_for_users() is asked about all the users together.
+
+    The results reflect the database at the time the evaluator was created, so create a new one whenever the
+    user's progress might have changed (e.g. after granting a badge).
+    """
+
+    def __init__(self, user, parent_model, parent_object_ids=None):
+        """
+        :param user: the user to evaluate, or None to only load the Prereqs (see for_users())
+        :param parent_object_ids: optionally, only these objects of the parent model will be evaluated, so facts are
+        only loaded for their prereqs.
+        """
+        self.user = user
+        self.prereq_content_type_id = ContentType.objects.get_for_model(Prereq).id
+        self.parent_content_type_id = ContentType.objects.get_for_model(parent_model).id
+        self.parent_object_ids = None if parent_object_ids is None else set(parent_object_ids)
+
+        self._prereqs = {}  # {prereq.id: prereq} for every Prereq, so nested prereqs can be found
+        self._prereqs_by_parent = defaultdict(list)  # {parent_object_id: [prereq, ...]} for the parent model only
+        self._requirements = {}  # {content_type_id: [(object, num_required), ...]} for prereq objects that still exist
+        self._existing_ids = {}  # {content_type_id: {object_id, ...}} prereq objects that still exist
+        self._met = {}  # {content_type_id: {(object_id, num_required), ...}} requirements met by the user
+        self._results = {}  # {prereq.id: bool} memoized, since nested prereqs can be shared by many parents
+
+        self._load_prereqs()
+        if user is not None:
+            self._met = self._load_met([user])[user.id]
+
+    @classmethod
+    def for_users(cls, users, parent_model, parent_object_ids=None):
+        """
+        :param users: an iterable of django users
+        :return: a dict of {user.id: PrereqEvaluator} sharing the same Prereqs and prereq objects
+        """
+        users = list(users)
+        shared = cls(None, parent_model, parent_object_ids)
+        met_by_user = shared._load_met(users)
+
+        evaluators = {}
+        for user in users:
+            evaluator = copy.copy(shared)
+            evaluator.user = user
+            evaluator._met = met_by_user[user.id]
+            evaluator._results = {}
+            evaluators[user.id] = evaluator
+        return evaluators
+
+    def _load_prereqs(self):
+        for prereq in Prereq.objects.all():
+            self._prereqs[prereq.id] = prereq
+            if prereq.parent_content_type_id == self.parent_content_type_id and (
+                self.parent_object_ids is None or prereq.parent_object_id in self.parent_object_ids
+            ):
+                self._prereqs_by_parent[prereq.parent_object_id].append(prereq)
+
+        # Gather the requirements of every Prereq reachable from the parent model, grouped by content type
+        requirements = defaultdict(set)  # {content_type_id: {(object_id, num_required), ...}}
+        to_visit = [prereq for prereqs in self._prereqs_by_parent.values() for prereq in prereqs]
+        visited = set()
+        while to_visit:
+            prereq = to_visit.pop()
+            if prereq.id in visited:
+                continue
+            visited.add(prereq.id)
+            for content_type_id, object_id, num_required in self._requirements_of(prereq):
+                if content_type_id == self.prereq_content_type_id:
+                    if object_id in self._prereqs:
+                        to_visit.append(self._prereqs[object_id])
+                else:
+                    requirements[content_type_id].add((object_id, num_required))
+
+        for content_type_id, ct_requirements in requirements.items():
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            if not IsAPrereqMixin.model_is_registered(model_class):
+                # stale content type, treat its objects as missing
+                self._existing_ids[content_type_id] = set()
+                continue
+
+            # _base_manager so objects hidden by a custom default manager (e.g. archived quests) are still found,
+            # same as when the GenericForeignKey is accessed directly.
+            objects = model_class._base_manager.in_bulk({object_id for object_id, _ in ct_requirements})
+            self._existing_ids[content_type_id] = set(objects)
+            self._requirements[content_type_id] = [
+                (objects[object_id], num_required) for object_id, num_required in ct_requirements if object_id in objects
+            ]
+
+    def _load_met(self, users):
+        """
+        :return: a dict of {user.id: {content_type_id: {(object_id, num_required), ...}}} of the requirements met by each user
+        """
+        met_by_user = {user.id: {} for user in users}
+        # shared by the models, e.g. Grade, Block and Course prereqs all need the user's current courses
+        context = PrereqEvaluationContext(users[0]) if len(users) == 1 else None
+        for content_type_id, ct_requirements in self._requirements.items():
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            if len(users) == 1:
+                ct_met_by_user = {users[0].id: model_class.bulk_condition_met_as_prerequisite(users[0], ct_requirements, context=context)}
+            else:
+                ct_met_by_user = model_class.bulk_condition_met_for_users(users, ct_requirements)
+            for user_id, met in met_by_user.items():
+                met[content_type_id] = ct_met_by_user.get(user_id, set())
+        return met_by_user
+
+    @staticmethod
+    def _requirements_of(prereq):
+        """ Yields a (content_type_id, object_id, num_required) tuple for the main and, if present, the alternate prereq object"""
+        yield prereq.prereq_content_type_id, prereq.prereq_object_id, prereq.prereq_count
+        if prereq.or_prereq_object_id and prereq.or_prereq_content_type_id:
+            yield prereq.or_prereq_content_type_id, prereq.or_prereq_object_id, prereq.or_prereq_count
+
+    def _object_condition_met(self, content_type_id, object_id, num_required):
+        """
+        :return: True or False if the user has met the condition of the prereq object, or None if it doesn't exist.
+        """
+        if content_type_id == self.prereq_content_type_id:
+            nested_prereq = self._prereqs.get(object_id)
+            if nested_prereq is None:
+                return None
+            # A Prereq used as a prereq object ignores num_required, see Prereq.condition_met_as_prerequisite()
+            return self.prereq_condition_met(nested_prereq)
+
+        if object_id not in self._existing_ids.get(content_type_id, ()):
+            return None
+        return (object_id, num_required) in self._met.get(content_type_id, ())
+
+    def prereq_condition_met(self, prereq):
+        """ The in memory equivalent of Prereq.condition_met() """
+        if prereq.id in self._results:
+            return self._results[prereq.id]
+
+        # Guard against circular chains of nested prereqs (A requires B requires A), which can never be met.
+        self._results[prereq.id] = False
+
+        main_condition_met = self._object_condition_met(
+            prereq.prereq_content_type_id, prereq.prereq_object_id, prereq.prereq_count
+        )
+        if main_condition_met is None:
+            return False
+
+        # invert the requirement if needed (NOT)
+        if prereq.prereq_invert:
+            main_condition_met = not main_condition_met
+
+        # check if there is an alternate condition (OR)
+        if not prereq.or_prereq_object_id or not prereq.or_prereq_content_type_id:
+            self._results[prereq.id] = main_condition_met
+            return main_condition_met
+
+        or_condition_met = self._object_condition_met(
+            prereq.or_prereq_content_type_id, prereq.or_prereq_object_id, prereq.or_prereq_count
+        )
+        if or_condition_met is None:
+            return False
+
+        # invert alternate if required (NOT OR)
+        if prereq.or_prereq_invert:
+            or_condition_met = not or_condition_met
+
+        self._results[prereq.id] = main_condition_met or or_condition_met
+        return self._results[prereq.id]
+
+    def all_conditions_met(self, parent_object_id, no_prereq_means=True):
+        """ The in memory equivalent of PrereqManager.all_conditions_met() for the object of the parent model with this id """
+        prereqs = self._prereqs_by_parent.get(parent_object_id)
+        if not prereqs:
+            return no_prereq_means
+        return all(self.prereq_condition_met(prereq) for prereq in prereqs)
+
+
+class PrereqAllConditionsMetQuerySet(models.query.QuerySet):
+    def get_user_model_name(self, user, model_name):
+        return self.filter(user=user, model_name=model_name)
+
+    def unnest_ids(self):
+        """
+        :return: a queryset of the individual ids in the `ids` arrays, so it can be used as a subquery,
+        e.g. Quest.objects.filter(pk__in=PrereqAllConditionsMet.objects.filter(...).unnest_ids())
+        """
+        return self.annotate(
+            met_id=Func(F('ids'), function='unnest', output_field=models.PositiveIntegerField())
+        ).values('met_id')
+
+    def add_id(self, id_to_add):
+        """ Adds the id to every cache in the queryset that doesn't have it yet, in a single UPDATE """
+        return self.exclude(ids__contains=[id_to_add]).update(
+            ids=Func(F('ids'), Value(id_to_add), function='array_append', output_field=ArrayField(models.PositiveIntegerField()))
+        )
+
+    def remove_id(self, id_to_remove):
+        """ Removes the id from every cache in the queryset that has it, in a single UPDATE """
+        return self.filter(ids__contains=[id_to_remove]).update(
+            ids=Func(F('ids'), Value(id_to_remove), function='array_remove', output_field=ArrayField(models.PositiveIntegerField()))
+        )
+
+    def set_ids_for_users(self, model_name, ids_by_user_id, batch_size=None):
+        """
+        Replaces the cached ids of many users at once: the caches that changed are saved with bulk_update()
+        and the missing ones are created with bulk_create()
+        :param ids_by_user_id: a dict of {user_id: list of met ids}
+        """
+        existing = {met_list.user_id: met_list for met_list in self.filter(model_name=model_name, user_id__in=list(ids_by_user_id))}
+
+        to_update, to_create = [], []
+        for user_id, ids in ids_by_user_id.items():
+            met_list = existing.get(user_id)
+            if met_list is None:
+                to_create.append(self.model(user_id=user_id, model_name=model_name, ids=list(ids)))
+            elif sorted(met_list.get_ids()) != sorted(ids):
+                met_list.ids = list(ids)
+                to_update.append(met_list)
+
+        self.bulk_update(to_update, ['ids'], batch_size=batch_size)
+        # another task might have created a user's cache in the meantime, the next update will correct it
+        self.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+        return len(to_update), len(to_create)
+
+
 class PrereqAllConditionsMet(models.Model):
     """This is a cache of the Prereq.objects.all_conditions_met(obj, user) method which is super innefficient and clunky
     but also critical to how this site works.
 
     It is recalulated asynchronously using celery (see tasks.py).
+
+    There is one row per user and model, and the met ids are stored in a Postgres integer array so they can be
+    used directly in a subquery (see unnest_ids()), and added or removed atomically without rewriting the row.
     """
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # these next two fields look like a custom Generic Foreign Key implementation?
-    ids = models.TextField(default='[]')  # str representation of a list of ids for the model, e.g '[25, 34, 55, 56, 77]'
+    ids = ArrayField(models.PositiveIntegerField(), default=list, blank=True)  # ids for the model, e.g [25, 34, 55, 56, 77]
     model_name = models.CharField(max_length=256)  # model name as a string with .get_model_name()
 
+    objects = PrereqAllConditionsMetQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'model_name'], name='unique_prereqallconditionsmet_user_model_name'),
+        ]
+        indexes = [
+            GinIndex(fields=['ids'], name='prereqallconditionsmet_ids_gin'),
+        ]
+
     def add_id(self, new_id):
-        ids = self.get_ids()
-        if new_id not in ids:
-            ids.append(new_id)
-            self.set_ids(ids)
+        """ Adds the id with a single UPDATE, so concurrent changes to the same row can't overwrite each other """
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).add_id(new_id)
+        if new_id not in self.ids:
+            self.ids.append(new_id)
 
     def remove_id(self, id_to_remove):
-        ids = self.get_ids()
-        if id_to_remove in ids:
-            ids.remove(id_to_remove)
-            self.set_ids(ids)
+        """ Removes the id with a single UPDATE, so concurrent changes to the same row can't overwrite each other """
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).remove_id(id_to_remove)
+        if id_to_remove in self.ids:
+            self.ids.remove(id_to_remove)
+
+    def update_ids(self, ids_to_add, ids_to_remove):
+        """ Adds and removes many ids with a single UPDATE, see add_id() and remove_id() """
+        ids_to_add, ids_to_remove = list(ids_to_add), list(ids_to_remove)
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).update(
+            ids=RawSQL(
+                "ARRAY(SELECT DISTINCT met_id FROM unnest(ids || %s::integer[]) AS met_id WHERE met_id <> ALL(%s::integer[]))",
+                (ids_to_add, ids_to_remove),
+                output_field=ArrayField(models.PositiveIntegerField()),
+            )
+        )
+        self.ids = [met_id for met_id in dict.fromkeys(self.get_ids() + ids_to_add) if met_id not in ids_to_remove]
 
     def get_ids(self):
-        if self.ids:
-            return json.loads(self.ids)
-        return PrereqAllConditionsMet.ids.default
+        return list(self.ids or [])
 
     def set_ids(self, id_list=None):
         if id_list is None:
             id_list = []
-        self.ids = str(id_list)
+        self.ids = list(id_list)
         self.save()
@@ -0,0 +1,164 @@
+"""
+Coalesces the updates of the cache of available quests (PrereqAllConditionsMet) requested by signals.
+
+A single save can fire many signals (e.g. editing a quest's prereqs deletes and re-adds several Prereq objects), so
+instead of starting a celery task for each of them, the signal receivers mark what is dirty in a batch for the current
+transaction and tenant.  The batch is flushed once the transaction is committed, starting one task per quest, user or
+"all users" marker.  Quest and "all users" tasks are also debounced between transactions (and processes) with a
+pending key in the tenant's cache, so the task that's already waiting to run picks up the later changes.
+"""
+import logging
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+METRICS_SIGNALS_KEY = 'prereq-update-signals'
+METRICS_TASKS_KEY = 'prereq-update-tasks'
+
+
+class ConditionsUpdateBatch:
+    """ The updates requested by signals during one transaction, for one tenant """
+
+    def __init__(self):
+        self.num_signals = 0
+        self.all_users = False
+        self.quest_ids = set()
+        self.quest_ids_by_user = {}  # {user_id: set of quest ids, or None to re-evaluate all quests}
+        self.callbacks = []  # the on_commit callbacks that will flush this batch
+
+    def is_registered(self):
+        """ Whether one of the batch's callbacks is still waiting for the current transaction to be committed """
+        pending = [func for _, func, _ in connection.run_on_commit]
+        return any(callback in pending for callback in self.callbacks)
+
+    def add_user(self, user_id, quest_ids=None):
+        self.num_signals += 1
+        if user_id in self.quest_ids_by_user:
+            if quest_ids is None or self.quest_ids_by_user[user_id] is None:
+                self.quest_ids_by_user[user_id] = None
+            else:
+                self.quest_ids_by_user[user_id] |= set(quest_ids)
+        else:
+            self.quest_ids_by_user[user_id] = None if quest_ids is None else set(quest_ids)
+
+    def add_quest(self, quest_id):
+        self.num_signals += 1
+        self.quest_ids.add(quest_id)
+
+    def add_all_users(self):
+        self.num_signals += 1
+        self.all_users = True
+
+    def flush(self):
+        """ Starts the deduplicated tasks
+
+        Returns:
+            the number of tasks started
+        """
+        from prerequisites.tasks import update_conditions_for_quest, update_quest_conditions_all_users, update_quest_conditions_for_user
+
+        num_tasks = 0
+        for user_id, quest_ids in self.quest_ids_by_user.items():
+            update_quest_conditions_for_user.apply_async(
+                args=[user_id], kwargs={'quest_ids': None if quest_ids is None else sorted(quest_ids)}, queue='default'
+            )
+            num_tasks += 1
+
+        for quest_id in sorted(self.quest_ids):
+            if cache.add(pending_quest_key(quest_id), True, settings.CONDITIONS_UPDATE_DEBOUNCE):
+                update_conditions_for_quest.apply_async(
+                    kwargs={'quest_id': quest_id, 'start_from_user_id': 1}, queue='default', countdown=settings.CONDITIONS_UPDATE_DEBOUNCE
+                )
+                num_tasks += 1
+
+        if self.all_users and cache.add(pending_all_users_key(), True, settings.CONDITIONS_UPDATE_COUNTDOWN):
+            update_quest_conditions_all_users.apply_async(args=[1], queue='default', countdown=settings.CONDITIONS_UPDATE_COUNTDOWN)
+            num_tasks += 1
+
+        record_metrics(self.num_signals, num_tasks)
+        logger.info(f"Prereq cache updates: {self.num_signals} signals merged into {num_tasks} tasks")
+        return num_tasks
+
+
+def pending_quest_key(quest_id):
+    return f'prereq-update-pending-quest-{quest_id}'
+
+
+def pending_all_users_key():
+    return 'prereq-update-pending-all-users'
+
+
+def get_batch():
+    """ The batch of the current tenant, which is flushed after the current transaction is committed """
+    batches = getattr(_local, 'batches', None)
+    if batches is None:
+        batches = _local.batches = {}
+
+    schema_name = connection.schema_name
+    batch = batches.get(schema_name)
+    if batch is None or (connection.in_atomic_block and not batch.is_registered()):
+        # none of the batch's callbacks are pending, so the transaction it was collected in was rolled back
+        batch = batches[schema_name] = ConditionsUpdateBatch()
+
+    if connection.in_atomic_block:
+        # Only the first callback will have something to flush, but registering one each time means the batch is
+        # still flushed when a savepoint that registered an earlier one is rolled back.
+        callback = partial(flush, schema_name)
+        batch.callbacks.append(callback)
+        transaction.on_commit(callback)
+    return batch
+
+
+def flush(schema_name):
+    batch = getattr(_local, 'batches', {}).pop(schema_name, None)
+    if batch and batch.num_signals:
+        batch.flush()
+
+
+def flush_if_autocommit():
+    """ Outside of a transaction there is nothing to wait for """
+    if not connection.in_atomic_block:
+        flush(connection.schema_name)
+
+
+def schedule_user_update(user_id, quest_ids=None):
+    """ Updates the user's cache of available quests, for these quests only if provided.
+    See prerequisites.tasks.update_quest_conditions_for_user() """
+    get_batch().add_user(user_id, quest_ids)
+    flush_if_autocommit()
+
+
+def schedule_quest_update(quest_id):
+    """ Updates the quest in every relevant user's cache, see prerequisites.tasks.update_conditions_for_quest() """
+    get_batch().add_quest(quest_id)
+    flush_if_autocommit()
+
+
+def schedule_all_users_update():
+    """ Updates the cache of all users in a course, see prerequisites.tasks.update_quest_conditions_all_users() """
+    get_batch().add_all_users()
+    flush_if_autocommit()
+
+
+def record_metrics(num_signals, num_tasks):
+    for key, value in ((METRICS_SIGNALS_KEY, num_signals), (METRICS_TASKS_KEY, num_tasks)):
+        cache.add(key, 0, None)
+        cache.incr(key, value)
+
+
+def get_metrics():
+    """
+    Returns:
+        a dict with the number of signals received, tasks started, and signals merged (i.e. that didn't need their own task)
+        for the current tenant
+    """
+    num_signals = cache.get(METRICS_SIGNALS_KEY, 0)
+    num_tasks = cache.get(METRICS_TASKS_KEY, 0)
+    return {'signals': num_signals, 'tasks': num_tasks, 'merged': num_signals - num_tasks}
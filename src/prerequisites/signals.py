@@ -1,12 +1,12 @@
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from badges.models import Badge
+from badges.models import Badge, BadgeAssertion
+from courses.models import Rank
 from prerequisites.models import Prereq, HasPrereqsMixin
-from prerequisites.tasks import update_conditions_for_quest, update_quest_conditions_all_users, update_quest_conditions_for_user
-from quest_manager.models import Quest, QuestSubmission
+from prerequisites.scheduler import schedule_all_users_update, schedule_quest_update, schedule_user_update
+from quest_manager.models import Category, Quest, QuestSubmission
 from djcytoscape.models import CytoScape
 
 User = get_user_model()
@@ -36,8 +36,6 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
     list_of_models = ('BadgeAssertion', 'QuestSubmission', 'CourseStudent')
 
     if sender.__name__ in list_of_models:
-        # TODO Since the cache is only for quests (as prereq parent object), only need to send for affected quests, not ALL quests?
-
         # To prevent triggering update_quest_conditions_for_user more than once,
         # we check if the QuestSubmission is complete and approved.
         # When both conditions are met, that would be the only time we want to update available quests
@@ -45,7 +43,28 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
         if isinstance(instance, QuestSubmission) and (instance.is_completed is False or instance.is_approved is False):
             return
 
-        update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
+        schedule_user_update(instance.user_id, get_reliant_quest_ids(instance))
+
+
+def get_reliant_quest_ids(instance):
+    """ The quests whose availability might have changed for the instance's user, using the reverse index of the Prereq graph,
+    so the user's cache of available quests only needs to be updated for those.  Completing a quest or earning a badge
+    also changes the user's XP, so quests with a Rank prereq are included too.
+
+    Returns:
+        list of quest ids, or None if all quests should be re-evaluated (e.g. joining a course affects
+        Course, Block, Grade and Rank prereqs)
+    """
+    if isinstance(instance, QuestSubmission):
+        quest_ids = Prereq.objects.get_reliant_parent_ids(Quest, [instance.quest_id], Quest)
+        quest_ids |= Prereq.objects.get_reliant_parent_ids(Category, [instance.quest.campaign_id], Quest)
+    elif isinstance(instance, BadgeAssertion):
+        quest_ids = Prereq.objects.get_reliant_parent_ids(Badge, [instance.badge_id], Quest)
+    else:
+        return None
+
+    quest_ids |= Prereq.objects.get_reliant_parent_ids_for_model(Rank, Quest)
+    return sorted(quest_ids)
 
 
 # Don't need post_delete, it doesn't affect on result and will be updated on next all conditions update
@@ -57,7 +76,7 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
 # @receiver([post_save, post_delete], sender=Prereq)
 @receiver([post_save, post_delete], sender=Badge, dispatch_uid="prerequisites.signals.update_conditions_met")
 def update_conditions_met(sender, instance, *args, **kwargs):
-    update_quest_conditions_all_users.apply_async(args=[1], queue='default', countdown=settings.CONDITIONS_UPDATE_COUNTDOWN)
+    schedule_all_users_update()
 
 
 @receiver([post_save], sender=Quest, dispatch_uid="prerequisites.signals.update_cache_triggered_by_quest_without_prereqs")
@@ -66,7 +85,7 @@ def update_cache_triggered_by_quest_without_prereqs(sender, instance, *args, **k
     Handle a specific case where available quests is not updated if the Quest does not contain any prerequisites
     """
     if not instance.prereqs().exists():
-        update_quest_conditions_all_users.apply_async(args=[1], queue='default', countdown=settings.CONDITIONS_UPDATE_COUNTDOWN)
+        schedule_all_users_update()
 
 
 @receiver(post_save, sender=Quest, dispatch_uid="prerequisites.signals.update_cache_triggered_by_quests_available_outside_course")
@@ -75,7 +94,7 @@ def update_cache_triggered_by_quests_available_outside_course(sender, instance,
     Handle a specific case where available quests is not updated if the Quest is available outside a course
     """
     if instance.available_outside_course:
-        update_conditions_for_quest.apply_async(kwargs={'quest_id': instance.id, 'start_from_user_id': 1}, queue='default')
+        schedule_quest_update(instance.id)
 
 
 @receiver([post_save, post_delete], sender=Prereq, dispatch_uid="prerequisites.signals.update_cache_triggered_by_prereq")
@@ -87,7 +106,13 @@ def update_cache_triggered_by_prereq(sender, instance, *args, **kwargs):
         # # The parent_object itself being deleted could have cascaded to delete the sender Prereq, so it parent might not exist.
         # Cover this instance in a post_delete signal receiver for Quest objects.
         if instance.parent_object:
-            update_conditions_for_quest.apply_async(kwargs={'quest_id': instance.parent_object.id, 'start_from_user_id': 1}, queue='default')
+            schedule_quest_update(instance.parent_object.id)
+
+
+@receiver([post_save, post_delete], sender=Prereq, dispatch_uid="prerequisites.signals.invalidate_prereq_reverse_index")
+def invalidate_prereq_reverse_index(sender, instance, *args, **kwargs):
+    """ The reverse index used to find quests relying on a prereq object is rebuilt the next time it's needed """
+    Prereq.objects.invalidate_reverse_index()
 
 
 @receiver(post_save, sender=Prereq)
@@ -1,4 +1,6 @@
 import logging
+import math
+import time
 import traceback
 
 from django.conf import settings
@@ -12,6 +14,7 @@ from tenant_schemas_celery.task import TenantTask
 from courses.models import CourseStudent
 from hackerspace_online.celery import app
 from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.scheduler import pending_all_users_key, pending_quest_key
 from quest_manager.models import Quest
 
 logger = logging.getLogger(__name__)
@@ -35,87 +38,146 @@ class TransactionAwareTask(TenantTask):
             logger.error(traceback.format_exc())
 
 
+def chunks(items, size):
+    """ Yields successive lists of `size` items """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def split_between_tasks(task, user_ids, **kwargs):
+    """ Splits the users between CONDITIONS_UPDATE_PARALLELISM tasks so they can be processed by several workers at once
+
+    Returns:
+        the number of tasks started, or 0 if the users should be processed by the current task
+    """
+    parallelism = settings.CONDITIONS_UPDATE_PARALLELISM
+    if parallelism <= 1 or len(user_ids) <= settings.CONDITIONS_UPDATE_CHUNK_SIZE:
+        return 0
+
+    share = math.ceil(len(user_ids) / parallelism)
+    parts = list(chunks(user_ids, share))
+    for part in parts:
+        task.apply_async(kwargs={**kwargs, 'start_from_user_id': part[0], 'user_ids': part}, queue='default')
+    return len(parts)
+
+
+def bulk_update_conditions_for_quest(quest, user_ids, chunk_size=None):
+    """Adds the quest to the cache of available quests (PrereqAllConditionsMet) of the users who meet its prereqs,
+    and removes it from the others.  Each chunk of users is evaluated with a handful of set based queries
+    (see Prereq.objects.all_conditions_met_user_ids()) and written with two UPDATE queries.
+
+    Users whose cache has never been calculated are skipped, it will be fully calculated (including this quest)
+    the first time it's needed, see QuestQuerySet.get_conditions_met()
+
+    Returns:
+        the number of users that were evaluated
+    """
+    chunk_size = chunk_size or settings.CONDITIONS_UPDATE_CHUNK_SIZE
+    quest_caches = PrereqAllConditionsMet.objects.filter(model_name=Quest.get_model_name())
+    num_users = 0
+
+    for chunk in chunks(list(user_ids), chunk_size):
+        users = list(User.objects.filter(id__in=quest_caches.filter(user_id__in=chunk).values('user_id')))
+        met_user_ids = Prereq.objects.all_conditions_met_user_ids(quest, users)
+
+        quest_caches.filter(user_id__in=met_user_ids).add_id(quest.id)
+        quest_caches.filter(user_id__in=[user.id for user in users]).exclude(user_id__in=met_user_ids).remove_id(quest.id)
+        num_users += len(users)
+
+    return num_users
+
+
+def bulk_update_quest_conditions_for_users(user_ids, chunk_size=None):
+    """Recalculates the cache of available quests (PrereqAllConditionsMet) of all the users.  Each chunk of users is
+    evaluated with a handful of set based queries (see Prereq.objects.all_conditions_met_pks_for_users()), then the
+    caches that changed are saved with bulk_update() and the missing ones with bulk_create().
+
+    Returns:
+        the number of users that were evaluated
+    """
+    chunk_size = chunk_size or settings.CONDITIONS_UPDATE_CHUNK_SIZE
+    num_users = 0
+
+    for chunk in chunks(list(user_ids), chunk_size):
+        users = list(User.objects.filter(id__in=chunk))
+        pks_met_by_user = Prereq.objects.all_conditions_met_pks_for_users(Quest.objects.all(), users)
+        PrereqAllConditionsMet.objects.set_ids_for_users(Quest.get_model_name(), pks_met_by_user)
+        num_users += len(users)
+
+    return num_users
+
+
 @app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_conditions_for_quest', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
-def update_conditions_for_quest(self, quest_id, start_from_user_id):
-    """Cycles through all relevant users and adds this quest to their cache of available quests (PrereqAllConditionsMet), if they meet the prereqs,
-    or removes it if they don't. This is done in bunches of users (CELERY_TASKS_BUNCH_SIZE), recursively.
+def update_conditions_for_quest(self, quest_id, start_from_user_id, user_ids=None):
+    """Adds this quest to the cache of available quests (PrereqAllConditionsMet) of all relevant users, if they meet the prereqs,
+    or removes it if they don't. The users are processed in bulk, in chunks of CONDITIONS_UPDATE_CHUNK_SIZE users,
+    and split between CONDITIONS_UPDATE_PARALLELISM tasks.
 
     If the quest is available outside a course, it will update the cache for ALL users, otherwise it will only update
     students who are currently registered in a course.
 
     Args:
         quest_id (int): The quest with updated prerequisites (i.e this quest is the parent_object of an updated Prereq),
-        start_from_user_id (int): user_id to start with for the next bunch of calculations
+        start_from_user_id (int): user_id to start with
+        user_ids (list of int): the users to process, when the work has been split between several tasks
     """
     quest = Quest.objects.filter(id=quest_id).first()
     if not quest:
         # If the quest is deleted while this task is running.
         return f"Quest {quest_id} no longer exists."
 
-    # check if this already started recently, if so, don't need to start a new one.
-    cache_key = f'update_conditions_for_quest_{quest_id}_wait'
-    if start_from_user_id == 1 and cache.get(cache_key):
-        return f"Skipping task for quest {quest_id}, already started."
+    if user_ids is None:
+        # Changes made from now on need another task, see prerequisites.scheduler
+        cache.delete(pending_quest_key(quest_id))
 
-    # Set a 1 second cache to prevent this task from running multiple times concurrently for the same quest
-    # for example, when prereqs are updated, one might be deleted and two more added, that will result in 3 signals!
-    cache.set(cache_key, True, 1)
-
-    if quest.available_outside_course:
-        users = User.objects.all()
-    else:
-        users = CourseStudent.objects.all_users_for_active_semester()
-
-    users = users.order_by('id').filter(id__gte=start_from_user_id)[:settings.CELERY_TASKS_BUNCH_SIZE]
-    user = None
-
-    for user in users:
-        try:
-            quest_prereq_cache, created = PrereqAllConditionsMet.objects.get_or_create(
-                user=user,
-                model_name=Quest.get_model_name(),
-            )
-        except PrereqAllConditionsMet.MultipleObjectsReturned:
-            # why are there multiple?  Delete cache and regenerate new for this user
-            caches = PrereqAllConditionsMet.objects.filter(user=user, model_name=Quest.get_model_name())
-            caches.delete()
-            # do full recalc for the user:
-            update_quest_conditions_for_user.apply_async(args=[user.id], queue='default')
-            # carry on with the next user
-            continue
-
-        if Prereq.objects.all_conditions_met(quest, user):
-            quest_prereq_cache.add_id(quest.id)
+        if quest.available_outside_course:
+            users = User.objects.all()
         else:
-            quest_prereq_cache.remove_id(quest.id)
-
-    else:
-        # finished the previous bunch, call the next bunch recursively
-        # or maybe there were no users in the bunch... check that too
-        if user:
-            # user is the last user that was updated, increment by 1
-            minimum_user_id = user.id + 1
-            user = User.objects.filter(id__gte=minimum_user_id).values('id').first()
-            if user:
-                # there are more users, so keep going.
-                self.apply_async(
-                    queue='default',
-                    # doesn't seem necessary, each group of 10 only takes about 0.1 seconds?
-                    countdown=1,  # delay a bit to give some time for the last group to finish, so we don't hog all the resources.
-                    kwargs={'quest_id': quest.id, 'start_from_user_id': minimum_user_id}
-                )
+            users = CourseStudent.objects.all_users_for_active_semester()
+        user_ids = list(users.order_by('id').filter(id__gte=start_from_user_id).values_list('id', flat=True))
+
+        num_tasks = split_between_tasks(self, user_ids, quest_id=quest.id)
+        if num_tasks:
+            return f"{quest.name}: {len(user_ids)} users split between {num_tasks} tasks"
+
+    start = time.perf_counter()
+    num_users = bulk_update_conditions_for_quest(quest, user_ids)
+    logger.info(
+        f"Task prerequisites.tasks.update_conditions_for_quest: {quest.name} evaluated for {num_users} users "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
     # Return value is displayed at the end of the celery log
     return quest.name
 
 
 @app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_user', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
-def update_quest_conditions_for_user(self, user_id):
+def update_quest_conditions_for_user(self, user_id, quest_ids=None):
+    """Recalculates the user's cache of available quests (PrereqAllConditionsMet).
+
+    Args:
+        user_id (int): the user whose cache should be updated
+        quest_ids (list of int): if provided, only these quests are re-evaluated and added to or removed from the cache,
+            e.g. the quests that rely on something the user just completed (see Prereq.objects.get_reliant_parent_ids()).
+            If the user's cache hasn't been calculated yet, all quests are evaluated anyway.
+    """
     user = User.objects.filter(id=user_id).first()
     if not user:
         return None
-    pk_met_list = [obj.pk for obj in Quest.objects.all() if Prereq.objects.all_conditions_met(obj, user)]
+
+    if quest_ids is not None:
+        met_list = PrereqAllConditionsMet.objects.get_user_model_name(user, Quest.get_model_name()).first()
+        if met_list:
+            # quests that no longer exist (or are archived) are not returned, so they will be removed as well
+            pk_met_list = Prereq.objects.all_conditions_met_pks(Quest.objects.filter(pk__in=quest_ids), user)
+            met_list.update_ids(pk_met_list, set(quest_ids) - set(pk_met_list))
+            logger.info(
+                f"Task prerequisites.tasks.update_quest_conditions_for_user: {len(quest_ids)} available quests udpated for {user.username}"
+            )
+            return met_list.id
+
+    pk_met_list = Prereq.objects.all_conditions_met_pks(Quest.objects.all(), user)
     met_list, created = PrereqAllConditionsMet.objects.update_or_create(
-        user=user, model_name=Quest.get_model_name(), defaults={'ids': str(pk_met_list)})
+        user=user, model_name=Quest.get_model_name(), defaults={'ids': pk_met_list})
 
     logger.info(f"Task prerequisites.tasks.update_quest_conditions_for_user: Cache of available quests udpated for {user.username}")
     # Return value is displayed at the end of the celery log
@@ -124,37 +186,32 @@ def update_quest_conditions_for_user(self, user_id):
 
 
 @app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_all_users', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
-def update_quest_conditions_all_users(self, start_from_user_id):
-    """Cycles through all quests for all users to update the cache of available quests (PreqAllConditionsMet)
-    This is done in bunches of users (CELERY_TASKS_BUNCH_SIZE), recursively.
+def update_quest_conditions_all_users(self, start_from_user_id, user_ids=None):
+    """Recalculates the cache of available quests (PreqAllConditionsMet) for all users currently in a course.
+    The users are processed in bulk, in chunks of CONDITIONS_UPDATE_CHUNK_SIZE users, and split between
+    CONDITIONS_UPDATE_PARALLELISM tasks.
 
     Args:
-        user_id to start with for the next bunch of calculations
+        start_from_user_id (int): user_id to start with
+        user_ids (list of int): the users to process, when the work has been split between several tasks
     """
 
-    if start_from_user_id == 1 and cache.get('update_conditions_all_task_waiting'):
-        # Return value is displayed at the end of the celery log
-        return "Skipping task, already running."
-
-    cache.set('update_conditions_all_task_waiting', True, settings.CONDITIONS_UPDATE_COUNTDOWN)
-
-    # only cycle through users currently in a course
-    users = CourseStudent.objects.all_users_for_active_semester()
-    users = users.order_by('id').filter(id__gte=start_from_user_id)
-
-    users = list(users.values_list('id', flat=True)[:settings.CELERY_TASKS_BUNCH_SIZE])  # noqa
-    for uid in users:
-        update_quest_conditions_for_user.apply_async(args=[uid], queue='default')
-
-    # Perform a recursive call to start the next chunk of users
-    # It gets the last user id in the list users[-1] and continues the next chunk with the next user id (+1).
-    # For example if the chunk size is 5 users,
-    # This method will first run
-    #    update_quest_conditions_for_user.apply_async(args=[uid], queue='default')
-    # on the first 5 usersr in the list e.g. [1, 2, 3, 4, 5].
-    # Then, this code gets the next user id by taking the last id in the list (5)
-    # and adding one (6) and then recursively calling itself starting with user
-    # id = 6.
-    if users:
-        user = User.objects.filter(id__gte=users[-1] + 1).values('id').first()
-        user and self.apply_async(args=[user['id']], queue='default', countdown=5)
+    if user_ids is None:
+        # Changes made from now on need another task, see prerequisites.scheduler
+        cache.delete(pending_all_users_key())
+
+        # only cycle through users currently in a course
+        users = CourseStudent.objects.all_users_for_active_semester()
+        user_ids = list(users.order_by('id').filter(id__gte=start_from_user_id).values_list('id', flat=True))
+
+        num_tasks = split_between_tasks(self, user_ids)
+        if num_tasks:
+            return f"{len(user_ids)} users split between {num_tasks} tasks"
+
+    start = time.perf_counter()
+    num_users = bulk_update_quest_conditions_for_users(user_ids)
+    logger.info(
+        f"Task prerequisites.tasks.update_quest_conditions_all_users: cache of available quests updated for {num_users} users "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return num_users
@@ -3,12 +3,17 @@
 from django.utils.six import text_type
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
 
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 
-from prerequisites.models import IsAPrereqMixin, Prereq, PrereqAllConditionsMet
+from badges.models import Badge
+from courses.models import Rank
+from prerequisites.models import IsAPrereqMixin, Prereq, PrereqAllConditionsMet, PrereqEvaluationContext
+from quest_manager.models import Quest
+from siteconfig.models import SiteConfig
 
 User = get_user_model()
 
@@ -291,14 +296,14 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
     def test_object_creation(self):
         self.assertIsInstance(self.prereq_cache, PrereqAllConditionsMet)
         self.assertEqual(self.prereq_cache.user, self.student)
-        self.assertEqual(self.prereq_cache.ids, '[]')
+        self.assertEqual(self.prereq_cache.ids, [])
 
     def test_get_ids_when_empty(self):
         self.assertEqual([], self.prereq_cache.get_ids())
 
     def test_get_ids(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.ids = ids
         self.assertEqual(ids, self.prereq_cache.get_ids())
 
     def test_add_id(self):
@@ -313,7 +318,7 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
         self.assertEqual(self.prereq_cache.get_ids(), [100, 101])
 
     def test_remove_id(self):
-        self.prereq_cache.ids = str([1, 2, 3, 4, 5])
+        self.prereq_cache.set_ids([1, 2, 3, 4, 5])
         self.assertIn(1, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(1)
@@ -321,9 +326,264 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
 
     def test_remove_id_that_doesnt_exist(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.set_ids(ids)
         self.assertNotIn(6, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(6)
         self.assertNotIn(6, self.prereq_cache.get_ids())
         self.assertEqual(len(self.prereq_cache.get_ids()), len(ids))
+
+    def test_add_id_and_remove_id_are_saved(self):
+        """ add_id() and remove_id() update the database directly, without needing to save() """
+        self.prereq_cache.add_id(100)
+        self.prereq_cache.add_id(100)
+        self.prereq_cache.add_id(101)
+        self.prereq_cache.remove_id(100)
+
+        self.prereq_cache.refresh_from_db()
+        self.assertEqual(self.prereq_cache.get_ids(), [101])
+
+    def test_add_id_does_not_overwrite_concurrent_changes(self):
+        """ Changes made through another instance of the same row shouldn't be lost """
+        other_instance = PrereqAllConditionsMet.objects.get(pk=self.prereq_cache.pk)
+        other_instance.add_id(200)
+
+        self.prereq_cache.add_id(100)
+
+        self.prereq_cache.refresh_from_db()
+        self.assertCountEqual(self.prereq_cache.get_ids(), [100, 200])
+
+    def test_update_ids(self):
+        self.prereq_cache.set_ids([1, 2, 3])
+
+        self.prereq_cache.update_ids([3, 4], [1, 5])
+        self.assertCountEqual(self.prereq_cache.get_ids(), [2, 3, 4])
+
+        self.prereq_cache.refresh_from_db()
+        self.assertCountEqual(self.prereq_cache.get_ids(), [2, 3, 4])
+
+    def test_unnest_ids(self):
+        """ The cached ids can be used as a subquery """
+        quests = baker.make('quest_manager.Quest', _quantity=3)
+        self.prereq_cache.set_ids([quests[0].id, quests[2].id])
+
+        met_ids = PrereqAllConditionsMet.objects.filter(pk=self.prereq_cache.pk).unnest_ids()
+        self.assertCountEqual(Quest.objects.filter(pk__in=met_ids), [quests[0], quests[2]])
+
+
+class PrereqEvaluatorTest(TenantTestCase):
+    """ The set based PrereqEvaluator should give the same results as evaluating each Prereq one at a time """
+
+    def setUp(self):
+        self.student = baker.make(User, username='student', is_staff=False)
+        self.sem = SiteConfig.get().active_semester
+
+        self.quest_done = baker.make('quest_manager.Quest', name="done", max_repeats=-1)
+        self.quest_not_done = baker.make('quest_manager.Quest', name="not done")
+        self.badge_earned = baker.make('badges.Badge', name="earned")
+        self.badge_not_earned = baker.make('badges.Badge', name="not earned")
+
+        baker.make('quest_manager.QuestSubmission', user=self.student, quest=self.quest_done,
+                   is_completed=True, is_approved=True, semester=self.sem)
+        baker.make('badges.BadgeAssertion', user=self.student, badge=self.badge_earned, semester=self.sem)
+
+    def make_parent_with_prereq(self, **kwargs):
+        parent = baker.make('quest_manager.Quest')
+        Prereq.objects.create(parent_object=parent, **kwargs)
+        return parent
+
+    def assert_same_as_all_conditions_met(self, parents):
+        met_pks = Prereq.objects.all_conditions_met_pks(Quest.objects.filter(pk__in=[p.pk for p in parents]), self.student)
+        for parent in parents:
+            self.assertEqual(parent.pk in met_pks, Prereq.objects.all_conditions_met(parent, self.student), parent)
+
+    def test_all_conditions_met_pks(self):
+        no_prereqs = baker.make('quest_manager.Quest')
+        simple_met = self.make_parent_with_prereq(prereq_object=self.quest_done)
+        simple_not_met = self.make_parent_with_prereq(prereq_object=self.quest_not_done)
+        count_not_met = self.make_parent_with_prereq(prereq_object=self.quest_done, prereq_count=2)
+        not_met = self.make_parent_with_prereq(prereq_object=self.badge_earned, prereq_invert=True)
+        or_met = self.make_parent_with_prereq(prereq_object=self.quest_not_done, or_prereq_object=self.badge_earned)
+        or_not_met = self.make_parent_with_prereq(prereq_object=self.quest_not_done, or_prereq_object=self.badge_not_earned)
+        or_invert_met = self.make_parent_with_prereq(
+            prereq_object=self.quest_not_done, or_prereq_object=self.badge_not_earned, or_prereq_invert=True
+        )
+
+        nested = Prereq.objects.create(
+            name="nested", parent_object=self.quest_not_done, prereq_object=self.badge_not_earned, or_prereq_object=self.quest_done
+        )
+        nested_met = self.make_parent_with_prereq(prereq_object=nested)
+
+        # two prereqs on the same parent must both be met
+        both_not_met = self.make_parent_with_prereq(prereq_object=self.quest_done)
+        Prereq.objects.create(parent_object=both_not_met, prereq_object=self.badge_not_earned)
+
+        parents = [no_prereqs, simple_met, simple_not_met, count_not_met, not_met, or_met, or_not_met, or_invert_met,
+                   nested_met, both_not_met]
+        met_pks = Prereq.objects.all_conditions_met_pks(Quest.objects.filter(pk__in=[p.pk for p in parents]), self.student)
+        self.assertCountEqual(met_pks, [no_prereqs.pk, simple_met.pk, or_met.pk, or_invert_met.pk, nested_met.pk])
+
+        self.assert_same_as_all_conditions_met(parents)
+
+    def test_all_conditions_met_pks__no_prereq_means(self):
+        no_prereqs = baker.make('quest_manager.Quest')
+        met_pks = Prereq.objects.all_conditions_met_pks(Quest.objects.filter(pk=no_prereqs.pk), self.student, no_prereq_means=False)
+        self.assertEqual(met_pks, [])
+
+    def test_all_conditions_met_pks__deleted_prereq_object(self):
+        """ A prereq object that no longer exists is never met, even when inverted """
+        deleted_grade = baker.make('courses.Grade')
+        parent = self.make_parent_with_prereq(prereq_object=deleted_grade, prereq_invert=True)
+        deleted_grade.delete()
+
+        self.assertEqual(Prereq.objects.all_conditions_met_pks(Quest.objects.filter(pk=parent.pk), self.student), [])
+
+    def test_all_conditions_met_pks_for_users(self):
+        """ Evaluating many users at once gives the same results as evaluating them one at a time """
+        other_student = baker.make(User, username='other_student', is_staff=False)
+        baker.make('badges.BadgeAssertion', user=other_student, badge=self.badge_not_earned, semester=self.sem)
+
+        parents = [
+            baker.make('quest_manager.Quest'),
+            self.make_parent_with_prereq(prereq_object=self.quest_done),
+            self.make_parent_with_prereq(prereq_object=self.badge_earned, or_prereq_object=self.badge_not_earned),
+            self.make_parent_with_prereq(prereq_object=self.badge_not_earned, prereq_invert=True),
+            self.make_parent_with_prereq(prereq_object=baker.make('courses.Rank', xp=0)),
+        ]
+        parent_qs = Quest.objects.filter(pk__in=[p.pk for p in parents])
+
+        met_pks_by_user = Prereq.objects.all_conditions_met_pks_for_users(parent_qs, [self.student, other_student])
+        self.assertCountEqual(met_pks_by_user[self.student.id], Prereq.objects.all_conditions_met_pks(parent_qs, self.student))
+        self.assertCountEqual(met_pks_by_user[other_student.id], Prereq.objects.all_conditions_met_pks(parent_qs, other_student))
+        self.assertNotEqual(sorted(met_pks_by_user[self.student.id]), sorted(met_pks_by_user[other_student.id]))
+
+        self.assertCountEqual(
+            Prereq.objects.all_conditions_met_user_ids(parents[1], [self.student, other_student]), [self.student.id]
+        )
+
+    def test_all_conditions_met_pks__constant_number_of_queries(self):
+        """ The number of queries should not grow with the number of quests being evaluated """
+        self.make_parent_with_prereq(prereq_object=self.quest_done)
+        self.make_parent_with_prereq(prereq_object=self.badge_earned)
+
+        with CaptureQueriesContext(connection) as few_quests:
+            Prereq.objects.all_conditions_met_pks(Quest.objects.all(), self.student)
+
+        for _ in range(10):
+            self.make_parent_with_prereq(prereq_object=self.quest_not_done, or_prereq_object=self.badge_earned)
+            self.make_parent_with_prereq(prereq_object=self.badge_not_earned, prereq_count=3)
+
+        with CaptureQueriesContext(connection) as many_quests:
+            Prereq.objects.all_conditions_met_pks(Quest.objects.all(), self.student)
+
+        self.assertEqual(len(few_quests), len(many_quests))
+
+
+class PrereqEvaluationContextTest(TenantTestCase):
+    """ Facts about the user are loaded once per evaluation run and shared by all the prereqs """
+
+    def setUp(self):
+        self.student = baker.make(User, username='student', is_staff=False)
+        self.sem = SiteConfig.get().active_semester
+
+        self.course = baker.make('courses.Course')
+        self.block = baker.make('courses.Block')
+        self.grade = baker.make('courses.Grade')
+        baker.make('courses.CourseStudent', user=self.student, semester=self.sem, course=self.course, block=self.block,
+                   grade_fk=self.grade)
+
+        self.quest = baker.make('quest_manager.Quest')
+        baker.make('quest_manager.QuestSubmission', user=self.student, quest=self.quest,
+                   is_completed=True, is_approved=True, semester=self.sem)
+        self.badge = baker.make('badges.Badge')
+        baker.make('badges.BadgeAssertion', user=self.student, badge=self.badge, semester=self.sem)
+
+    def test_get_is_memoized(self):
+        context = PrereqEvaluationContext(self.student)
+        calls = []
+
+        def load(user):
+            calls.append(user)
+            return 42
+
+        self.assertEqual(context.get('answer', load), 42)
+        self.assertEqual(context.get('answer', load), 42)
+        self.assertEqual(calls, [self.student])
+
+    def test_facts(self):
+        context = PrereqEvaluationContext(self.student)
+
+        self.assertEqual(context.current_courses_values('course_id'), {self.course.pk})
+        self.assertEqual(context.current_courses_values('block_id'), {self.block.pk})
+        self.assertEqual(context.current_courses_values('grade_fk__value'), {self.grade.value})
+        self.assertEqual(context.approved_count_per_quest(), {self.quest.pk: 1})
+        self.assertEqual(context.assertion_count_per_badge(), {self.badge.pk: 1})
+        self.assertEqual(context.xp(), self.student.profile.xp_cached)
+
+    def test_condition_met__shared_context(self):
+        """ Once each kind of fact has been loaded, checking more prereqs doesn't need any queries """
+        parent = baker.make('quest_manager.Quest')
+        prereq_objects = [self.course, self.block, self.grade, self.quest, self.badge, baker.make('courses.Rank', xp=0)]
+        prereqs = [Prereq.objects.create(parent_object=parent, prereq_object=obj) for obj in prereq_objects]
+        for prereq in prereqs:
+            prereq.get_prereq()  # load the generic foreign keys first
+
+        context = PrereqEvaluationContext(self.student)
+        for prereq in prereqs:
+            self.assertTrue(prereq.condition_met(self.student, context=context), prereq.get_prereq())
+
+        with self.assertNumQueries(0):
+            for prereq in prereqs:
+                self.assertTrue(prereq.condition_met(self.student, context=context))
+
+        # the current courses are only queried once for the Course, Block and Grade prereqs
+        context = PrereqEvaluationContext(self.student)
+        prereqs[0].condition_met(self.student, context=context)
+        with self.assertNumQueries(0):
+            prereqs[1].condition_met(self.student, context=context)
+            prereqs[2].condition_met(self.student, context=context)
+
+        self.assertTrue(Prereq.objects.all_conditions_met(parent, self.student))
+
+
+class PrereqReverseIndexTest(TenantTestCase):
+
+    def setUp(self):
+        self.badge = baker.make('badges.Badge')
+        self.other_badge = baker.make('badges.Badge')
+
+    def test_get_reliant_parent_ids(self):
+        direct = baker.make('quest_manager.Quest')
+        Prereq.add_simple_prereq(direct, self.badge)
+        alternate = baker.make('quest_manager.Quest')
+        Prereq.objects.create(parent_object=alternate, prereq_object=self.other_badge, or_prereq_object=self.badge)
+        nested_prereq = Prereq.objects.create(parent_object=baker.make('quest_manager.Quest'), prereq_object=self.badge)
+        nested = baker.make('quest_manager.Quest')
+        Prereq.objects.create(parent_object=nested, prereq_object=nested_prereq)
+        not_reliant = baker.make('quest_manager.Quest')
+        Prereq.add_simple_prereq(not_reliant, self.other_badge)
+
+        reliant_ids = Prereq.objects.get_reliant_parent_ids(Badge, [self.badge.id], Quest)
+        self.assertCountEqual(reliant_ids, [direct.id, alternate.id, nested_prereq.parent_object_id, nested.id])
+
+        # only parents of the requested model
+        badge_parent = baker.make('badges.Badge')
+        Prereq.add_simple_prereq(badge_parent, self.badge)
+        self.assertEqual(Prereq.objects.get_reliant_parent_ids(Badge, [self.badge.id], Badge), {badge_parent.id})
+
+    def test_get_reliant_parent_ids_for_model(self):
+        rank_quest = baker.make('quest_manager.Quest')
+        Prereq.add_simple_prereq(rank_quest, baker.make('courses.Rank'))
+        Prereq.add_simple_prereq(baker.make('quest_manager.Quest'), self.badge)
+
+        self.assertEqual(Prereq.objects.get_reliant_parent_ids_for_model(Rank, Quest), {rank_quest.id})
+
+    def test_reverse_index_is_invalidated_when_prereqs_change(self):
+        quest = baker.make('quest_manager.Quest')
+        self.assertEqual(Prereq.objects.get_reliant_parent_ids(Badge, [self.badge.id], Quest), set())
+
+        prereq = Prereq.add_simple_prereq(quest, self.badge)
+        self.assertEqual(Prereq.objects.get_reliant_parent_ids(Badge, [self.badge.id], Quest), {quest.id})
+
+        prereq.delete()
+        self.assertEqual(Prereq.objects.get_reliant_parent_ids(Badge, [self.badge.id], Quest), set())
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django_tenants.test.cases import TenantTestCase
+
+from prerequisites import scheduler
+
+
+@patch('prerequisites.tasks.update_quest_conditions_all_users.apply_async')
+@patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
+@patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
+class SchedulerTest(TenantTestCase):
+
+    def setUp(self):
+        scheduler.flush(connection.schema_name)
+        cache.clear()
+
+    def flush(self):
+        """ Batches are flushed once the transaction is committed, which never happens in a TestCase """
+        scheduler.flush(connection.schema_name)
+
+    def test_user_updates_are_merged(self, user_task, quest_task, all_users_task):
+        scheduler.schedule_user_update(1, [10])
+        scheduler.schedule_user_update(1, [11, 10])
+        scheduler.schedule_user_update(2, [10])
+        scheduler.schedule_user_update(2)
+        self.flush()
+
+        self.assertEqual(user_task.call_count, 2)
+        quest_ids_by_user = {call.kwargs['args'][0]: call.kwargs['kwargs']['quest_ids'] for call in user_task.call_args_list}
+        self.assertEqual(quest_ids_by_user, {1: [10, 11], 2: None})
+
+    def test_quest_updates_are_merged_and_debounced(self, user_task, quest_task, all_users_task):
+        scheduler.schedule_quest_update(1)
+        scheduler.schedule_quest_update(1)
+        scheduler.schedule_quest_update(2)
+        self.flush()
+        self.assertEqual(quest_task.call_count, 2)
+
+        # the tasks haven't started yet, so they will include these changes
+        scheduler.schedule_quest_update(1)
+        self.flush()
+        self.assertEqual(quest_task.call_count, 2)
+
+        # once started, another task is needed
+        cache.delete(scheduler.pending_quest_key(1))
+        scheduler.schedule_quest_update(1)
+        self.flush()
+        self.assertEqual(quest_task.call_count, 3)
+        quest_task.assert_called_with(
+            kwargs={'quest_id': 1, 'start_from_user_id': 1}, queue='default', countdown=settings.CONDITIONS_UPDATE_DEBOUNCE
+        )
+
+    def test_all_users_updates_are_merged(self, user_task, quest_task, all_users_task):
+        for _ in range(3):
+            scheduler.schedule_all_users_update()
+        self.flush()
+        scheduler.schedule_all_users_update()
+        self.flush()
+
+        self.assertEqual(all_users_task.call_count, 1)
+
+    def test_nothing_scheduled(self, user_task, quest_task, all_users_task):
+        self.flush()
+
+        self.assertEqual(user_task.call_count + quest_task.call_count + all_users_task.call_count, 0)
+        self.assertEqual(scheduler.get_metrics(), {'signals': 0, 'tasks': 0, 'merged': 0})
+
+    def test_metrics(self, user_task, quest_task, all_users_task):
+        scheduler.schedule_user_update(1)
+        scheduler.schedule_user_update(1)
+        scheduler.schedule_quest_update(1)
+        scheduler.schedule_all_users_update()
+        scheduler.schedule_all_users_update()
+        self.flush()
+
+        self.assertEqual(scheduler.get_metrics(), {'signals': 5, 'tasks': 3, 'merged': 2})
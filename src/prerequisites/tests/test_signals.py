@@ -1,6 +1,11 @@
+from contextlib import contextmanager
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
 from django_tenants.test.cases import TenantTestCase
 from django_tenants.test.client import TenantClient
 from freezegun import freeze_time
@@ -9,6 +14,7 @@ from model_bakery import baker
 
 from badges.models import Badge, BadgeAssertion
 from courses.models import CourseStudent, Semester
+from prerequisites import scheduler
 from prerequisites.models import Prereq
 from quest_manager.models import Quest, QuestSubmission
 from djcytoscape.models import CytoScape
@@ -38,124 +44,175 @@ class PrerequisitesSignalsTest(TenantTestCase):
                                          user=self.student,
                                          active=False)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+        # start each test without pending updates
+        scheduler.flush(connection.schema_name)
+        cache.clear()
+
+    @contextmanager
+    def flush_scheduled_updates(self):
+        """ The updates are only started once the transaction is committed, which never happens in a TestCase.
+        See prerequisites.scheduler """
+        yield
+        scheduler.flush(connection.schema_name)
+
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_badge_assertion_on_create(self, task):
         """
         Creation of a new badge assertion (granting a badge to a student) should trigger a signal
         """
-        baker.make(BadgeAssertion, user=self.student, do_not_grant_xp=True, semester=self.sem)
+        with self.flush_scheduled_updates():
+            baker.make(BadgeAssertion, user=self.student, do_not_grant_xp=True, semester=self.sem)
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_badge_assertion_on_update(self, task):
         """
         Updating a new badge assertion (granting a badge to a student) should trigger a signal
         """
         self.badge_assertion.do_not_grant_xp = False
-        self.badge_assertion.save()
+        with self.flush_scheduled_updates():
+            self.badge_assertion.save()
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_quest_summission_on_create(self, task):
         """
         Creation of a new quest_submission (when starting a quest) should NOT trigger a signal
         """
-        baker.make(QuestSubmission, user=self.student, is_completed=False)
+        with self.flush_scheduled_updates():
+            baker.make(QuestSubmission, user=self.student, is_completed=False)
         self.assertEqual(task.call_count, 0)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_quest_summission_on_update(self, task):
         """
         Updating a quest_submission (when completing a quest) should trigger a signal
         """
         self.quest_submission.is_approved = True
         self.quest_submission.is_completed = True
-        self.quest_submission.save()
+        with self.flush_scheduled_updates():
+            self.quest_submission.save()
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
+    def test_update_conditions_met_for_user_only_for_reliant_quests(self, task):
+        """
+        Granting a badge should only re-evaluate the quests that rely on that badge, or on a rank (because of the XP)
+        """
+        badge = baker.make(Badge)
+        badge_quest = baker.make(Quest)
+        Prereq.add_simple_prereq(badge_quest, badge)
+        rank_quest = baker.make(Quest)
+        Prereq.add_simple_prereq(rank_quest, baker.make('courses.Rank'))
+        baker.make(Quest)  # no prereqs, not reliant on the badge
+
+        with self.flush_scheduled_updates():
+            baker.make(BadgeAssertion, user=self.student, badge=badge, do_not_grant_xp=True, semester=self.sem)
+        self.assertEqual(task.call_count, 1)
+        self.assertEqual(task.call_args.kwargs['kwargs'], {'quest_ids': sorted([badge_quest.id, rank_quest.id])})
+
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_course_student_on_create(self, task):
-        with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback:
+        with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback, self.flush_scheduled_updates():
             baker.make(CourseStudent, user=self.student, active=False)
-            self.assertEqual(task.call_count, 1)
-            self.assertEqual(callback.call_count, 1)
+        self.assertEqual(task.call_count, 1)
+        # all quests are re-evaluated
+        self.assertEqual(task.call_args.kwargs['kwargs'], {'quest_ids': None})
+        self.assertEqual(callback.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_course_student_on_update(self, task):
-        with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback:
+        with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback, self.flush_scheduled_updates():
             self.course_student.active = True
             self.course_student.save()
-            self.assertEqual(task.call_count, 1)
-            self.assertEqual(callback.call_count, 1)
+        self.assertEqual(task.call_count, 1)
+        self.assertEqual(callback.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_all_users.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_all_users.apply_async')
     def test_update_prereq_cache_triggered_by_badge(self, task):
-        """Creation and Update of a badge should...
+        """Creation and Update of a badge should trigger a single cache update for all users
         """
-        badge = baker.make(Badge, active=True)  # creation
-        badge.active = False
-        badge.save()  # update
-        self.assertEqual(task.call_count, 2)
+        with self.flush_scheduled_updates():
+            badge = baker.make(Badge, active=True)  # creation
+            badge.active = False
+            badge.save()  # update
+        self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_all_users.apply_async')
+    @patch('prerequisites.tasks.update_quest_conditions_all_users.apply_async')
     def test_update_cache_triggered_by_quest_without_prereqs(self, task):
         """
         Creation and Update of a Quest without a prerequisite should trigger a cache update
         """
-        quest = baker.make(Quest)   # creation
-        quest.verification_required = False
-        quest.save()  # update
-        self.assertEqual(task.call_count, 2)
+        with self.flush_scheduled_updates():
+            quest = baker.make(Quest)   # creation
+            quest.verification_required = False
+            quest.save()  # update
+        self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_update_prereq_cache_triggered_by_quest(self, task):
         """Creation and Update of a quest should not trigger a cache update, only when a prereq is added to the quest (covered elsewhere).
         """
-        quest = baker.make(Quest, verification_required=True)  # creation
-        quest.verification_required = False
-        quest.save()  # update
+        with self.flush_scheduled_updates():
+            quest = baker.make(Quest, verification_required=True)  # creation
+            quest.verification_required = False
+            quest.save()  # update
         self.assertEqual(task.call_count, 0)
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_update_prereq_cache_triggered_by_quest_available_outside_course(self, task):
         """Creation and Update of a quest should trigger a cache update, only when it is available outside the course.
         """
-        quest = baker.make(Quest, verification_required=True)  # creation
-        quest.available_outside_course = True
-        quest.save()  # update
+        with self.flush_scheduled_updates():
+            quest = baker.make(Quest, verification_required=True)  # creation
+            quest.available_outside_course = True
+            quest.save()  # update
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_update_cache_triggered_by_non_quest_prereq(self, task):
         """
         Creation and Update of a prereq where the parent is not a quest should not trigger a cache update
         """
-        badge = baker.make(Badge)
-        prereq = baker.make(Prereq, prereq_invert=True, parent_object=badge)  # creation
-        prereq.prereq_invert = False
-        prereq.save()  # update
+        with self.flush_scheduled_updates():
+            badge = baker.make(Badge)
+            prereq = baker.make(Prereq, prereq_invert=True, parent_object=badge)  # creation
+            prereq.prereq_invert = False
+            prereq.save()  # update
         self.assertEqual(task.call_count, 0)
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_update_cache_triggered_by_quest_prereq_changes(self, task):
-        """Creation and Update of a prereq where the parent IS a quest should both trigger a cache update
+        """Creation and Update of a prereq where the parent IS a quest should both trigger a cache update,
+        which are merged into a single one.
         """
         quest = baker.make('quest_manager.quest')
-        prereq = baker.make(Prereq, prereq_invert=True, parent_object=quest)  # creation
-        prereq.prereq_invert = False
-        prereq.save()  # update
-        self.assertEqual(task.call_count, 2)
-        task.assert_called_with(kwargs={'quest_id': quest.id, 'start_from_user_id': 1}, queue='default')
+        with self.flush_scheduled_updates():
+            prereq = baker.make(Prereq, prereq_invert=True, parent_object=quest)  # creation
+            prereq.prereq_invert = False
+            prereq.save()  # update
+        self.assertEqual(task.call_count, 1)
+        task.assert_called_with(
+            kwargs={'quest_id': quest.id, 'start_from_user_id': 1}, queue='default', countdown=settings.CONDITIONS_UPDATE_DEBOUNCE
+        )
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+        # the update is still waiting to start, so it will include later changes
+        with self.flush_scheduled_updates():
+            prereq.delete()
+        self.assertEqual(task.call_count, 1)
+
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_update_cache_triggered_by_parent_object_deletion(self, task):
         """When a quest is deleted it will cascade to delete any prereqs for which it is a parent.
         That shouldn't break this signal.
         """
         quest = baker.make('quest_manager.quest')
-        baker.make(Prereq, prereq_invert=True, parent_object=quest)  # creation
+        with self.flush_scheduled_updates():
+            baker.make(Prereq, prereq_invert=True, parent_object=quest)  # creation
+        self.assertEqual(task.call_count, 1)
 
-        quest.delete()  # doesn't call task because parent_object no longer exists.
+        with self.flush_scheduled_updates():
+            quest.delete()  # doesn't call task because parent_object no longer exists.
         self.assertEqual(task.call_count, 1)
 
     @patch('djcytoscape.tasks.regenerate_map.apply_async')
@@ -175,7 +232,8 @@ class PrerequisitesSignalsTest(TenantTestCase):
         self.assertEqual(task.call_count, 1)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
 
-        # should regenerate map on delete
+        # should regenerate map on delete, once the pending regeneration has started
+        cache.clear()
         prereq.delete()
         self.assertEqual(task.call_count, 2)
         self.assertEqual(task.call_args.kwargs['args'][0], [scape.id])
@@ -1 +1,82 @@
 # When prereq is changed, id is added/removed from cache
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from badges.models import Badge, BadgeAssertion
+from courses.models import CourseStudent
+from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.tasks import (
+    bulk_update_conditions_for_quest,
+    bulk_update_quest_conditions_for_users,
+    update_conditions_for_quest,
+    update_quest_conditions_all_users,
+)
+from quest_manager.models import Quest
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class BulkConditionsUpdateTest(TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.student_with_badge = baker.make(User, username='with_badge', is_staff=False)
+        self.student_without_badge = baker.make(User, username='without_badge', is_staff=False)
+        for student in [self.student_with_badge, self.student_without_badge]:
+            baker.make(CourseStudent, user=student, semester=self.sem)
+
+        self.badge = baker.make(Badge)
+        baker.make(BadgeAssertion, user=self.student_with_badge, badge=self.badge, semester=self.sem)
+
+        self.quest = baker.make(Quest, name='needs badge')
+        Prereq.add_simple_prereq(self.quest, self.badge)
+
+    def get_cached_ids(self, user):
+        return PrereqAllConditionsMet.objects.get(user=user, model_name=Quest.get_model_name()).get_ids()
+
+    def test_bulk_update_quest_conditions_for_users(self):
+        """ Caches are created for users that don't have one, and updated for those that do """
+        baker.make(PrereqAllConditionsMet, user=self.student_without_badge, model_name=Quest.get_model_name(), ids=[self.quest.id])
+
+        num_users = bulk_update_quest_conditions_for_users(
+            [self.student_with_badge.id, self.student_without_badge.id], chunk_size=1
+        )
+
+        self.assertEqual(num_users, 2)
+        self.assertIn(self.quest.id, self.get_cached_ids(self.student_with_badge))
+        self.assertNotIn(self.quest.id, self.get_cached_ids(self.student_without_badge))
+
+    def test_bulk_update_conditions_for_quest(self):
+        """ The quest is added or removed from existing caches only """
+        baker.make(PrereqAllConditionsMet, user=self.student_with_badge, model_name=Quest.get_model_name(), ids=[])
+        baker.make(PrereqAllConditionsMet, user=self.student_without_badge, model_name=Quest.get_model_name(), ids=[self.quest.id])
+        no_cache = baker.make(User)
+
+        num_users = bulk_update_conditions_for_quest(
+            self.quest, [self.student_with_badge.id, self.student_without_badge.id, no_cache.id]
+        )
+
+        self.assertEqual(num_users, 2)
+        self.assertEqual(self.get_cached_ids(self.student_with_badge), [self.quest.id])
+        self.assertEqual(self.get_cached_ids(self.student_without_badge), [])
+        self.assertFalse(PrereqAllConditionsMet.objects.filter(user=no_cache).exists())
+
+    def test_update_quest_conditions_all_users(self):
+        update_quest_conditions_all_users(start_from_user_id=1)
+
+        self.assertIn(self.quest.id, self.get_cached_ids(self.student_with_badge))
+        self.assertNotIn(self.quest.id, self.get_cached_ids(self.student_without_badge))
+
+    @override_settings(CONDITIONS_UPDATE_CHUNK_SIZE=1, CONDITIONS_UPDATE_PARALLELISM=2)
+    def test_update_conditions_for_quest__split_between_tasks(self):
+        with patch('prerequisites.tasks.update_conditions_for_quest.apply_async') as task:
+            update_conditions_for_quest(quest_id=self.quest.id, start_from_user_id=1)
+
+        self.assertEqual(task.call_count, 2)
+        user_ids = [user_id for call in task.call_args_list for user_id in call.kwargs['kwargs']['user_ids']]
+        self.assertCountEqual(user_ids, [self.student_with_badge.id, self.student_without_badge.id])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from profile_manager.models import Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare each student's cached XP, which is adjusted as submissions are approved and returned, "
+        "with the full XP calculation and report any drift"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Recalculate the XP and mark of the profiles that have drifted'
+        )
+
+    def handle(self, *args, **options):
+        profiles_qs = Profile.objects.all_for_active_semester()
+        xp_per_user = Profile.objects.calculate_xp_per_user(profiles_qs.values('user_id'))
+
+        drifted = []
+        for profile_id, user_id, username, xp_cached in profiles_qs.values_list('id', 'user_id', 'user__username', 'xp_cached'):
+            xp = xp_per_user.get(user_id, 0)
+            if xp != xp_cached:
+                drifted.append(profile_id)
+                self.stdout.write(f'{username}: cached {xp_cached} XP, calculated {xp} XP (drift {xp_cached - xp:+d})')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f'No drift found in {profiles_qs.count()} profiles'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'{len(drifted)} of {profiles_qs.count()} profiles have drifted'))
+
+        if options['fix']:
+            Profile.objects.xp_invalidate_cache(Profile.objects.filter(id__in=drifted))
+            self.stdout.write(self.style.SUCCESS(f'Recalculated {len(drifted)} profiles'))
@@ -1,11 +1,16 @@
 # import re
+from bisect import bisect_left
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.validators import validate_comma_separated_integer_list
 from django.db import models
 from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.templatetags.static import static
@@ -13,6 +18,7 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 
+import numpy
 from django_resized import ResizedImageField
 from django_tenants.utils import get_public_schema_name
 
@@ -27,6 +33,11 @@ from allauth.account.signals import email_confirmed, user_logged_in, email_confi
 from allauth.account.models import EmailAddress, EmailConfirmationHMAC
 
 
+def progress_chart_cache_key(user_id):
+    """ The key of the user's XP progress chart in the cache, see courses.views.ajax_progress_chart() """
+    return f'progress-chart-{user_id}'
+
+
 class ProfileQuerySet(models.query.QuerySet):
 
     def announcement_email(self):
@@ -61,6 +72,53 @@ class ProfileManager(models.Manager):
         qs = self.all_students().filter(user__in=courses_user_list, user__is_active=True)
         return qs
 
+    def calculate_xp_per_user(self, users):
+        """
+        The full calculation of the XP of many users from quests, badges and course adjustments, see Profile.xp_invalidate_cache()
+        :param users: a queryset or list of users
+        :return: a dict of {user_id: xp} for the users that have any XP
+        """
+        xp_per_user = defaultdict(int)
+        for xp_per_user_source in [
+            QuestSubmission.objects.calculate_xp_per_user(users),
+            BadgeAssertion.objects.calculate_xp_per_user(users),
+            CourseStudent.objects.calculate_xp_per_user(users),
+        ]:
+            for user_id, xp in xp_per_user_source.items():
+                xp_per_user[user_id] += xp
+        return dict(xp_per_user)
+
+    def xp_invalidate_cache(self, profiles_qs=None, batch_size=None):
+        """
+        The set based equivalent of calling Profile.xp_invalidate_cache() on each profile.
+        The XP from quests, badges and course adjustments is summed for all the users with one grouped query each,
+        then xp_cached and mark_cached are saved with a single bulk_update, so the number of queries doesn't grow
+        with the number of profiles.
+        :param profiles_qs: a queryset of the profiles to update, defaults to all_for_active_semester()
+        :param batch_size: passed to bulk_update()
+        :return: the number of profiles updated
+        """
+        if profiles_qs is None:
+            profiles_qs = self.all_for_active_semester()
+        users = profiles_qs.values('user_id')
+
+        xp_per_user = self.calculate_xp_per_user(users)
+        courses_per_user = CourseStudent.objects.current_courses_per_user(users)
+
+        config = SiteConfig.get()
+        cap_at_100 = config.cap_marks_at_100_percent
+        fraction_complete = config.active_semester.fraction_complete() if courses_per_user else None
+
+        profiles = list(profiles_qs.select_related(None).only('id', 'user', 'xp_cached', 'mark_cached'))
+        for profile in profiles:
+            profile.xp_cached = xp_per_user.get(profile.user_id, 0)
+            profile.mark_cached = self.model.calc_mark(
+                courses_per_user.get(profile.user_id), profile.xp_cached, fraction_complete, cap_at_100
+            )
+
+        self.bulk_update(profiles, ['xp_cached', 'mark_cached'], batch_size=batch_size)
+        return len(profiles)
+
     def get_mailing_list(
         self,
         *,
@@ -348,6 +406,19 @@ class Profile(models.Model):
         self.save()
         return xp
 
+    def xp_add(self, xp):
+        """
+        Adjusts xp_cached by the change in the user's XP, e.g. from a submission being approved, instead of recalculating
+        it from the user's whole history with xp_invalidate_cache().  The XP is added in the database so concurrent
+        changes aren't lost.  Any drift is reported and fixed by the `reconcile_xp` management command.
+        """
+        if not xp:
+            return
+        Profile.objects.filter(pk=self.pk).update(xp_cached=F('xp_cached') + xp)
+        self.refresh_from_db(fields=['xp_cached'])
+        self.mark_cached = self.mark()
+        self.save(update_fields=['mark_cached'])
+
     def xp_per_course(self):
         course_count = self.num_courses()
         if not course_count or course_count == 0:
@@ -362,11 +433,55 @@ class Profile(models.Model):
         xp += CourseStudent.objects.calculate_xp(self.user)
         return xp
 
+    def xp_to_dates(self, dates):
+        """
+        The same as calling xp_to_date() for each date, e.g. for the points of a progress chart, but the user's approved
+        submissions and badges are only fetched once.  Each one is placed in the first date it counts towards, and the
+        running totals are summed with numpy, applying each quest's max_xp as they go.
+        :param dates: a list of datetimes, in order
+        :return: a list of the XP earned up to and including each date
+        """
+        xp_per_date = numpy.zeros(len(dates) + 1, dtype=numpy.int64)  # the extra one is for anything after the last date
+
+        def bucket(time):
+            return bisect_left(dates, time)
+
+        submissions = QuestSubmission.objects.all_approved(self.user).grant_xp().filter(time_approved__isnull=False)
+        submissions = submissions.annotate(xp_earned=Greatest('quest__xp', 'xp_requested')).order_by('time_approved')
+
+        xp_per_quest = defaultdict(int)
+        for quest_id, max_xp, time_approved, xp_earned in submissions.values_list('quest_id', 'quest__max_xp', 'time_approved', 'xp_earned'):
+            xp_before = xp_per_quest[quest_id]
+            xp_per_quest[quest_id] += xp_earned
+            if max_xp == -1:  # no limit
+                xp_per_date[bucket(time_approved)] += xp_earned
+            else:
+                # Prevent xp going over the maximum gainable xp, see QuestSubmissionManager.calculate_xp_to_date()
+                max_xp = max_xp or 0
+                xp_per_date[bucket(time_approved)] += min(xp_per_quest[quest_id], max_xp) - min(xp_before, max_xp)
+
+        assertions = BadgeAssertion.objects.get_queryset(True).grant_xp().get_user(self.user)
+        for timestamp, xp in assertions.values_list('timestamp', 'badge__xp'):
+            xp_per_date[bucket(timestamp)] += xp or 0
+
+        xp_to_dates = numpy.cumsum(xp_per_date[:-1]) + CourseStudent.objects.calculate_xp(self.user)
+        return [int(xp) for xp in xp_to_dates]
+
     def mark(self):
-        courses = self.current_courses()
-        cap_at_100 = SiteConfig.get().cap_marks_at_100_percent
+        return self.calc_mark(self.current_courses(), self.xp_cached)
+
+    @staticmethod
+    def calc_mark(courses, xp, fraction_complete=None, cap_at_100=None):
+        """
+        :param courses: the student's current courses
+        :param fraction_complete: and cap_at_100 can be provided when calculating the marks of many students,
+            so they are only looked up once
+        :return: the mark for the xp, or None if there are no courses
+        """
+        if cap_at_100 is None:
+            cap_at_100 = SiteConfig.get().cap_marks_at_100_percent
         if courses:
-            mark = courses[0].calc_mark(self.xp_cached) / len(courses)
+            mark = courses[0].calc_mark(xp, fraction_complete) / len(courses)
             if cap_at_100:
                 return min(mark, 100)
             else:
@@ -448,6 +563,17 @@ def create_profile(sender, **kwargs):
                 verb='.  New user registered: ')
 
 
+@receiver(post_save, sender=QuestSubmission)
+@receiver(post_delete, sender=QuestSubmission)
+@receiver(post_save, sender=BadgeAssertion)
+@receiver(post_delete, sender=BadgeAssertion)
+@receiver(post_save, sender=CourseStudent)
+@receiver(post_delete, sender=CourseStudent)
+def invalidate_progress_chart(sender, instance, **kwargs):
+    """ The user's XP might have changed, e.g. a submission was approved, so their progress chart needs to be redrawn """
+    cache.delete(progress_chart_cache_key(instance.user_id))
+
+
 @receiver(post_delete, sender=Profile)
 def post_delete_user(sender, instance, *args, **kwargs):
     """If a profile is deleted, then that to cascade and delete profile as well.
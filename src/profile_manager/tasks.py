@@ -1,19 +1,26 @@
 from hackerspace_online.celery import app
 
-from django_tenants.utils import tenant_context, get_tenant_model
+from tenant.scheduler import run_on_all_schemas
 from .models import Profile
 
 
 @app.task(name="profile_manager.tasks.invalidate_profile_xp_cache_in_all_schemas")
 def invalidate_profile_xp_cache_in_all_schemas():
     """
-    Dispatcher task that calls invalidate_xp_cache_on_schema for each schema
+    Dispatcher task that runs invalidate_profile_xp_cache() on each schema, see tenant.scheduler
     """
-    for tenant in get_tenant_model().objects.exclude(schema_name="public"):
-        with tenant_context(tenant):
-            invalidate_profile_xp_cache_on_schema.apply_async(queue='default')
+    num_tasks = run_on_all_schemas('profile_manager.tasks.invalidate_profile_xp_cache')
 
-    return "Scheduled invalidate_profile_xp_cache_on_schema for all schemas"
+    return f"Scheduled invalidate_profile_xp_cache for all schemas in {num_tasks} tasks"
+
+
+def invalidate_profile_xp_cache():
+    """
+    Invalidate xp cache of all profiles for the current schema to recalculate xp
+
+    :return: the number of profiles
+    """
+    return Profile.objects.xp_invalidate_cache()
 
 
 @app.task(name="profile_manager.tasks.invalidate_profile_xp_cache_on_schema")
@@ -22,9 +29,6 @@ def invalidate_profile_xp_cache_on_schema():
     Invalidate xp cache of all profiles for a schema to recalculate xp
     """
 
-    profiles_qs = Profile.objects.all_for_active_semester()
-
-    for profile in profiles_qs:
-        profile.xp_invalidate_cache()
+    num_profiles = invalidate_profile_xp_cache()
 
-    return f"Successfully invalidated {profiles_qs.count()} profiles."
+    return f"Successfully invalidated {num_profiles} profiles."
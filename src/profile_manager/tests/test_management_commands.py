@@ -0,0 +1,39 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from courses.models import CourseStudent
+from profile_manager.models import Profile
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class ReconcileXPCommandTest(TenantTestCase):
+
+    def setUp(self):
+        self.student = baker.make(User, username='student')
+        baker.make(CourseStudent, user=self.student, semester=SiteConfig.get().active_semester, xp_adjustment=10)
+
+    def call_command(self, *args):
+        out = StringIO()
+        call_command('reconcile_xp', *args, stdout=out)
+        return out.getvalue()
+
+    def test_no_drift(self):
+        output = self.call_command()
+        self.assertIn('No drift found', output)
+
+    def test_drift(self):
+        Profile.objects.filter(user=self.student).update(xp_cached=15)
+
+        output = self.call_command()
+        self.assertIn('student: cached 15 XP, calculated 10 XP (drift +5)', output)
+        self.assertEqual(Profile.objects.get(user=self.student).xp_cached, 15)
+
+        self.call_command('--fix')
+        self.assertEqual(Profile.objects.get(user=self.student).xp_cached, 10)
+        self.assertIn('No drift found', self.call_command())
@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django_tenants.test.cases import TenantTestCase
 
 from model_bakery import baker
@@ -67,3 +69,64 @@ class ProfileManagerTest(TenantTestCase):
         expected_qs = [user.username for user in expected_qs]
 
         self.assertEqual(set(qs), set(expected_qs))
+
+
+class ProfileManagerXpInvalidateCacheTest(TenantTestCase):
+    """ The bulk xp_invalidate_cache() should give the same results as Profile.xp_invalidate_cache() """
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.course = baker.make(Course, xp_for_100_percent=100)
+        self.students = baker.make(User, is_staff=False, _quantity=3)
+        for index, student in enumerate(self.students):
+            baker.make(CourseStudent, user=student, course=self.course, semester=self.sem, xp_adjustment=index * 5)
+
+        capped_quest = baker.make('quest_manager.Quest', xp=10, max_xp=15, max_repeats=-1)
+        custom_quest = baker.make('quest_manager.Quest', xp=5, max_xp=-1)
+        badge = baker.make('badges.Badge', xp=7)
+
+        def approve(user, quest, **kwargs):
+            baker.make('quest_manager.QuestSubmission', user=user, quest=quest, semester=self.sem,
+                       is_completed=True, is_approved=True, **kwargs)
+
+        first, second, _ = self.students
+        for _ in range(3):
+            approve(first, capped_quest)
+        approve(first, custom_quest, xp_requested=20)
+        approve(first, custom_quest, xp_requested=1)
+        approve(second, custom_quest, do_not_grant_xp=True)
+        approve(second, capped_quest)
+        baker.make('badges.BadgeAssertion', user=second, badge=badge, semester=self.sem)
+        baker.make('badges.BadgeAssertion', user=second, badge=badge, semester=self.sem, do_not_grant_xp=True)
+
+    def test_xp_invalidate_cache(self):
+        expected = {}
+        for student in self.students:
+            profile = Profile.objects.get(user=student)
+            profile.xp_invalidate_cache()
+            expected[student.id] = (profile.xp_cached, profile.mark_cached)
+        Profile.objects.filter(user__in=self.students).update(xp_cached=0, mark_cached=None)
+
+        num_profiles = Profile.objects.xp_invalidate_cache(Profile.objects.filter(user__in=self.students))
+
+        self.assertEqual(num_profiles, 3)
+        for student in self.students:
+            profile = Profile.objects.get(user=student)
+            self.assertEqual((profile.xp_cached, profile.mark_cached), expected[student.id])
+
+        # 15 (capped) + 20 + 5 from quests, 10 (second student) + 7 from badges, adjustments
+        self.assertEqual([expected[student.id][0] for student in self.students], [40, 10 + 7 + 5, 10])
+
+    def test_xp_invalidate_cache__constant_number_of_queries(self):
+        Profile.objects.xp_invalidate_cache()  # so cached config lookups don't skew the count
+
+        with CaptureQueriesContext(connection) as few_students:
+            Profile.objects.xp_invalidate_cache()
+
+        for _ in range(5):
+            baker.make(CourseStudent, user=baker.make(User), course=self.course, semester=self.sem)
+
+        with CaptureQueriesContext(connection) as many_students:
+            Profile.objects.xp_invalidate_cache()
+
+        self.assertEqual(len(few_students), len(many_students))
@@ -1,13 +1,17 @@
+import datetime
 from unittest.mock import Mock, patch
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import SimpleTestCase
+from django.utils import timezone
 
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 from model_bakery.recipe import Recipe
 
+from badges.models import BadgeAssertion
 from courses.models import Semester
-from profile_manager.models import Profile, smart_list
+from profile_manager.models import Profile, progress_chart_cache_key, smart_list
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -202,6 +206,39 @@ class ProfileTestModel(TenantTestCase):
         config.cap_marks_at_100_percent = False
         config.save()
 
+    def test_xp_to_dates(self):
+        """ Same results as xp_to_date() for each date, including max_xp """
+        self.create_active_course_registration()
+        day = timezone.make_aware(datetime.datetime(2024, 1, 1, 12))
+        capped_quest = baker.make('quest_manager.Quest', xp=10, max_xp=15, max_repeats=-1)
+        custom_quest = baker.make('quest_manager.Quest', xp=5, max_xp=-1)
+
+        def approve(quest, days, **kwargs):
+            baker.make('quest_manager.QuestSubmission', user=self.user, quest=quest, semester=self.active_sem,
+                       is_completed=True, is_approved=True, time_approved=day + datetime.timedelta(days=days), **kwargs)
+
+        approve(capped_quest, 0)
+        approve(capped_quest, 1)
+        approve(capped_quest, 2)
+        approve(custom_quest, 1, xp_requested=20)
+        approve(custom_quest, 3, do_not_grant_xp=True)
+        assertion = baker.make('badges.BadgeAssertion', user=self.user, badge__xp=7, semester=self.active_sem)
+        BadgeAssertion.objects.filter(pk=assertion.pk).update(timestamp=day + datetime.timedelta(days=2))
+
+        dates = [day + datetime.timedelta(days=days, hours=1) for days in range(-1, 5)]
+        xp_to_dates = self.profile.xp_to_dates(dates)
+
+        self.assertEqual(xp_to_dates, [self.profile.xp_to_date(date) for date in dates])
+        self.assertEqual(xp_to_dates, [0, 10, 35, 42, 42, 42])
+
+    def test_invalidate_progress_chart__course_removed(self):
+        """ Removing a student from a course redraws their progress chart """
+        course_student = self.create_active_course_registration()
+        cache.set(progress_chart_cache_key(self.user.id), 'chart')
+
+        course_student.delete()
+        self.assertIsNone(cache.get(progress_chart_cache_key(self.user.id)))
+
 
 class SmartListTests(SimpleTestCase):
 
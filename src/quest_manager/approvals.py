@@ -0,0 +1,215 @@
+"""
+Approves or returns many submissions at once, e.g. when a teacher works through the approvals queue.
+
+Doing the same as ApproveView.post() for each submission would recalculate each student's badges and XP once per
+submission, and create each comment and notification with its own queries.  Here the submissions are updated together
+in one transaction, the badges and XP are recalculated once per affected student, the comments and notifications are
+created with bulk_create, and the update of each student's available quests is merged into one task per student by
+prerequisites.scheduler.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from badges.models import BadgeAssertion
+from comments.models import Comment, clean_html
+from courses.models import CourseStudent, Rank
+from notifications.models import Notification, notify_rank_up, unread_counts_cache_key
+from prerequisites.models import Prereq
+from prerequisites.scheduler import schedule_user_update
+from profile_manager.models import Profile, progress_chart_cache_key
+from quest_manager.models import Category, Quest, QuestSubmission, invalidate_awaiting_approval_counts
+from siteconfig.models import SiteConfig
+
+APPROVE = 'approve'
+RETURN = 'return'
+
+APPROVE_ICON = (
+    "<span class='fa-stack'>"
+    + "<i class='fa fa-check fa-stack-2x text-success'></i>"
+    + "<i class='fa fa-shield fa-stack-1x'></i>"
+    + "</span>"
+)
+RETURN_ICON = (
+    "<span class='fa-stack'>"
+    + "<i class='fa fa-shield fa-stack-1x'></i>"
+    + "<i class='fa fa-ban fa-stack-2x text-danger'></i>"
+    + "</span>"
+)
+
+
+def bulk_approve(submission_ids, teacher, comment_text=None):
+    """ Approves the submissions that are awaiting approval, see bulk_mark_submissions() """
+    return bulk_mark_submissions(submission_ids, teacher, APPROVE, comment_text)
+
+
+def bulk_return(submission_ids, teacher, comment_text=None):
+    """ Returns the submissions that are awaiting approval, see bulk_mark_submissions() """
+    return bulk_mark_submissions(submission_ids, teacher, RETURN, comment_text)
+
+
+def bulk_mark_submissions(submission_ids, teacher, action, comment_text=None):
+    """
+    The bulk equivalent of approving or returning each submission with ApproveView, in a single transaction.
+    Submissions that aren't awaiting approval (e.g. another teacher already approved them) are left alone.
+
+    :param submission_ids: ids of the QuestSubmissions
+    :param teacher: the staff member approving or returning them, who is the sender of the comments and notifications
+    :param action: APPROVE or RETURN
+    :param comment_text: added as a comment to each submission, defaults to the SiteConfig's blank approval/return text
+    :return: the list of submissions that were approved or returned
+    """
+    if action not in (APPROVE, RETURN):
+        raise ValueError(f"Unknown action: {action}")
+
+    config = SiteConfig.get()
+    if not comment_text or comment_text == "<p><br></p>":
+        blank_text = config.blank_approval_text if action == APPROVE else config.blank_return_text
+        comment_text = f"<p>{blank_text}</p>"
+
+    with transaction.atomic():
+        qs = QuestSubmission.objects.get_queryset(
+            exclude_archived_quests=False, exclude_quests_not_visible_to_students=False, include_related=False,
+        )
+        submissions = list(
+            qs.select_for_update(of=('self',))
+            .filter(id__in=submission_ids, is_completed=True, is_approved=False)
+            .select_related('quest', 'user')
+            .order_by('id')
+        )
+        if not submissions:
+            return []
+
+        users = {submission.user_id: submission.user for submission in submissions}
+        profiles_qs = Profile.objects.filter(user_id__in=users)
+        xp_before = dict(profiles_qs.values_list('user_id', 'xp_cached'))
+
+        update_submissions(submissions, action)
+
+        Profile.objects.xp_invalidate_cache(profiles_qs)
+
+        if action == APPROVE:
+            # New badges depend on everything approved, so they're only checked once per student, with the XP that
+            # badges gated on XP or a Rank are checked against already including these submissions
+            profiles = {profile.user_id: profile for profile in profiles_qs}
+            for user_id, user in users.items():
+                user.profile = profiles[user_id]
+                BadgeAssertion.objects.check_for_new_assertions(user)
+            # and again for the XP of the new badges
+            Profile.objects.xp_invalidate_cache(profiles_qs)
+
+        create_comments(submissions, teacher, comment_text)
+        create_notifications(submissions, teacher, action)
+
+        if action == APPROVE:
+            schedule_available_quests_updates(submissions)
+            xp_after = dict(profiles_qs.values_list('user_id', 'xp_cached'))
+            for user_id, user in users.items():
+                notify_rank_up(user, xp_before.get(user_id, 0), xp_after.get(user_id, 0))
+
+        # bulk_update doesn't send post_save, see awaiting_approval_changed_callback() and invalidate_progress_chart()
+        invalidate_awaiting_approval_counts()
+        cache.delete_many([progress_chart_cache_key(user_id) for user_id in users])
+
+    return submissions
+
+
+def update_submissions(submissions, action):
+    """ The same changes as QuestSubmission.mark_approved() or mark_returned(), saved with one query """
+    now = timezone.now()
+    for submission in submissions:
+        submission.do_not_grant_xp = False
+        if action == APPROVE:
+            submission.is_completed = True
+            submission.is_approved = True
+            submission.time_approved = now
+        else:
+            submission.is_completed = False
+            submission.is_approved = False
+            submission.time_returned = now
+
+    fields = ['is_completed', 'is_approved', 'do_not_grant_xp', 'time_approved' if action == APPROVE else 'time_returned']
+    QuestSubmission.objects.bulk_update(submissions, fields)
+
+
+def create_comments(submissions, teacher, text):
+    """ The same comments as Comment.objects.create_comment(), but the text is only cleaned once """
+    text = clean_html(text)
+    content_type = ContentType.objects.get_for_model(QuestSubmission)
+    comments = Comment.objects.bulk_create([
+        Comment(
+            user=teacher,
+            path=submission.get_absolute_url(),
+            text=text,
+            target_content_type=content_type,
+            target_object_id=submission.id,
+        )
+        for submission in submissions
+    ])
+
+    # add anchor target to Comment path now that the ids are assigned
+    for comment in comments:
+        comment.path += "#comment-" + str(comment.id)
+    Comment.objects.bulk_update(comments, ['path'])
+    return comments
+
+
+def create_notifications(submissions, teacher, action):
+    """
+    Notifies each student, and their teachers if the teacher approving or returning the submissions isn't one of them,
+    the same way ApproveView.get_notification_kwargs() does
+    """
+    verb = "approved" if action == APPROVE else "returned"
+    icon = APPROVE_ICON if action == APPROVE else RETURN_ICON
+    sender_content_type = ContentType.objects.get_for_model(teacher)
+    target_content_type = ContentType.objects.get_for_model(QuestSubmission)
+
+    users = list({submission.user_id: submission.user for submission in submissions}.values())
+    teacher_ids_per_user = CourseStudent.objects.current_courses_values_per_user(users, 'block__current_teacher')
+
+    notifications = []
+    for submission in submissions:
+        recipient_ids = {submission.user_id}
+        teacher_ids = teacher_ids_per_user[submission.user_id] - {None}
+        if teacher.id not in teacher_ids:
+            recipient_ids |= teacher_ids
+        # don't send a notification to yourself/themself
+        recipient_ids.discard(teacher.id)
+
+        fields = Notification.render_text(verb, teacher, target=submission)
+        notifications.extend(
+            Notification(
+                recipient_id=recipient_id,
+                verb=verb,
+                font_icon=icon,
+                sender_content_type=sender_content_type,
+                sender_object_id=teacher.id,
+                target_content_type=target_content_type,
+                target_object_id=submission.id,
+                **fields,
+            )
+            for recipient_id in sorted(recipient_ids)
+        )
+
+    Notification.objects.bulk_create(notifications)
+    # bulk_create doesn't send post_save, see notification_changed_receiver()
+    cache.delete_many([unread_counts_cache_key(notification.recipient_id) for notification in notifications])
+    return notifications
+
+
+def schedule_available_quests_updates(submissions):
+    """ One update of the available quests per student, for the quests that rely on any of their approved submissions,
+    the same as prerequisites.signals.get_reliant_quest_ids() for each submission """
+    quest_ids_per_user = defaultdict(set)
+    for submission in submissions:
+        quest_ids_per_user[submission.user_id].add(submission.quest_id)
+
+    rank_quest_ids = Prereq.objects.get_reliant_parent_ids_for_model(Rank, Quest)
+    for user_id, completed_quest_ids in quest_ids_per_user.items():
+        campaign_ids = {submission.quest.campaign_id for submission in submissions if submission.user_id == user_id}
+        quest_ids = Prereq.objects.get_reliant_parent_ids(Quest, completed_quest_ids, Quest)
+        quest_ids |= Prereq.objects.get_reliant_parent_ids(Category, campaign_ids, Quest)
+        schedule_user_update(user_id, sorted(quest_ids | rank_quest_ids))
@@ -1,12 +1,13 @@
 import uuid
-import json
 import datetime
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db import models
-from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Max, Q, Sum
+from django.db.models import Count, DateTimeField, Exists, ExpressionWrapper, F, Max, OuterRef, Q, Sum
 from django.db.models.functions import Greatest
 from django.urls import reverse
 from django.utils import timezone
@@ -15,7 +16,7 @@ from siteconfig.models import SiteConfig
 
 from badges.models import BadgeAssertion
 from comments.models import Comment
-from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin, PrereqAllConditionsMet
+from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin, PrereqAllConditionsMet, PrereqEvaluationContext
 from tags.models import TagsModelMixin
 
 
@@ -58,24 +59,63 @@ class Category(IsAPrereqMixin, models.Model):
         Repeating quests are only counted once."""
         return self.current_quests().aggregate(Sum('xp'))['xp__sum']
 
-    def condition_met_as_prerequisite(self, user, num_required=1):
+    def condition_met_as_prerequisite(self, user, num_required=1, context=None):
         """
         The prerequisite is met if all quests in the campaign have been completed by the user
         param num_required: not used.
         """
+        context = context or PrereqEvaluationContext(user)
 
         # get all the active quests in this campaign/category
         # active = not expired, past availability date and time, not archived, visible to students (not draft)
-        quests = self.quest_set.get_active()
+        quest_ids = set(self.quest_set.get_active().values_list('id', flat=True))
 
-        # get all approved submissions of these quests for this user
-        submissions = QuestSubmission.objects.all_approved(user=user, active_semester_only=False).filter(quest__in=quests)
+        # quests with at least one approved submission, so repeatable quests are only counted once.
+        # Archived and draft quests aren't included, but they aren't active anyway.
+        approved_quest_ids = set(context.approved_count_per_quest())
 
-        # remove duplicates with distinct so only one submission per quest is counted
-        # (there could be more than one submission if there are repeatable quests in the campaign)
-        submissions = submissions.order_by('quest_id').distinct('quest')
+        return quest_ids <= approved_quest_ids
 
-        return quests.count() == submissions.count()
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        requirements = list(requirements)
+        campaign_ids = [campaign.pk for campaign, _ in requirements]
+
+        quest_ids_by_campaign = defaultdict(set)
+        for campaign_id, quest_id in Quest.objects.get_active().filter(campaign_id__in=campaign_ids).values_list('campaign_id', 'id'):
+            quest_ids_by_campaign[campaign_id].add(quest_id)
+
+        approved_quest_ids = set(context.approved_count_per_quest())
+
+        return {
+            (campaign.pk, num_required) for campaign, num_required in requirements
+            if quest_ids_by_campaign[campaign.pk] <= approved_quest_ids
+        }
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        campaign_ids = [campaign.pk for campaign, _ in requirements]
+
+        quest_ids_by_campaign = defaultdict(set)
+        for campaign_id, quest_id in Quest.objects.get_active().filter(campaign_id__in=campaign_ids).values_list('campaign_id', 'id'):
+            quest_ids_by_campaign[campaign_id].add(quest_id)
+
+        quest_ids = set().union(*quest_ids_by_campaign.values())
+        approved_quest_ids = defaultdict(set)
+        for user_id, quest_id in QuestSubmission.objects.approved_count_per_user_quest(users, quest_ids):
+            approved_quest_ids[user_id].add(quest_id)
+
+        return {
+            user.id: {
+                (campaign.pk, num_required) for campaign, num_required in requirements
+                if quest_ids_by_campaign[campaign.pk] <= approved_quest_ids[user.id]
+            }
+            for user in users
+        }
 
     @staticmethod
     def autocomplete_search_fields():  # for grapelli prereq selection
@@ -224,18 +264,14 @@ class QuestQuerySet(models.QuerySet):
 
     def block_if_needed(self, user=None):
         """ If there are blocking quests or blocking subs in progress, only return blocking quests.
-        Otherwise, return full qs """
-        blocking_quests = self.filter(blocking=True)
+        Otherwise, return full qs.  Both checks are EXISTS subqueries, so this stays a single query. """
+        has_blocking = Q(Exists(self.filter(blocking=True)))
         if user:
             # Check the student's submissions in progress.
             blocking_subs_in_progress = QuestSubmission.objects.all_not_completed(user=user, blocking=False).filter(quest__blocking=True)  # noqa
-        else:
-            blocking_subs_in_progress = False
+            has_blocking |= Q(Exists(blocking_subs_in_progress))
 
-        if blocking_quests or blocking_subs_in_progress:
-            return blocking_quests
-        else:
-            return self
+        return self.filter(Q(blocking=True) | ~has_blocking)
 
     def datetime_available(self):
         now_local = timezone.now().astimezone(timezone.get_default_timezone())
@@ -269,6 +305,11 @@ class QuestQuerySet(models.QuerySet):
     def visible(self):
         return self.filter(visible_to_students=True)
 
+    def annotate_expired(self):
+        """ Adds is_expired to each quest, so Quest.expired() doesn't need a query for each of them """
+        not_expired = Quest.objects.filter(id=OuterRef('id')).not_expired()
+        return self.annotate(is_expired=~Exists(not_expired))
+
     def active_or_no_campaign(self):
         """With self as an argument, returns a filtered queryset
         containing only quests in active campaigns or quests without campaigns.
@@ -290,8 +331,7 @@ class QuestQuerySet(models.QuerySet):
         :param user:
         :return: A queryset of the prerequisite's that have been met so far
         """
-        pk_met_list = self.get_pk_met_list(user) or [0]
-        return self.filter(pk__in=pk_met_list)
+        return self.filter(pk__in=self.get_pk_met_subquery(user))
 
     def not_in_progress_completed_or_cooldown(self, user):
         """filter the queryset to remove quests that are:
@@ -301,77 +341,33 @@ class QuestQuerySet(models.QuerySet):
           4. completed and repeatable and max repeats reached this semester
           5. completed and repeatable and max all time repeats reached (for repeatable_per_semester=False)
 
-          These need to be grouped together, so that we can start with a queryset that removes all inprogress submissions first
-          and don't have to worry about them when considering repeats, which are more complicated.
+          All five are checked in a single subquery: the user's submissions are grouped by quest
+          (see QuestSubmissionManager.stats_per_quest()) and the quests breaking any of the conditions are excluded.
         """
+        stats = QuestSubmission.objects.stats_per_quest(user)
 
-        # Condition 1: remove inprogress submissions
-        # remember qs is a queryset of Quest objects, not QuestSubmission objects.
-        qs = self.not_in_progress(user)
-
-        # This is completed submissions and quests ALL TIME, not just current semester
-        completed_subs_all_time = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
-        completed_quests_all_time = qs.filter(pk__in=completed_subs_all_time.values_list('quest__id', flat=True))
-
-        # This is completed submissions THIS SEMESTER ONLY
-        completed_subs_current = QuestSubmission.objects.all_completed(user=user)
-        completed_quests_current = qs.filter(pk__in=completed_subs_current.values_list('quest__id', flat=True))
-
-        # Condition 2: remove completed submissions that are not repeatable
-        subs_to_exclude_2 = completed_subs_all_time.filter(Q(quest__max_repeats=0) & Q(quest__repeat_per_semester=False))
-        quests_to_exclude = subs_to_exclude_2.values_list('quest__id', flat=True)
-
-        qs = qs.exclude(pk__in=quests_to_exclude)
-
-        # Condition 3: remove completed submissions that are repeatable, but still in cooldown
-
-        # Calculate the cooldown expression based on hours_between_repeats
-        current_time = timezone.now()
+        # Quests in cooldown will have latest_first_time_completed > now - hours_between_repeats
         cooldown_time = ExpressionWrapper(
-            current_time - F('hours_between_repeats') * timezone.timedelta(hours=1),
+            timezone.now() - F('quest__hours_between_repeats') * timezone.timedelta(hours=1),
             output_field=DateTimeField()
         )
-
-        # start with completed subs this semester (already filtered our non-repeatable)
-        # annotate the latest `first_time_completed` for submissions of this quest
-        # so we can use that time to determine if cooldown is complete
-        cooldown_quests = completed_quests_current.annotate(
-            latest_submission_time=Max(
-                'questsubmission__first_time_completed',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # Quests in cooldown will have latest_submission_time > now - hours_between_repeats
-        # (cooldown_time = now - hours_between_repeats)
-        cooldown_quests = cooldown_quests.filter(latest_submission_time__gt=cooldown_time)
-
-        qs = qs.exclude(pk__in=cooldown_quests)
-
-        # CONDITION 4: remove completed and repeatable and max repeats reached this semester
-        max_repeats_this_sem = completed_quests_current.annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
         # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_this_sem = max_repeats_this_sem.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
-
-        qs = qs.exclude(pk__in=max_repeats_this_sem)
-
-        # CONDITION 5: remove completed and repeatable and max all-time repeats reached (for repeatable_per_semester=False)
-        max_repeats_all_time = completed_quests_all_time.filter(repeat_per_semester=False).annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
+        max_repeats_reached = ~Q(quest__max_repeats=-1) & Q(num_submissions__gt=F('quest__max_repeats'))
+
+        quests_to_exclude = stats.filter(
+            # Condition 1: inprogress submissions (of visible and not archived quests)
+            Q(num_in_progress__gt=0)
+            # Condition 2: completed and not repeatable
+            | Q(num_completed__gt=0, quest__max_repeats=0, quest__repeat_per_semester=False)
+            # Condition 3: completed this semester, but still in cooldown
+            | Q(num_completed_current__gt=0, latest_first_time_completed__gt=cooldown_time)
+            # Condition 4: completed this semester and max repeats reached
+            | (Q(num_completed_current__gt=0) & max_repeats_reached)
+            # Condition 5: completed and max all-time repeats reached (for repeatable_per_semester=False)
+            | (Q(num_completed__gt=0, quest__repeat_per_semester=False) & max_repeats_reached)
         )
-        # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_all_time = max_repeats_all_time.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
 
-        qs = qs.exclude(pk__in=max_repeats_all_time)
-
-        return qs
+        return self.exclude(pk__in=quests_to_exclude.values('quest_id'))
 
     def not_in_progress(self, user):
         """
@@ -386,14 +382,16 @@ class QuestQuerySet(models.QuerySet):
         else:
             return self.filter(editor=user.id)
 
-    def get_pk_met_list(self, user):
-        model_name = f'{Quest._meta.app_label}.{Quest._meta.model_name}'
-        pk_met_list = PrereqAllConditionsMet.objects.filter(user=user, model_name=model_name).first()
-        if not pk_met_list:
+    def get_pk_met_subquery(self, user):
+        """
+        :return: a subquery of the ids of quests whose prerequisites have been met by the user, from the
+        PrereqAllConditionsMet cache.  If the user doesn't have a cache yet, it's calculated first.
+        """
+        conditions_met = PrereqAllConditionsMet.objects.get_user_model_name(user, Quest.get_model_name())
+        if not conditions_met.exists():
             from prerequisites.tasks import update_quest_conditions_for_user
-            pk_met_list = update_quest_conditions_for_user(user.id)
-            pk_met_list = PrereqAllConditionsMet.objects.get(id=pk_met_list)
-        return json.loads(pk_met_list.ids)
+            update_quest_conditions_for_user(user.id)
+        return conditions_met.unnest_ids()
 
 
 class QuestManager(models.Manager):
@@ -554,17 +552,41 @@ class Quest(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, XPItem):
         else:
             return False
 
-    def condition_met_as_prerequisite(self, user, num_required=1):
+    def condition_met_as_prerequisite(self, user, num_required=1, context=None):
         """
         Defines how this model's requirements are met as a prerequisite to other models
         :param user:
         :param num_required:
+        :param context: a PrereqEvaluationContext, so the approved submissions of all quests are only counted once
         :return: True if the condition have been met for this object.
         """
-        num_approved = QuestSubmission.objects.all_for_user_quest(user, self, False).approved().count()
-        # print("num_approved: " + str(num_approved) + "/" + str(num_required))
+        context = context or PrereqEvaluationContext(user)
+        num_approved = context.approved_count_per_quest().get(self.pk, 0)
         return num_approved >= num_required
 
+    @classmethod
+    def bulk_condition_met_as_prerequisite(cls, user, requirements, context=None):
+        """ See IsAPrereqMixin.bulk_condition_met_as_prerequisite(), same rules as condition_met_as_prerequisite() """
+        context = context or PrereqEvaluationContext(user)
+        num_approved = context.approved_count_per_quest()
+        return {
+            (quest.pk, num_required) for quest, num_required in requirements
+            if num_approved.get(quest.pk, 0) >= num_required
+        }
+
+    @classmethod
+    def bulk_condition_met_for_users(cls, users, requirements):
+        """ See IsAPrereqMixin.bulk_condition_met_for_users(), same rules as condition_met_as_prerequisite() """
+        requirements = list(requirements)
+        num_approved = QuestSubmission.objects.approved_count_per_user_quest(users, [quest.pk for quest, _ in requirements])
+        return {
+            user.id: {
+                (quest.pk, num_required) for quest, num_required in requirements
+                if num_approved.get((user.id, quest.pk), 0) >= num_required
+            }
+            for user in users
+        }
+
     def is_editable(self, user):
         if user.is_staff:
             return True
@@ -575,6 +597,8 @@ class Quest(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, XPItem):
         """Returns True if the quest has expired, False otherwise.
         See QuestQueryset.expired() for details.
         """
+        if hasattr(self, 'is_expired'):  # see QuestQuerySet.annotate_expired()
+            return self.is_expired
         # utilize existing code in QuestQuerySet method not_expired()
         return not Quest.objects.filter(id=self.id).not_expired().exists()
 
@@ -630,27 +654,22 @@ class QuestSubmissionQuerySet(models.query.QuerySet):
     def for_teacher_only(self, teacher):
         """
         :param teacher: a User model
-        :return: qs filtered for submissions of students in the current teacher's blocks
+        :return: qs filtered for submissions of students in the current teacher's blocks (this semester), or of quests
+        that notify the teacher specifically.  The filter is done in the database, so the qs is not evaluated.
         """
         if teacher is None:
             return self
         else:
-            # Why doesn't this work?!? it only works for some teachers? with or without pk
-            # return self.filter(user__coursestudent__block__current_teacher=teacher).distinct()
-            # pk_sub_list = [
-            #     sub.pk for sub in self
-            #     if teacher.pk in sub.user.profile.teachers() or sub.quest.specific_teacher_to_notify == teacher
-            # ]
-
-            pk_sub_list = [
-                sub.pk for sub in self
-                if (
-                    teacher.pk in sub.user.profile.teachers() or
-                    (sub.quest.specific_teacher_to_notify == teacher if sub.quest else False)  # will error if quest has been deleted
-                )
-            ]
-
-            return self.filter(pk__in=pk_sub_list)
+            from courses.models import CourseStudent  # avoid circular import
+
+            # Exists() instead of joining user__coursestudent, which would duplicate submissions of students in more
+            # than one course and match courses from past semesters
+            in_teachers_block = CourseStudent.objects.filter(
+                user=OuterRef('user'),
+                semester=SiteConfig.get().active_semester,
+                block__current_teacher=teacher,
+            )
+            return self.filter(Q(Exists(in_teachers_block)) | Q(quest__specific_teacher_to_notify=teacher))
 
     def exclude_archived_quests(self):
         return self.exclude(quest__archived=True)
@@ -659,6 +678,15 @@ class QuestSubmissionQuerySet(models.query.QuerySet):
         return self.exclude(quest__visible_to_students=False)
 
 
+AWAITING_APPROVAL_VERSION_KEY = 'awaiting-approval-version'
+AWAITING_APPROVAL_COUNT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def invalidate_awaiting_approval_counts():
+    """ Changes the version of all the teachers' cached counts, see QuestSubmissionManager.awaiting_approval_count() """
+    cache.set(AWAITING_APPROVAL_VERSION_KEY, uuid.uuid4().hex, None)
+
+
 class QuestSubmissionManager(models.Manager):
     def get_queryset(self,
                      active_semester_only=False,
@@ -751,6 +779,20 @@ class QuestSubmissionManager(models.Manager):
             return qs
         return self.get_queryset(True).get_user(user).not_approved().completed()
 
+    def awaiting_approval_count(self, teacher):
+        """
+        The number shown in the navbar's approvals badge, which is polled by every open page of every teacher.
+        Any change to a submission (or to which students a teacher has) could change the count of several teachers,
+        so instead of keeping each teacher's count up to date, the counts are cached under a version that is changed
+        whenever that happens, see invalidate_awaiting_approval_counts().
+        """
+        version = cache.get_or_set(AWAITING_APPROVAL_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+        return cache.get_or_set(
+            f'awaiting-approval-count-{version}-{teacher.id}',
+            lambda: self.all_awaiting_approval(teacher=teacher).order_by().count(),
+            AWAITING_APPROVAL_COUNT_CACHE_TIMEOUT,
+        )
+
     def all_returned(self, user=None):
         # completion date indicates the quest was submitted, but since completed
         # is false, it must have been returned.
@@ -766,6 +808,41 @@ class QuestSubmissionManager(models.Manager):
     def all_for_user_quest(self, user, quest, active_semester_only):
         return self.get_queryset(active_semester_only).get_user(user).get_quest(quest)
 
+    def stats_per_quest(self, user):
+        """
+        :return: a values queryset with one row per quest the user has submissions for (in any semester), annotated with
+        the submission counts needed to know if the quest is available to them, see QuestQuerySet.not_in_progress_completed_or_cooldown()
+        """
+        active_semester_id = SiteConfig.get().active_semester_id
+        qs = self.get_queryset(exclude_archived_quests=False, exclude_quests_not_visible_to_students=False, include_related=False)
+        qs = qs.get_user(user).order_by()
+        return qs.values(
+            'quest_id', 'quest__max_repeats', 'quest__repeat_per_semester', 'quest__hours_between_repeats'
+        ).annotate(
+            num_submissions=Count('id'),
+            num_in_progress=Count('id', filter=Q(is_completed=False, quest__archived=False, quest__visible_to_students=True)),
+            num_completed=Count('id', filter=Q(is_completed=True)),
+            num_completed_current=Count('id', filter=Q(is_completed=True, semester_id=active_semester_id)),
+            latest_first_time_completed=Max('first_time_completed'),
+        )
+
+    def approved_count_per_quest(self, user):
+        """
+        :return: a dict of {quest_id: number of approved submissions} for the user, for all semesters.  Counted the
+        same way as all_for_user_quest(user, quest, False).approved().count(), but for every quest in one query.
+        """
+        qs = self.get_queryset(include_related=False).get_user(user).approved().order_by()
+        return dict(qs.values('quest_id').annotate(num_approved=Count('id')).values_list('quest_id', 'num_approved'))
+
+    def approved_count_per_user_quest(self, users, quest_ids):
+        """
+        :return: a dict of {(user_id, quest_id): number of approved submissions} for the users and quests, for all semesters.
+        The same as approved_count_per_quest(), but for many users in one query.
+        """
+        qs = self.get_queryset(include_related=False).filter(user__in=users, quest_id__in=quest_ids).approved().order_by()
+        qs = qs.values('user_id', 'quest_id').annotate(num_approved=Count('id'))
+        return {(user_id, quest_id): num_approved for user_id, quest_id, num_approved in qs.values_list('user_id', 'quest_id', 'num_approved')}
+
     def num_submissions(self, user, quest):
         qs = self.all_for_user_quest(user, quest, False)
         if qs.exists():
@@ -818,20 +895,22 @@ class QuestSubmissionManager(models.Manager):
         new_submission.save()
         return new_submission
 
-    def calculate_xp(self, user):
+    def calculate_xp(self, user, quest=None):
         """
         Return the number of XP earned by a student for all xp-granting quests that they have completed so far.
+        If quest is provided, only the XP earned from that quest.
         """
-        return self.calculate_xp_to_date(user=user, date=None)
+        return self.calculate_xp_to_date(user=user, date=None, quest=quest)
 
-    def calculate_xp_to_date(self, user, date):
+    def calculate_xp_to_date(self, user, date, quest=None):
         """
         Return the number of XP earned by a student for all xp-granting quests that they have completed, up to and including the specified date.
+        If quest is provided, only the XP earned from that quest.
         """
         total_xp = 0
 
         # Get all of the user's XP granting submissions for the active semester
-        submissions_qs = self.all_approved(user, up_to_date=date).grant_xp()
+        submissions_qs = self.all_approved(user, quest=quest, up_to_date=date).grant_xp()
         # print("\nSubmission_qs: ", submissions_qs)
 
         # annotate with xp_earned, since xp could come from xp_requested on the submission, or from the quest's xp value
@@ -851,6 +930,26 @@ class QuestSubmissionManager(models.Manager):
 
         return total_xp
 
+    def calculate_xp_per_user(self, users):
+        """
+        The same as calculate_xp(), but for many users at once with a single grouped query.
+        :param users: a queryset or list of users
+        :return: a dict of {user_id: xp} for the users that have earned XP from quests this semester
+        """
+        submissions_qs = self.all_approved().grant_xp().filter(user__in=users)
+        submissions_qs = submissions_qs.annotate(xp_earned=Greatest('quest__xp', 'xp_requested'))
+        submission_xps = submissions_qs.order_by().values('user_id', 'quest_id', 'quest__max_xp').annotate(xp_sum=Sum('xp_earned'))
+
+        # one row per user and quest, so the max_xp of each quest can be applied before summing
+        submission_xps = submission_xps.values_list('user_id', 'quest_id', 'quest__max_xp', 'xp_sum')
+        xp_per_user = defaultdict(int)
+        for user_id, _, max_xp, xp_sum in submission_xps:
+            if max_xp == -1:  # no limit
+                xp_per_user[user_id] += xp_sum
+            else:
+                xp_per_user[user_id] += min(xp_sum, max_xp or 0)
+        return dict(xp_per_user)
+
     def remove_in_progress(self):
         # In Progress Quests
         qs = self.all_not_completed(active_semester_only=False)
@@ -930,23 +1029,32 @@ class QuestSubmission(models.Model):
         self.xp_requested = xp_requested
         self.save()
 
+    def save_and_update_xp(self):
+        """
+        Saves the submission and adds the change in XP earned from its quest to the user's xp_cached.
+        Only this quest's submissions are summed (with its max_xp applied) before and after saving, so the
+        user's whole history doesn't need to be recalculated.
+        """
+        xp_before = QuestSubmission.objects.calculate_xp(self.user, quest=self.quest)
+        self.save()
+        xp_after = QuestSubmission.objects.calculate_xp(self.user, quest=self.quest)
+        self.user.profile.xp_add(xp_after - xp_before)
+
     def mark_approved(self, transfer=False):
         self.is_completed = True  # might have been false if returned
         self.is_approved = True
         self.time_approved = timezone.now()
         self.do_not_grant_xp = transfer
-        self.save()
+        self.save_and_update_xp()
         # update badges
         BadgeAssertion.objects.check_for_new_assertions(self.user, transfer=transfer)
-        self.user.profile.xp_invalidate_cache()  # recalculate XP
 
     def mark_returned(self):
         self.is_completed = False
         self.is_approved = False
         self.do_not_grant_xp = False
         self.time_returned = timezone.now()
-        self.save()
-        self.user.profile.xp_invalidate_cache()  # recalculate XP
+        self.save_and_update_xp()
 
     def is_awaiting_approval(self):
         return self.is_completed and not self.is_approved
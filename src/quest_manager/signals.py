@@ -1,10 +1,10 @@
 from bs4 import BeautifulSoup
 from bs4.formatter import HTMLFormatter
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import pre_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_save, pre_delete
 from django.dispatch import receiver
 
-from quest_manager.models import Quest, QuestSubmission
+from quest_manager.models import Quest, QuestSubmission, invalidate_awaiting_approval_counts
 from comments.models import Comment
 
 
@@ -25,6 +25,22 @@ def submission_pre_delete_callback(sender, instance, **kwargs):
     ).delete()
 
 
+@receiver(post_save, sender=QuestSubmission)
+@receiver(post_delete, sender=QuestSubmission)
+@receiver(post_save, sender='courses.CourseStudent')
+@receiver(post_delete, sender='courses.CourseStudent')
+@receiver(post_save, sender='courses.Block')
+@receiver(post_delete, sender='courses.Block')
+@receiver(post_save, sender=Quest)
+@receiver(post_delete, sender=Quest)
+@receiver(post_save, sender='siteconfig.SiteConfig')
+@receiver(post_save, sender='courses.Semester')
+def awaiting_approval_changed_callback(sender, **kwargs):
+    """ Submissions were completed, approved or returned, students moved between teachers, quests were archived, hidden
+    or given another teacher to notify, or the active semester changed """
+    invalidate_awaiting_approval_counts()
+
+
 def tidy_html(markup, fix_runaway_newlines=False):
     """Prettify's HTML by adding an indentation of 4, except for specified inline tags.
     """
@@ -0,0 +1,159 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
+from model_bakery import baker
+
+from badges.models import Badge, BadgeAssertion
+from comments.models import Comment
+from notifications.models import Notification
+from prerequisites.models import Prereq
+from quest_manager import approvals
+from quest_manager.models import Quest, QuestSubmission
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class BulkApprovalsTest(TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.teacher = baker.make(User, username='teacher', is_staff=True)
+        self.students = baker.make(User, is_staff=False, _quantity=2)
+        self.quest = baker.make(Quest, xp=10)
+        self.submissions = [
+            self.make_submission(student) for student in self.students for _ in range(2)
+        ]
+
+    def make_submission(self, student, **kwargs):
+        kwargs.setdefault('is_completed', True)
+        return baker.make(
+            QuestSubmission, user=student, quest=self.quest, semester=self.sem, time_completed=timezone.now(), **kwargs
+        )
+
+    def ids(self, submissions):
+        return [submission.id for submission in submissions]
+
+    def test_bulk_approve(self):
+        submissions = approvals.bulk_approve(self.ids(self.submissions), self.teacher, comment_text='<p>Nice</p>')
+
+        self.assertEqual(self.ids(submissions), self.ids(self.submissions))
+        for submission in self.submissions:
+            submission.refresh_from_db()
+            self.assertTrue(submission.is_approved)
+            self.assertIsNotNone(submission.time_approved)
+
+        # one comment and notification for each submission
+        comments = Comment.objects.filter(target_object_id__in=self.ids(self.submissions))
+        self.assertEqual(comments.count(), 4)
+        for comment in comments:
+            self.assertIn('Nice', comment.text)
+            self.assertTrue(comment.path.endswith(f'#comment-{comment.id}'))
+
+        notifications = Notification.objects.filter(verb='approved')
+        self.assertEqual(notifications.count(), 4)
+        self.assertCountEqual({notification.recipient for notification in notifications}, self.students)
+
+    def test_bulk_approve__xp_and_badges_once_per_student(self):
+        badge = baker.make(Badge, xp=5)
+        Prereq.add_simple_prereq(badge, self.quest)
+
+        with patch('quest_manager.approvals.BadgeAssertion.objects.check_for_new_assertions',
+                   wraps=BadgeAssertion.objects.check_for_new_assertions) as check_badges:
+            approvals.bulk_approve(self.ids(self.submissions), self.teacher)
+
+        self.assertEqual(check_badges.call_count, 2)
+        for student in self.students:
+            self.assertEqual(BadgeAssertion.objects.filter(user=student, badge=badge).count(), 1)
+            student.profile.refresh_from_db()
+            self.assertEqual(student.profile.xp_cached, student.profile.xp_invalidate_cache())
+
+    def test_bulk_approve__badge_gated_on_rank(self):
+        """ The students' XP includes the approved submissions before their badges are checked """
+        rank = baker.make('courses.Rank', xp=10)
+        badge = baker.make(Badge, xp=5)
+        Prereq.add_simple_prereq(badge, rank)
+
+        approvals.bulk_approve(self.ids(self.submissions), self.teacher)
+
+        for student in self.students:
+            self.assertTrue(BadgeAssertion.objects.filter(user=student, badge=badge).exists())
+            student.profile.refresh_from_db()
+            self.assertEqual(student.profile.xp_cached, student.profile.xp_invalidate_cache())
+
+    def test_bulk_approve__one_available_quests_update_per_student(self):
+        with patch('quest_manager.approvals.schedule_user_update') as schedule_user_update:
+            approvals.bulk_approve(self.ids(self.submissions), self.teacher)
+
+        self.assertCountEqual([call.args[0] for call in schedule_user_update.call_args_list], self.ids(self.students))
+
+    def test_bulk_return(self):
+        approvals.bulk_return(self.ids(self.submissions), self.teacher)
+
+        for submission in self.submissions:
+            submission.refresh_from_db()
+            self.assertFalse(submission.is_completed)
+            self.assertFalse(submission.is_approved)
+            self.assertIsNotNone(submission.time_returned)
+
+        config = SiteConfig.get()
+        comment = Comment.objects.filter(target_object_id=self.submissions[0].id).get()
+        self.assertIn(config.blank_return_text, comment.text)
+        self.assertEqual(Notification.objects.filter(verb='returned').count(), 4)
+
+    def test_only_submissions_awaiting_approval(self):
+        in_progress = self.make_submission(self.students[0], is_completed=False)
+        approved = self.make_submission(self.students[0], is_approved=True)
+
+        submissions = approvals.bulk_approve(self.ids([in_progress, approved, self.submissions[0]]), self.teacher)
+
+        self.assertEqual(self.ids(submissions), [self.submissions[0].id])
+        in_progress.refresh_from_db()
+        self.assertFalse(in_progress.is_approved)
+        self.assertFalse(Comment.objects.filter(target_object_id__in=self.ids([in_progress, approved])).exists())
+
+    def test_unknown_action(self):
+        with self.assertRaises(ValueError):
+            approvals.bulk_mark_submissions(self.ids(self.submissions), self.teacher, 'skip')
+
+
+class BulkApproveViewTest(TenantTestCase):
+
+    def setUp(self):
+        self.client = TenantClient(self.tenant)
+        self.teacher = User.objects.create_user('test_teacher', password="password", is_staff=True)
+        self.student = User.objects.create_user('test_student', password="password")
+        self.submission = baker.make(
+            QuestSubmission, user=self.student, quest=baker.make(Quest), semester=SiteConfig.get().active_semester,
+            is_completed=True, time_completed=timezone.now(),
+        )
+
+    def test_staff_only(self):
+        self.client.force_login(self.student)
+        response = self.client.post(reverse('quests:bulk_approve'), {'action': 'approve', 'submission_ids': [self.submission.id]})
+        self.assertEqual(response.status_code, 403)
+
+    def test_post_only(self):
+        self.client.force_login(self.teacher)
+        self.assertEqual(self.client.get(reverse('quests:bulk_approve')).status_code, 404)
+
+    def test_bad_request(self):
+        self.client.force_login(self.teacher)
+        url = reverse('quests:bulk_approve')
+        self.assertEqual(self.client.post(url, {'action': 'skip', 'submission_ids': [self.submission.id]}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'action': 'approve', 'submission_ids': ['x']}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'action': 'approve'}).status_code, 400)
+
+    def test_approve(self):
+        self.client.force_login(self.teacher)
+        response = self.client.post(
+            reverse('quests:bulk_approve'), {'action': 'approve', 'submission_ids': [self.submission.id, 0]}
+        )
+
+        self.assertEqual(response.json(), {'submission_ids': [self.submission.id]})
+        self.submission.refresh_from_db()
+        self.assertTrue(self.submission.is_approved)
@@ -1,13 +1,19 @@
 from datetime import datetime, timedelta, timezone
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Max, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as djtimezone
 from django.utils.timezone import localtime
 # from django.test import tag
 from freezegun import freeze_time
 from model_bakery import baker
 
 from courses.models import Semester
-from quest_manager.models import Quest, QuestSubmission
+from prerequisites import scheduler
+from quest_manager.models import AWAITING_APPROVAL_VERSION_KEY, Quest, QuestSubmission
 from siteconfig.models import SiteConfig
 from django_tenants.test.cases import TenantTestCase
 from unittest.mock import patch
@@ -464,7 +470,7 @@ class QuestManagerTest(TenantTestCase):
                     ordered=False
                 )
 
-    @patch('prerequisites.signals.update_conditions_for_quest.apply_async')
+    @patch('prerequisites.tasks.update_conditions_for_quest.apply_async')
     def test_get_available__student_outside_course(self, mock_task):
         """
         Test that newly created quests are available for students outside the course
@@ -481,6 +487,8 @@ class QuestManagerTest(TenantTestCase):
 
         # And then create a new quest
         new_quest = baker.make(Quest, name="Quest, anew!", available_outside_course=True)
+        # the update is only started once the transaction is committed, which never happens in a TestCase
+        scheduler.flush(connection.schema_name)
 
         self.assertTrue(new_quest.available_outside_course)
         self.assertTrue(mock_task.called)
@@ -633,6 +641,25 @@ class QuestSubmissionQuerysetTest(TenantTestCase):
         qs = QuestSubmission.objects.all()
         self.assertQuerysetEqual(qs.for_teacher_only(self.teacher), [self.sub, sub2], ordered=False)
 
+    def test_for_teacher_only__single_query(self):
+        """ Past semesters don't count, students in several of the teacher's blocks aren't duplicated,
+        and the submissions are filtered in the database """
+        active_semester = SiteConfig.get().active_semester
+        past_semester = baker.make(Semester)
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        other_block = baker.make('courses.Block', current_teacher=self.teacher)
+        baker.make('courses.CourseStudent', user=self.student, block=block, semester=active_semester)
+        baker.make('courses.CourseStudent', user=self.student, block=other_block, semester=active_semester)
+        past_student = baker.make(User)
+        baker.make('courses.CourseStudent', user=past_student, block=block, semester=past_semester)
+
+        sub = baker.make(QuestSubmission, user=self.student, semester=active_semester)
+        baker.make(QuestSubmission, user=past_student, semester=active_semester)
+
+        qs = QuestSubmission.objects.all().for_teacher_only(self.teacher)
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(qs, [sub])
+
     def test_for_teachers_only__with_deleted_quest(self):
         """for_teachers_only QuestSubmissions should be deleted for that quest if it is deleted"""
 
@@ -686,6 +713,65 @@ class QuestSubmissionManagerTest(TenantTestCase):
         qs = QuestSubmission.objects.all_for_user_quest(self.student, quest, True)
         self.assertQuerysetEqual(qs, [first])
 
+    def test_awaiting_approval_count(self):
+        """ The count is cached until a submission changes """
+        quest = self.sub1.quest
+        quest.specific_teacher_to_notify = self.teacher
+        quest.save()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 0)
+
+        self.sub1.mark_completed()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 1)
+        with self.assertNumQueries(0):
+            QuestSubmission.objects.awaiting_approval_count(self.teacher)
+
+        self.sub1.mark_approved()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 0)
+
+    def test_awaiting_approval_count__quest_changed(self):
+        """ The count is recalculated when a quest is archived, hidden, or notifies another teacher """
+        quest = self.sub1.quest
+        quest.specific_teacher_to_notify = self.teacher
+        quest.save()
+        self.sub1.mark_completed()
+
+        for field, value in [('archived', True), ('visible_to_students', False), ('specific_teacher_to_notify', baker.make(User))]:
+            with self.subTest(field=field):
+                quest.archived, quest.visible_to_students, quest.specific_teacher_to_notify = False, True, self.teacher
+                quest.save()
+                self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 1)
+
+                setattr(quest, field, value)
+                quest.save()
+                self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 0)
+
+    def test_awaiting_approval_count__quest_deleted(self):
+        quest = self.sub1.quest
+        quest.specific_teacher_to_notify = self.teacher
+        quest.save()
+        self.sub1.mark_completed()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 1)
+
+        quest.delete()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 0)
+
+    def test_awaiting_approval_count__block_deleted(self):
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        version = cache.get(AWAITING_APPROVAL_VERSION_KEY)
+
+        block.delete()
+        self.assertNotEqual(cache.get(AWAITING_APPROVAL_VERSION_KEY), version)
+
+    def test_awaiting_approval_count__active_semester_changed(self):
+        quest = self.sub1.quest
+        quest.specific_teacher_to_notify = self.teacher
+        quest.save()
+        self.sub1.mark_completed()
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 1)
+
+        SiteConfig.get().set_active_semester(self.sub2.semester_id)
+        self.assertEqual(QuestSubmission.objects.awaiting_approval_count(self.teacher), 0)
+
     def make_test_submissions_stack(self):
         """Generate 7 submissions, 3 from one semester and 4 from a different semester, each with different settings
 
@@ -819,3 +905,129 @@ class QuestSubmissionManagerTest(TenantTestCase):
         # now delete the custom_xp quest (submission is still there though!) Shouldn't break!
         quest_5xp_custom.delete()
         self.assertEqual(QuestSubmission.objects.calculate_xp(self.student), 10)
+
+
+def legacy_not_in_progress_completed_or_cooldown(qs, user):
+    """ The previous implementation of QuestQuerySet.not_in_progress_completed_or_cooldown(), with one subquery per
+    condition, kept as a reference for the regression tests below. """
+    in_progress_subs = QuestSubmission.objects.all_not_completed(user=user, active_semester_only=False)
+    qs = qs.exclude(pk__in=in_progress_subs.values_list('quest__id', flat=True))
+
+    completed_subs_all_time = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
+    completed_quests_all_time = qs.filter(pk__in=completed_subs_all_time.values_list('quest__id', flat=True))
+    completed_subs_current = QuestSubmission.objects.all_completed(user=user)
+    completed_quests_current = qs.filter(pk__in=completed_subs_current.values_list('quest__id', flat=True))
+
+    subs_to_exclude_2 = completed_subs_all_time.filter(Q(quest__max_repeats=0) & Q(quest__repeat_per_semester=False))
+    qs = qs.exclude(pk__in=subs_to_exclude_2.values_list('quest__id', flat=True))
+
+    cooldown_time = ExpressionWrapper(
+        djtimezone.now() - F('hours_between_repeats') * timedelta(hours=1), output_field=DateTimeField()
+    )
+    cooldown_quests = completed_quests_current.annotate(
+        latest_submission_time=Max('questsubmission__first_time_completed', filter=Q(questsubmission__user_id=user.id))
+    ).filter(latest_submission_time__gt=cooldown_time)
+    qs = qs.exclude(pk__in=cooldown_quests)
+
+    max_repeats_this_sem = completed_quests_current.annotate(
+        submission_count=Count('questsubmission', filter=Q(questsubmission__user_id=user.id))
+    ).filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
+    qs = qs.exclude(pk__in=max_repeats_this_sem)
+
+    max_repeats_all_time = completed_quests_all_time.filter(repeat_per_semester=False).annotate(
+        submission_count=Count('questsubmission', filter=Q(questsubmission__user_id=user.id))
+    ).filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
+    return qs.exclude(pk__in=max_repeats_all_time)
+
+
+def legacy_get_available(user):
+    """ The previous implementation of QuestManager.get_available() """
+    qs = Quest.objects.get_active().get_conditions_met(user)
+    qs = legacy_not_in_progress_completed_or_cooldown(qs, user)
+
+    blocking_quests = qs.filter(blocking=True)
+    blocking_subs_in_progress = QuestSubmission.objects.all_not_completed(user=user).filter(quest__blocking=True)
+    if blocking_quests or blocking_subs_in_progress:
+        qs = blocking_quests
+    return qs.exclude_hidden(user)
+
+
+@freeze_time('2018-10-12 00:54:00', tz_offset=0)
+class GetAvailableRegressionTest(TenantTestCase):
+    """ QuestManager.get_available() is a single query, it should give the same results as the previous implementation
+    for every combination of repeat settings and submission history. """
+
+    def setUp(self):
+        self.student = baker.make(User, username='student', is_staff=False)
+        self.active_semester = SiteConfig.get().active_semester
+        self.previous_semester = baker.make(Semester)
+
+    def make_history(self, quest, history):
+        """ Submissions of the student for the quest """
+        now = localtime()
+        for semester, is_completed, hours_ago in history:
+            baker.make(
+                QuestSubmission, quest=quest, user=self.student, semester=semester, is_completed=is_completed,
+                first_time_completed=now - timedelta(hours=hours_ago) if is_completed else None,
+                time_completed=now - timedelta(hours=hours_ago) if is_completed else None,
+            )
+
+    def make_quests(self):
+        current, previous = self.active_semester, self.previous_semester
+        histories = [
+            [],
+            [(current, False, 0)],  # in progress
+            [(current, True, 1)],  # completed recently
+            [(current, True, 5)],
+            [(current, True, 5), (current, True, 30)],
+            [(previous, True, 100)],  # completed last semester
+            [(previous, True, 100), (current, True, 1)],
+            [(previous, True, 100), (previous, True, 90), (current, False, 0)],
+        ]
+        repeat_settings = [
+            {'max_repeats': max_repeats, 'repeat_per_semester': per_semester, 'hours_between_repeats': hours}
+            for max_repeats in (0, 1, 2, -1) for per_semester in (False, True) for hours in (0, 2, 24)
+        ]
+        for i, repeat in enumerate(repeat_settings):
+            for j, history in enumerate(histories):
+                quest = baker.make(Quest, name=f"Quest-{i}-{j}", **repeat)
+                self.make_history(quest, history)
+
+    def assert_same_as_legacy(self):
+        new = Quest.objects.get_available(self.student)
+        self.assertCountEqual(list(new.values_list('id', flat=True)), list(legacy_get_available(self.student).values_list('id', flat=True)))
+
+    def test_repeats_and_cooldowns(self):
+        self.make_quests()
+        self.assert_same_as_legacy()
+
+        for hours in (2, 25, 200):
+            with freeze_time(localtime() + timedelta(hours=hours)):
+                self.assert_same_as_legacy()
+
+    def test_blocking(self):
+        self.make_quests()
+        blocking_quest = baker.make(Quest, name='Quest-blocking', blocking=True)
+        self.assert_same_as_legacy()
+
+        # blocking quest in progress
+        self.make_history(blocking_quest, [(self.active_semester, False, 0)])
+        self.assert_same_as_legacy()
+
+        # in progress last semester doesn't block
+        QuestSubmission.objects.filter(quest=blocking_quest).update(semester=self.previous_semester)
+        self.assert_same_as_legacy()
+
+    def test_hidden(self):
+        self.make_quests()
+        self.student.profile.hide_quest(Quest.objects.get(name='Quest-0-0').id)
+        self.assert_same_as_legacy()
+
+    def test_single_query(self):
+        self.make_quests()
+        qs = Quest.objects.get_available(self.student)  # calculates the cache of prerequisites met the first time
+
+        qs = Quest.objects.get_available(self.student)
+        with CaptureQueriesContext(connection) as queries:
+            list(qs)
+        self.assertEqual(len(queries), 1)
@@ -571,3 +571,30 @@ class SubmissionTestModel(TenantTestCase):
         # the setup submission should not be completed yet, but make sure
         self.assertFalse(self.submission.is_completed, False)
         self.assertIsNone(self.submission.get_minutes_to_complete())
+
+    def test_mark_approved_and_returned__update_xp(self):
+        """ Approving and returning a submission adjusts the user's cached XP by the change in XP from its quest,
+        including the quest's max_xp, and gives the same result as recalculating it from scratch """
+        active_semester = SiteConfig.get().active_semester
+        quest = baker.make(Quest, xp=10, max_xp=25, max_repeats=-1)
+        subs = baker.make(QuestSubmission, user=self.student, quest=quest, semester=active_semester, is_completed=True, _quantity=3)
+
+        subs[0].mark_approved()
+        self.assertEqual(self.student.profile.xp_cached, 10)
+        subs[1].mark_approved()
+        self.assertEqual(self.student.profile.xp_cached, 20)
+        subs[2].mark_approved()
+        self.assertEqual(self.student.profile.xp_cached, 25)  # capped at max_xp
+
+        # approving again doesn't add any more
+        subs[2].mark_approved()
+        self.assertEqual(self.student.profile.xp_cached, 25)
+
+        subs[0].mark_returned()
+        self.assertEqual(self.student.profile.xp_cached, 20)
+
+        # transfers don't grant xp
+        subs[0].mark_approved(transfer=True)
+        self.assertEqual(self.student.profile.xp_cached, 20)
+
+        self.assertEqual(self.student.profile.xp_invalidate_cache(), 20)
@@ -25,6 +25,7 @@ urlpatterns = [
 
     # Ajax
     re_path(r'^ajax/$', views.ajax_submission_count, name='ajax_submission_count'),
+    re_path(r'^ajax/approvals/count/$', views.ajax_approvals_count, name='ajax_approvals_count'),
     re_path(r'^ajax_flag/$', views.ajax_flag, name='ajax_flag'),
     re_path(r'^ajax_quest_info/(?P<quest_id>[0-9]+)/$', views.ajax_quest_info, name='ajax_quest_info'),
     re_path(r'^ajax_quest_info/$', views.ajax_quest_info, name='ajax_quest_root'),
@@ -49,6 +50,7 @@ urlpatterns = [
 
     # Approvals
     re_path(r'^approvals/$', views.approvals, name='approvals'),
+    re_path(r'^approvals/bulk/$', views.bulk_approve, name='bulk_approve'),
     re_path(r'^approvals/submitted/$', views.approvals, name='submitted'),
     re_path(r'^approvals/submitted/all/$', views.approvals, name='submitted_all'),
     re_path(r'^approvals/returned/$', views.approvals, name='returned'),
@@ -18,6 +18,7 @@ from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.views.generic import DetailView, View
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
+from django.views.decorators.http import condition
 
 from hackerspace_online.decorators import staff_member_required, xml_http_request_required
 
@@ -32,6 +33,7 @@ from siteconfig.models import SiteConfig
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 from djcytoscape.views import UpdateMapMessageMixin
 
+from .approvals import APPROVE, RETURN, bulk_mark_submissions
 from .forms import (
     QuestForm,
     SubmissionForm,
@@ -934,6 +936,33 @@ class ApproveView(NonPublicOnlyViewMixin, View):
         return self.form_invalid()
 
 
+@non_public_only_view
+@staff_member_required
+def bulk_approve(request):
+    """ Approves or returns all the submissions in POST["submission_ids"] at once, depending on POST["action"]
+    ("approve" or "return"), with an optional POST["comment_text"] added to each of them. See quest_manager.approvals
+    Returns the ids of the submissions that were awaiting approval, which are the only ones changed.
+    """
+    if request.method != "POST":
+        raise Http404
+
+    action = request.POST.get("action")
+    try:
+        submission_ids = [int(submission_id) for submission_id in request.POST.getlist("submission_ids")]
+    except ValueError:
+        return JsonResponse({'error': 'Bad Request'}, status=400)
+    if action not in (APPROVE, RETURN) or not submission_ids:
+        return JsonResponse({'error': 'Bad Request'}, status=400)
+
+    submissions = bulk_mark_submissions(
+        submission_ids, request.user, action, comment_text=request.POST.get("comment_text")
+    )
+
+    verb = "approved" if action == APPROVE else "returned"
+    messages.success(request, f"{len(submissions)} of {len(submission_ids)} submissions {verb}")
+    return JsonResponse(data={"submission_ids": [submission.id for submission in submissions]})
+
+
 def paginate(object_list, page, per_page=30):
     paginator = Paginator(object_list, per_page)
     try:
@@ -1531,6 +1560,16 @@ def ajax_submission_count(request):
         raise Http404
 
 
+@xml_http_request_required
+@non_public_only_view
+@staff_member_required
+@condition(etag_func=lambda request: f"{request.user.id}-{QuestSubmission.objects.awaiting_approval_count(request.user)}")
+def ajax_approvals_count(request):
+    """ The same count as ajax_submission_count(), but cached, and with a 304 Not Modified response if it hasn't
+    changed since the page's last request (using the ETag) since it's polled by every open page """
+    return JsonResponse(data={"count": QuestSubmission.objects.awaiting_approval_count(request.user)})
+
+
 ########################
 #
 # FLAGGED SUBMISSIONS
@@ -1,11 +1,16 @@
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
 from copy import copy
 from allauth.socialaccount.models import SocialApp
 from allauth.socialaccount.providers.google.provider import GoogleProvider
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core.cache import cache
+from django.core.signals import request_finished, request_started
 from django.core.exceptions import MultipleObjectsReturned
-from django.db import connection, models
+from django.db import connection, models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
@@ -351,23 +356,86 @@ class SiteConfig(models.Model):
     def cache_key(cls):
         return f'{connection.schema_name}-siteconfig'
 
+    @classmethod
+    def cache_version_key(cls):
+        return f'{connection.schema_name}-siteconfig-version'
+
     @classmethod
     def get(cls):
         """
         Used to access the single model instance for the current tenant/schema
         The SiteConfig object is create automatically via signal after new tenants are created.
+
+        It's called many times during each request, so on top of the shared cache each process keeps the tenants'
+        SiteConfig objects, which are used for as long as the tenant's version in the shared cache doesn't change
+        (see invalidate_cache()).  The version is only checked once per request.
+        They're kept pickled, like in the shared cache, and each call unpickles a new copy (with its own active_semester
+        and deck_ai), so changes to it that aren't saved don't leak to other callers.
         """
 
-        if connection.schema_name != get_public_schema_name():
-            siteconfig = cache.get(cls.cache_key())
+        schema_name = connection.schema_name
+        if schema_name == get_public_schema_name():
+            return None
+
+        checked = getattr(_request_local, 'checked_schemas', None)
+        entry = _local_cache.get(schema_name)
+        if entry is not None and checked is not None and schema_name in checked:
+            return pickle.loads(entry[1])
 
+        version = cache.get(cls.cache_version_key())
+        if entry is None or version is None or entry[0] != version:
+            if version is None:
+                cache.add(cls.cache_version_key(), uuid.uuid4().hex, None)
+                version = cache.get(cls.cache_version_key())
+
+            siteconfig = cache.get(cls.cache_key())
             if not siteconfig:
                 siteconfig = cls.objects.select_related('deck_ai', 'active_semester').get()
                 cache.set(cls.cache_key(), siteconfig, 3600)
 
-            return siteconfig
+            entry = (version, pickle.dumps(siteconfig))
+            with _local_cache_lock:
+                _local_cache[schema_name] = entry
+                _local_cache.move_to_end(schema_name)
+                while len(_local_cache) > settings.SITECONFIG_LOCAL_CACHE_SIZE:
+                    _local_cache.popitem(last=False)
+
+        if checked is not None:
+            checked.add(schema_name)
+        return pickle.loads(entry[1])
+
+    @classmethod
+    def get_locally_cached(cls):
+        """ The current tenant's SiteConfig in this process's cache, if any, without checking its version """
+        entry = _local_cache.get(connection.schema_name)
+        return pickle.loads(entry[1]) if entry else None
+
+    @classmethod
+    def invalidate_cache(cls):
+        """ Removes the current tenant's SiteConfig from the shared cache, and from the cache of every process by
+        changing its version """
+        cache.delete(cls.cache_key())
+        cache.set(cls.cache_version_key(), uuid.uuid4().hex, None)
+        with _local_cache_lock:
+            _local_cache.pop(connection.schema_name, None)
+
+
+# Each process's cache of the tenants' SiteConfig objects, see SiteConfig.get()
+_local_cache = OrderedDict()  # {schema_name: (version, pickled siteconfig)}, least recently used first
+_local_cache_lock = threading.Lock()
+_request_local = threading.local()
 
-        return None
+
+@receiver(request_started)
+def start_siteconfig_version_checks(**kwargs):
+    """ The version of each tenant's SiteConfig in the local cache only needs to be checked once per request """
+    _request_local.checked_schemas = set()
+
+
+@receiver(request_finished)
+def stop_siteconfig_version_checks(**kwargs):
+    """ Outside of a request (e.g. celery tasks) the version is checked every time """
+    _request_local.checked_schemas = None
 
 
 @receiver(post_save, sender=User)
@@ -376,22 +444,18 @@ class SiteConfig(models.Model):
 def invalidate_siteconfig_cache_signal(sender, instance, **kwargs):
     """
     Whenever a `SiteConfig`, `Semester`, or `User` object is saved, we should invalidate the SiteConfig cache.
+    Invalidated again once committed, in case the old SiteConfig was cached meanwhile under the new version.
     """
 
     try:
-        config = cache.get(SiteConfig.cache_key())
+        config = cache.get(SiteConfig.cache_key()) or SiteConfig.get_locally_cached()
     except redis_exceptions.ConnectionError:
         # create_superuser is being called via manage.py initdb
         # This just prevents it from throwing an error when redis is not running
         # Because we are receiving a post_save from User, we don't want errors to happen
-        config = None
-
-    if not config:
         return
 
-    for obj in (config, config.active_semester, config.deck_ai):
-        # Only invalidate the cache when the instance we updated is the current one set in SiteConfig
-        if instance == obj:
-            cache.delete(SiteConfig.cache_key())
-            break
-    # cache.delete(SiteConfig.cache_key())
+    # Only check the instance against the current ones set in SiteConfig when we know what they are
+    if sender is SiteConfig or not config or instance in (config, config.active_semester, config.deck_ai):
+        SiteConfig.invalidate_cache()
+        transaction.on_commit(SiteConfig.invalidate_cache)
@@ -1,6 +1,8 @@
 from datetime import timedelta
+from unittest.mock import patch
 
 from django.core.cache import cache
+from django.core.signals import request_finished, request_started
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.timezone import localtime
@@ -109,6 +111,82 @@ class SiteConfigModelTest(TenantTestCase):
         with freeze_time(cache_time_expiration, tz_offset=0):
             self.assertIsNone(cache.get(SiteConfig.cache_key()))
 
+    def test_SiteConfig_get__uses_local_cache(self):
+        """ While the version in the shared cache doesn't change, the process's copy is used without reading the shared
+        cache again, and each call gets its own copy """
+        with patch('siteconfig.models.cache.get', wraps=cache.get) as cache_get:
+            config = SiteConfig.get()
+
+        # only the version is read from the shared cache
+        cache_get.assert_called_once_with(SiteConfig.cache_version_key())
+        self.assertEqual(config, self.config)
+        self.assertIsNot(config, self.config)
+
+        config.site_name = 'Not saved'
+        self.assertNotEqual(SiteConfig.get().site_name, 'Not saved')
+
+    def test_SiteConfig_get__related_objects_not_shared(self):
+        """ Unsaved changes to the active semester or deck owner don't leak to other callers either """
+        config = SiteConfig.get()
+        other = SiteConfig.get()
+        self.assertIsNot(config.active_semester, other.active_semester)
+        self.assertIsNot(config.deck_ai, other.deck_ai)
+
+        config.active_semester.closed = not config.active_semester.closed
+        config.deck_ai.first_name = 'Not saved'
+        self.assertNotEqual(SiteConfig.get().active_semester.closed, config.active_semester.closed)
+        self.assertNotEqual(SiteConfig.get().deck_ai.first_name, 'Not saved')
+
+    def test_SiteConfig_get__version_checked_once_per_request(self):
+        request_started.send(sender=self.__class__)
+        try:
+            SiteConfig.get()
+            with patch('siteconfig.models.cache.get', wraps=cache.get) as cache_get:
+                SiteConfig.get()
+            cache_get.assert_not_called()
+        finally:
+            request_finished.send(sender=self.__class__)
+
+    def test_SiteConfig_invalidate_cache__changes_version(self):
+        """ Other processes notice the new version and drop their copy """
+        old_version = cache.get(SiteConfig.cache_version_key())
+
+        # changed without signals, as if saved by another process
+        SiteConfig.objects.filter(pk=self.config.pk).update(site_name='Changed elsewhere')
+        self.assertNotEqual(SiteConfig.get().site_name, 'Changed elsewhere')
+
+        SiteConfig.invalidate_cache()
+
+        self.assertNotEqual(cache.get(SiteConfig.cache_version_key()), old_version)
+        self.assertIsNone(cache.get(SiteConfig.cache_key()))
+        self.assertEqual(SiteConfig.get().site_name, 'Changed elsewhere')
+
+    def test_SiteConfig_get__shared_cache_version_lost(self):
+        """ If the version is evicted from the shared cache, the local copy can't be trusted """
+        SiteConfig.objects.filter(pk=self.config.pk).update(site_name='Changed elsewhere')
+        cache.clear()
+
+        self.assertEqual(SiteConfig.get().site_name, 'Changed elsewhere')
+        self.assertIsNotNone(cache.get(SiteConfig.cache_version_key()))
+
+    def test_invalidate_siteconfig_cache_signal__invalidated_again_on_commit(self):
+        """ A copy of the old SiteConfig cached before the save is committed is dropped once it is """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.config.site_name = 'Saved'
+            self.config.save()
+            self.assertEqual(SiteConfig.get().site_name, 'Saved')
+            # changed without signals before the commit, so the cached copy is now the old one
+            SiteConfig.objects.filter(pk=self.config.pk).update(site_name='Committed')
+
+        self.assertEqual(SiteConfig.get().site_name, 'Committed')
+
+    def test_invalidate_siteconfig_cache_signal__nothing_cached(self):
+        """ Without a cached SiteConfig to compare against, any save of a related object invalidates the cache """
+        cache.clear()
+        with patch('siteconfig.models._local_cache', {}), patch.object(SiteConfig, 'invalidate_cache') as invalidate_cache:
+            baker.make(User)
+        invalidate_cache.assert_called()
+
     def test_deck_owner__correct_default_value(self):
         """
             Test to make sure new decks have the expected deck_owner after initialization, as set in settings.py via .env
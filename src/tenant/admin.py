@@ -24,7 +24,7 @@ from django_tenants.utils import get_public_schema_name, tenant_context
 from bytedeck_summernote.widgets import ByteDeckSummernoteSafeWidget
 from siteconfig.models import SiteConfig
 
-from .models import Tenant, TenantDomain
+from .models import Tenant, TenantDomain, TenantJobRun
 from .forms import TenantBaseForm
 from .utils import generate_schema_name
 from .tasks import send_email_message
@@ -127,7 +127,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
         'last_staff_login', 'google_signon_enabled',
         'paid_until_text', 'trial_end_date_text',
         'max_active_users', 'active_user_count', 'total_user_count',
-        'max_quests', 'quest_count',
+        'max_quests', 'quest_count', 'cached_fields_updated',
     )
     list_filter = ('paid_until', 'trial_end_date', 'active_user_count', 'last_staff_login')
     # DEPRECATED: these fields ("owner_full_name" and "owner_email") will be removed in a future update
@@ -139,7 +139,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
     delete_selected_confirmation_template = 'admin/tenant/tenant/delete_selected_confirmation.html'
     delete_confirmation_template = 'admin/tenant/tenant/delete_confirmation.html'
 
-    actions = ['message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin']
+    actions = ['message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin', 'refresh_cached_fields']
 
     @admin.display(description="owner full name")
     def owner_full_name_text(self, obj):
@@ -157,7 +157,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
         return obj.owner_email_cached
     owner_email_text.admin_order_field = "owner_email_cached"
 
-    @admin.display(description="email verified", boolean=True)
+    @admin.display(description="email verified", boolean=True, ordering="owner_email_verified_cached")
     def owner_email_verified_boolean(self, obj):
         """
         Returns `True` (green), if at least one verified email address was found, otherwise `False`.
@@ -165,14 +165,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
         if obj.schema_name == get_public_schema_name():
             return  # skip public schema
 
-        with tenant_context(obj):
-            owner = SiteConfig.get().deck_owner
-            # get the email address, but only primary and verified
-            for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
-                # make sure it's primary email for real
-                if primary_email_address.email == user_email(owner):
-                    return True
-        return False
+        return obj.owner_email_verified_cached
 
     @admin.display(description="owner email (DEPRECATED)")
     def owner_email_deprecated(self, obj):
@@ -214,17 +207,6 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
             del actions["delete_selected"]
         return actions
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        # Update cached fields
-        #
-        # FIX: reduce number of SQL queries by triggering this only when Tenant (and/or related) objects are changed
-        for tenant in qs:
-            if tenant.name != get_public_schema_name():
-                with tenant_context(tenant):
-                    tenant.update_cached_fields()
-        return qs
-
     def delete_model(self, request, obj):
         # for reference: https://django-tenants.readthedocs.io/en/stable/use.html#deleting-a-tenant
         obj.delete(force_drop=False)  # delete model, but *DO NOT* drop schema
@@ -482,5 +464,40 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
             disabled_count,
         ) % disabled_count, messages.SUCCESS)
 
+    @admin.action(description="Refresh cached fields of tenant(s) now")
+    def refresh_cached_fields(self, request, queryset):
+        """
+        The cached fields are updated by a daily background task (see tenant.tasks.update_cached_fields_in_all_schemas),
+        this updates the selected tenants' right away.
+        """
+        queryset = queryset.exclude(schema_name=get_public_schema_name())
+        for tenant in queryset:
+            with tenant_context(tenant):
+                tenant.update_cached_fields()
+
+        refreshed_count = queryset.count()
+        self.message_user(request, ngettext(
+            "%d tenant's cached fields were refreshed successfully",
+            "%d tenants' cached fields were refreshed successfully",
+            refreshed_count,
+        ) % refreshed_count, messages.SUCCESS)
+
 
 admin.site.register(Tenant, TenantAdmin)
+
+
+class TenantJobRunAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
+    """ The durations and row counts of the nightly jobs on each tenant, see tenant.scheduler """
+    list_display = ('job', 'tenant', 'started', 'duration', 'rows', 'succeeded')
+    list_filter = ('job', 'succeeded')
+    search_fields = ('tenant__schema_name',)
+    date_hierarchy = 'started'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(TenantJobRun, TenantJobRunAdmin)
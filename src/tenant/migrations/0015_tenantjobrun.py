@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0014_auto_20231116_0308'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantJobRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(help_text="The dotted path of the job's function", max_length=255)),
+                ('started', models.DateTimeField()),
+                ('duration', models.FloatField(help_text='In seconds')),
+                ('rows', models.PositiveIntegerField(default=0, help_text='The number returned by the job, e.g. profiles updated or emails sent')),
+                ('succeeded', models.BooleanField(default=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='job_runs', to='tenant.tenant')),
+            ],
+            options={
+                'ordering': ['-started'],
+                'indexes': [models.Index(fields=['job', 'tenant', 'started'], name='tenantjobrun_job_tenant')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0015_tenantjobrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='cached_fields_updated',
+            field=models.DateTimeField(blank=True, editable=False, help_text="When the cached fields were last updated, by the daily background task or the admin's refresh action.", null=True),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='owner_email_verified_cached',
+            field=models.BooleanField(default=False, editable=False, help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."),
+        ),
+    ]
@@ -4,6 +4,7 @@ from datetime import date
 from django.apps import apps
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from django.utils.timezone import timedelta
 from django.contrib.auth import get_user_model
 
@@ -127,6 +128,16 @@ class Tenant(TenantMixin):
         default=False,
         help_text="This is a cached field: Whether Google signon has been enabled for this deck."
     )
+
+    owner_email_verified_cached = models.BooleanField(
+        default=False, editable=False,
+        help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."
+    )
+
+    cached_fields_updated = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        help_text="When the cached fields were last updated, by the daily background task or the admin's refresh action."
+    )
     # END CALCULATED / CACHED FIELDS ##################################
 
     def __str__(self):
@@ -150,6 +161,8 @@ class Tenant(TenantMixin):
         self.quest_count = self.get_quest_count()
         self.last_staff_login = self.get_last_staff_login()
         self.google_signon_enabled = self.get_google_signon_enabled()
+        self.owner_email_verified_cached = self.get_owner_email_verified()
+        self.cached_fields_updated = timezone.now()
         self.save()
 
     def get_owner_full_name_cached(self):
@@ -177,6 +190,20 @@ class Tenant(TenantMixin):
                 email = owner.email
         return email
 
+    def get_owner_email_verified(self):
+        """
+        Returns `True` if the SiteConfig().deck_owner's primary email address has been verified.
+        """
+        SiteConfig = apps.get_model('siteconfig', 'SiteConfig')
+        owner = SiteConfig.get().deck_owner
+
+        # get the email address, but only primary and verified
+        for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
+            # make sure it's primary email for real
+            if primary_email_address.email == user_email(owner):
+                return True
+        return False
+
     def get_google_signon_enabled(self):
         """
         Returns whether Google signon has been enabled for this tenant by accessing the tenant's SiteConfig option
@@ -250,3 +277,23 @@ class Tenant(TenantMixin):
 
 class TenantDomain(DomainMixin):
     pass
+
+
+class TenantJobRun(models.Model):
+    """ How long a nightly job took on one tenant and how many rows it handled, for capacity planning.
+    Also used to balance the tenants between tasks and to resume a run, see tenant.scheduler """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='job_runs')
+    job = models.CharField(max_length=255, help_text="The dotted path of the job's function")
+    started = models.DateTimeField()
+    duration = models.FloatField(help_text="In seconds")
+    rows = models.PositiveIntegerField(default=0, help_text="The number returned by the job, e.g. profiles updated or emails sent")
+    succeeded = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['-started']
+        indexes = [
+            models.Index(fields=['job', 'tenant', 'started'], name='tenantjobrun_job_tenant'),
+        ]
+
+    def __str__(self):
+        return f'{self.job} on {self.tenant.schema_name} at {self.started}'
@@ -0,0 +1,139 @@
+"""
+Runs the nightly jobs that need to run on every tenant (e.g. recalculating XP, or the daily notification emails).
+
+Instead of one task per tenant in a single queue, the tenants are split between TENANT_JOBS_CONCURRENCY tasks that each
+run the job on their tenants one after another, so a large tenant only delays the tenants in its own task.  The tenants
+are balanced between the tasks using how long the job took on each of them last time, which is recorded in
+TenantJobRun along with the number of rows the job handled.  A task that has run for longer than TENANT_JOBS_TIME_BUDGET
+continues with its remaining tenants in a new task, and tenants that already finished the run are skipped, so a task
+that is retried or restarted resumes where it left off.  Runs older than TENANT_JOB_RUNS_RETENTION_DAYS are deleted each
+time the job is started, except each tenant's last successful one.
+
+A job is a function that takes no arguments, runs in the tenant's schema, and returns the number of rows it handled.
+"""
+import heapq
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+
+from .models import TenantJobRun
+
+logger = logging.getLogger(__name__)
+
+
+def split_tenants(job, schema_names, num_shards):
+    """ Splits the tenants between `num_shards` lists with about the same total duration, using each tenant's last
+    duration of the job.  Tenants that haven't run the job yet count as the average tenant.
+
+    Returns:
+        a list of lists of schema names, longest first in each list
+    """
+    last_runs = TenantJobRun.objects.filter(job=job, tenant=OuterRef('pk'), succeeded=True).order_by('-started')
+    durations = dict(
+        get_tenant_model().objects.filter(schema_name__in=schema_names)
+        .annotate(last_duration=Subquery(last_runs.values('duration')[:1]))
+        .values_list('schema_name', 'last_duration')
+    )
+    known = [duration for duration in durations.values() if duration is not None]
+    default = sum(known) / len(known) if known else 1
+    schema_names = sorted(schema_names, key=lambda name: durations.get(name) or default, reverse=True)
+
+    # the longest tenant goes to the shortest shard, see https://en.wikipedia.org/wiki/Longest-processing-time-first_scheduling
+    shards = [(0, i, []) for i in range(min(num_shards, len(schema_names)))]
+    for schema_name in schema_names:
+        total, i, shard = heapq.heappop(shards)
+        shard.append(schema_name)
+        heapq.heappush(shards, (total + (durations.get(schema_name) or default), i, shard))
+    return [shard for _, _, shard in sorted(shards, key=lambda item: item[1])]
+
+
+def run_on_all_schemas(job, concurrency=None):
+    """ Starts the tasks that run the job (the dotted path of its function) on every tenant
+
+    Returns:
+        the number of tasks started
+    """
+    from tenant.tasks import run_job_on_schemas  # avoid circular import
+
+    schema_names = list(
+        get_tenant_model().objects.exclude(schema_name=get_public_schema_name()).values_list('schema_name', flat=True)
+    )
+    shards = split_tenants(job, schema_names, concurrency or settings.TENANT_JOBS_CONCURRENCY)
+    started = timezone.now().isoformat()
+    for shard in shards:
+        run_job_on_schemas.apply_async(args=[job, shard, started], queue=settings.TENANT_JOBS_QUEUE)
+    prune_job_runs(job)
+    return len(shards)
+
+
+def prune_job_runs(job, retention_days=None):
+    """ Deletes the job's runs older than `retention_days`, except each tenant's last successful run, which split_tenants()
+    uses to balance the next run
+
+    Returns:
+        the number of runs deleted
+    """
+    retention_days = settings.TENANT_JOB_RUNS_RETENTION_DAYS if retention_days is None else retention_days
+    last_successful_runs = (
+        TenantJobRun.objects.filter(job=job, succeeded=True).order_by('tenant', '-started').distinct('tenant').values('id')
+    )
+    deleted, _ = (
+        TenantJobRun.objects.filter(job=job, started__lt=timezone.now() - timedelta(days=retention_days))
+        .exclude(id__in=last_successful_runs)
+        .delete()
+    )
+    return deleted
+
+
+def run_on_schemas(job, schema_names, since, time_budget=None):
+    """ Runs the job on the tenants one at a time, skipping those that already ran it successfully since the run started
+
+    Returns:
+        the schema names that were not run because the time budget was used up
+    """
+    time_budget = settings.TENANT_JOBS_TIME_BUDGET if time_budget is None else time_budget
+    func = import_string(job)
+    done = set(
+        TenantJobRun.objects.filter(job=job, started__gte=since, succeeded=True).values_list('tenant__schema_name', flat=True)
+    )
+
+    tenants = get_tenants_in_order(schema_names)
+    deadline = time.monotonic() + time_budget
+    num_run = 0
+    for i, tenant in enumerate(tenants):
+        if tenant.schema_name in done:
+            continue
+        # at least one tenant is run by each task, so a run always makes progress
+        if num_run and time.monotonic() > deadline:
+            return [tenant.schema_name for tenant in tenants[i:]]
+        run_on_schema(job, func, tenant)
+        num_run += 1
+    return []
+
+
+def get_tenants_in_order(schema_names):
+    tenants = get_tenant_model().objects.in_bulk(schema_names, field_name='schema_name')
+    return [tenants[schema_name] for schema_name in schema_names if schema_name in tenants]
+
+
+def run_on_schema(job, func, tenant):
+    """ Runs the job on the tenant and records how long it took.  A failure is logged instead of stopping the other tenants """
+    started = timezone.now()
+    start = time.perf_counter()
+    rows, succeeded = 0, True
+    try:
+        with tenant_context(tenant):
+            rows = func() or 0
+    except Exception:
+        succeeded = False
+        logger.exception(f"{job} failed on {tenant.schema_name}")
+
+    duration = time.perf_counter() - start
+    TenantJobRun.objects.create(tenant=tenant, job=job, started=started, duration=duration, rows=rows, succeeded=succeeded)
+    logger.info(f"{job} on {tenant.schema_name}: {rows} rows in {duration:.1f}s")
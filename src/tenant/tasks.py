@@ -5,6 +5,9 @@ from django.template.loader import get_template
 from hackerspace_online.celery import app
 from utilities.html import textify
 
+from .models import Tenant
+from .scheduler import run_on_all_schemas, run_on_schemas
+
 
 @app.task(name="tenant.tasks.send_email_message")
 def send_email_message(subject, message, recipient_list, **kwargs):
@@ -24,3 +27,38 @@ def send_email_message(subject, message, recipient_list, **kwargs):
     )
     email.attach_alternative(msg, "text/html")
     email.send()
+
+
+@app.task(name="tenant.tasks.run_job_on_schemas")
+def run_job_on_schemas(job, schema_names, since):
+    """
+    Runs the job on each of the tenants in turn, see tenant.scheduler.run_on_all_schemas()
+    If the time budget is used up, the remaining tenants are continued in a new task.
+    """
+    remaining = run_on_schemas(job, schema_names, since)
+    if remaining:
+        run_job_on_schemas.apply_async(args=[job, remaining, since], queue=settings.TENANT_JOBS_QUEUE)
+        return f"Ran {job} on {len(schema_names) - len(remaining)} schemas, continuing with {len(remaining)} in a new task"
+
+    return f"Ran {job} on {len(schema_names)} schemas"
+
+
+@app.task(name="tenant.tasks.update_cached_fields_in_all_schemas")
+def update_cached_fields_in_all_schemas():
+    """
+    Dispatcher task that runs update_cached_fields() on each schema, see tenant.scheduler
+    """
+    num_tasks = run_on_all_schemas('tenant.tasks.update_cached_fields')
+
+    return f"Scheduled update_cached_fields for all schemas in {num_tasks} tasks"
+
+
+def update_cached_fields():
+    """
+    Updates the cached fields of the current tenant, which are displayed in the public admin's list of tenants
+
+    :return: the tenant's total number of users
+    """
+    tenant = Tenant.get()
+    tenant.update_cached_fields()
+    return tenant.total_user_count
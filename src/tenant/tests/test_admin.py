@@ -148,6 +148,11 @@ class PublicTenantTestAdminPublic(TenantTestCase):
                 email_address.verified = True
                 email_address.save()
 
+        # the cached fields displayed in the list are updated by a background task, see TenantAdmin.refresh_cached_fields
+        for tenant in (self.tenant, self.extra_tenant):
+            with tenant_context(tenant):
+                tenant.update_cached_fields()
+
         self.client = TenantClient(self.public_tenant)
 
     def test_owner_full_name_text_column(self):
@@ -277,6 +282,28 @@ class PublicTenantTestAdminPublic(TenantTestCase):
         # confirm the search returned zero objects (by full name)
         self.assertContains(response, "0 result")
 
+    def test_changelist_does_not_update_cached_fields(self):
+        """ The list only displays the cached fields, which can be out of date until they're refreshed """
+        with tenant_context(self.extra_tenant):
+            config = SiteConfig.get()
+            config.deck_owner.first_name = "Taylor"
+            config.deck_owner.last_name = "Swift"
+            config.deck_owner.save()
+
+        self.client.force_login(self.superuser)
+        changelist_url = reverse("admin:{}_{}_changelist".format("tenant", "tenant"))
+        response = self.client.get(changelist_url)
+        self.assertContains(response, "John Doe")
+        self.assertNotContains(response, "Taylor Swift")
+
+        response = self.client.post(changelist_url, {
+            "action": "refresh_cached_fields",
+            ACTION_CHECKBOX_NAME: [self.extra_tenant.pk],
+        }, follow=True)
+        self.assertContains(response, "1 tenant&#x27;s cached fields were refreshed successfully")
+        self.assertContains(response, "Taylor Swift")
+        self.assertNotContains(response, "John Doe")
+
     @patch("tenant.admin.messages.add_message")
     def test_enable_google_signin_admin_without_config(self, mock_add_message):
         """
@@ -66,6 +66,14 @@ class TenantModelTest(TenantTestCase):
         # should still return the staff user's last log in, ignoring the admin user
         self.assertEqual(self.tenant.last_staff_login, staff.last_login)
 
+    def test_update_cached_fields__timestamp(self):
+        self.tenant.cached_fields_updated = None
+        self.tenant.update_cached_fields()
+
+        self.tenant.refresh_from_db()
+        self.assertIsNotNone(self.tenant.cached_fields_updated)
+        self.assertEqual(self.tenant.total_user_count, User.objects.count())
+
 
 class CheckTenantNameTest(SimpleTestCase):
     """ A tenant's name is used for both the schema_name and as the subdomain in the
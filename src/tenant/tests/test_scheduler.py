@@ -0,0 +1,100 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.utils import timezone
+from django_tenants.test.cases import TenantTestCase
+
+from tenant import scheduler
+from tenant.models import Tenant, TenantJobRun
+
+JOB = 'tenant.tests.test_scheduler.schema_name_length_job'
+FAILING_JOB = 'tenant.tests.test_scheduler.failing_job'
+
+
+def schema_name_length_job():
+    return len(connection.schema_name)
+
+
+def failing_job():
+    raise ValueError
+
+
+class SchedulerTest(TenantTestCase):
+
+    def test_split_tenants__without_previous_runs(self):
+        """ Tenants that haven't run the job yet are spread evenly """
+        shards = scheduler.split_tenants(JOB, ['a', 'b', 'c', 'd', 'e'], 2)
+        self.assertEqual(sorted(len(shard) for shard in shards), [2, 3])
+        self.assertCountEqual(sum(shards, []), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_split_tenants__balanced_by_last_duration(self):
+        """ A tenant that took as long as all the others gets a task to itself """
+        # bulk_create skips the signals that would create each tenant's schema
+        others = Tenant.objects.bulk_create([Tenant(schema_name=name, name=name) for name in ['a', 'b', 'c']])
+        for tenant in others:
+            TenantJobRun.objects.create(tenant=tenant, job=JOB, started=timezone.now() - timedelta(days=1), duration=1)
+        TenantJobRun.objects.create(tenant=self.tenant, job=JOB, started=timezone.now() - timedelta(days=2), duration=1)
+        TenantJobRun.objects.create(tenant=self.tenant, job=JOB, started=timezone.now() - timedelta(days=1), duration=3)
+
+        shards = scheduler.split_tenants(JOB, ['a', 'b', 'c', self.tenant.schema_name], 2)
+        self.assertCountEqual(shards, [[self.tenant.schema_name], ['a', 'b', 'c']])
+
+    def test_split_tenants__fewer_tenants_than_shards(self):
+        self.assertEqual(scheduler.split_tenants(JOB, ['a'], 3), [['a']])
+
+    def test_run_on_schemas(self):
+        since = timezone.now()
+        remaining = scheduler.run_on_schemas(JOB, [self.tenant.schema_name], since)
+
+        self.assertEqual(remaining, [])
+        run = TenantJobRun.objects.get(job=JOB)
+        self.assertEqual(run.tenant, self.tenant)
+        self.assertEqual(run.rows, len(self.tenant.schema_name))
+        self.assertTrue(run.succeeded)
+
+        # already done since the run started, e.g. the task was restarted
+        scheduler.run_on_schemas(JOB, [self.tenant.schema_name], since)
+        self.assertEqual(TenantJobRun.objects.filter(job=JOB).count(), 1)
+
+    def test_run_on_schemas__time_budget_used_up(self):
+        """ The first tenant is always run, the rest are returned to be continued in another task """
+        with patch('tenant.scheduler.get_tenants_in_order', return_value=[self.tenant, self.tenant]):
+            remaining = scheduler.run_on_schemas(JOB, [self.tenant.schema_name] * 2, timezone.now(), time_budget=-1)
+
+        self.assertEqual(remaining, [self.tenant.schema_name])
+        self.assertEqual(TenantJobRun.objects.filter(job=JOB).count(), 1)
+
+    def test_run_on_schemas__failure(self):
+        """ A failing tenant is recorded and doesn't stop the others """
+        with patch('tenant.scheduler.get_tenants_in_order', return_value=[self.tenant, self.tenant]):
+            remaining = scheduler.run_on_schemas(FAILING_JOB, [self.tenant.schema_name] * 2, timezone.now())
+
+        self.assertEqual(remaining, [])
+        self.assertEqual(TenantJobRun.objects.filter(job=FAILING_JOB, succeeded=False).count(), 2)
+        self.assertEqual(connection.schema_name, self.tenant.schema_name)
+
+    @patch('tenant.tasks.run_job_on_schemas.apply_async')
+    def test_run_on_all_schemas(self, task):
+        num_tasks = scheduler.run_on_all_schemas(JOB, concurrency=4)
+
+        self.assertEqual(num_tasks, task.call_count)
+        schema_names = sum((call.kwargs['args'][1] for call in task.call_args_list), [])
+        self.assertIn(self.tenant.schema_name, schema_names)
+        self.assertNotIn('public', schema_names)
+
+    def test_prune_job_runs(self):
+        """ Old runs are deleted, except the last successful one """
+        def make_run(days_ago, succeeded=True, job=JOB):
+            return TenantJobRun.objects.create(
+                tenant=self.tenant, job=job, started=timezone.now() - timedelta(days=days_ago), duration=1, succeeded=succeeded,
+            )
+
+        make_run(40)
+        last_successful = make_run(35)
+        make_run(32, succeeded=False)
+        recent = make_run(1, succeeded=False)
+        other_job = make_run(40, job=FAILING_JOB)
+
+        self.assertEqual(scheduler.prune_job_runs(JOB, retention_days=30), 2)
+        self.assertCountEqual(TenantJobRun.objects.all(), [last_successful, recent, other_job])
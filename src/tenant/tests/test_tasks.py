@@ -2,6 +2,7 @@ from django.core import mail
 
 from django_tenants.test.cases import TenantTestCase
 
+from quest_manager.models import Quest
 from tenant import tasks
 
 
@@ -29,3 +30,14 @@ class TenantTasksTests(TenantTestCase):
         self.assertEqual(mail.outbox[0].subject, "O hi, World!")
         # john doe was first in a list of recipients (BCC)
         self.assertIn("john@doe.com", mail.outbox[0].bcc)
+
+    def test_update_cached_fields(self):
+        """ Updates the cached fields of the current tenant, and returns its number of users """
+        self.tenant.quest_count = 999
+        self.tenant.save()
+
+        num_users = tasks.update_cached_fields()
+
+        self.tenant.refresh_from_db()
+        self.assertEqual(num_users, self.tenant.total_user_count)
+        self.assertEqual(self.tenant.quest_count, Quest.objects.filter(archived=False).count())